@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+
+from . import handlers, harness
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmark the custom resource handlers with a fake Device Farm.')
+    parser.add_argument('--output', help='where to write the results, defaults to .benchmarks/<commit>.json')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='fail when a benchmark is slower than the baseline by this factor (default: 1.25)')
+    parser.add_argument('--min-delta', type=float, default=0.25,
+                        help='ignore differences smaller than this, in ms or bytes (default: 0.25)')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for a smoke test')
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        benchmarks = handlers.run(iterations=10, import_iterations=1, curated_pool_counts=[1, 100])
+    else:
+        benchmarks = handlers.run()
+    document = harness.results_document(benchmarks)
+    output = args.output or os.path.join('.benchmarks', f'{document["commit"] or "results"}.json')
+    harness.save(output, document)
+
+    baseline = harness.load(args.compare) if args.compare else None
+    harness.report(document, baseline)
+    print(f'Results written to {output}')
+    if baseline is None:
+        return 0
+
+    regressions = harness.compare(baseline, document, threshold=args.threshold, min_delta=args.min_delta)
+    for regression in regressions:
+        print(f'REGRESSION {regression.name}: {regression.baseline:.4f} -> {regression.current:.4f} '
+              f'({regression.ratio:.2f}x)', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import contextlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+from typing import Callable, Dict, Iterator, List
+
+from device_farm import device_pool_resource, idempotency, project_resource, rate_limit
+from device_farm_testing import fakes
+
+from . import harness
+
+RULES = [
+    {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+    {'attribute': 'OS_VERSION', 'operator': 'GREATER_THAN_OR_EQUALS', 'value': '"9"'},
+    {'attribute': 'FORM_FACTOR', 'operator': 'IN', 'value': '["PHONE", "TABLET"]'},
+]
+
+COLD_IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import device_farm.project_resource, device_farm.device_pool_resource
+print((time.perf_counter() - start) * 1000)
+'''
+
+
+class FakeContext:
+    log_stream_name = '2021/01/01/[$LATEST]0123456789abcdef0123456789abcdef'
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:device-farm-resources'
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 60000
+
+
+@contextlib.contextmanager
+def fake_environment(device_farm: fakes.FakeDeviceFarm) -> Iterator[None]:
+    # shared state as in a warm Lambda container, with fakes for Device Farm and CloudFormation.
+    # The fakes keep what the handlers create and answer, which counts towards the retained bytes.
+    with fakes.installed(device_farm, fakes.FakeCloudFormation()):
+        idempotency.set_store(idempotency.LocalIdempotencyStore())
+        # measure the handlers, not the pacing of the rate limiter
+        rate_limit.set_limiter(rate_limit.RateLimiter(rates={}, default_rate=1e9))
+        project_resource.curated_pool_cache.clear()
+        try:
+            with harness.quiet():
+                yield
+        finally:
+            idempotency.set_store(None)
+            rate_limit.set_limiter(None)
+            project_resource.curated_pool_cache.clear()
+
+
+_request_ids = itertools.count()
+
+
+def event(request_type: str, properties: dict, old_properties: dict = None, physical_resource_id: str = None) -> dict:
+    result = {
+        'RequestType': request_type,
+        'ServiceToken': FakeContext.invoked_function_arn,
+        'ResponseURL': 'https://cloudformation-custom-resource-response-uswest2.s3-us-west-2.amazonaws.com/x',
+        'StackId': 'arn:aws:cloudformation:us-west-2:123456789012:stack/benchmark/guid',
+        # every event is new, redelivered events would be answered from the idempotency store
+        'RequestId': f'request-{next(_request_ids)}',
+        'LogicalResourceId': 'Benchmark',
+        'ResourceType': 'Custom::Benchmark',
+        'ResourceProperties': dict(properties, ServiceToken=FakeContext.invoked_function_arn),
+    }
+    if old_properties is not None:
+        result['OldResourceProperties'] = dict(old_properties, ServiceToken=FakeContext.invoked_function_arn)
+    if physical_resource_id is not None:
+        result['PhysicalResourceId'] = physical_resource_id
+    return result
+
+
+def curated_pool_names(count: int) -> List[str]:
+    return ['Top Devices' if index == 0 else f'Curated Pool {index}' for index in range(count)]
+
+
+def project_events(device_farm: fakes.FakeDeviceFarm) -> Dict[str, Callable[[], dict]]:
+    # every Delete gets a project of its own, the fake answers a second Delete with NotFoundException
+    properties = {'ProjectName': 'benchmark'}
+
+    def create_project() -> str:
+        return device_farm.create_project(name='benchmark')['project']['arn']
+
+    project_arn = create_project()
+    return {
+        'Create': lambda: event('Create', properties),
+        'Update': lambda: event('Update', {'ProjectName': 'renamed'}, properties, project_arn),
+        'UpdateUnchanged': lambda: event('Update', properties, properties, project_arn),
+        'Delete': lambda: event('Delete', properties, physical_resource_id=create_project()),
+    }
+
+
+def device_pool_events(device_farm: fakes.FakeDeviceFarm) -> Dict[str, Callable[[], dict]]:
+    project_arn = device_farm.create_project(name='benchmark')['project']['arn']
+    properties = {'ProjectArn': project_arn, 'Name': 'benchmark', 'Rules': RULES, 'MaxDevices': 5}
+    changed = dict(properties, Rules=RULES[:2])
+
+    def create_device_pool() -> str:
+        return device_farm.create_device_pool(projectArn=project_arn, name='benchmark', rules=RULES,
+                                              maxDevices=5)['devicePool']['arn']
+
+    device_pool_arn = create_device_pool()
+    return {
+        'Create': lambda: event('Create', properties),
+        'Update': lambda: event('Update', changed, properties, device_pool_arn),
+        'UpdateUnchanged': lambda: event('Update', properties, properties, device_pool_arn),
+        'Delete': lambda: event('Delete', properties, physical_resource_id=create_device_pool()),
+        'Invalid': lambda: event('Create', dict(properties, Rules=[{'attribute': 'PLATFORM'}])),
+    }
+
+
+def cold_import(iterations: int) -> dict:
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env.pop('DEVICE_FARM_EAGER_IMPORTS', None)
+    samples = [float(subprocess.check_output([sys.executable, '-c', COLD_IMPORT_SCRIPT], cwd=cwd, env=env))
+               for _ in range(iterations)]
+    return harness.summarize(samples).to_dict()
+
+
+def run(iterations: int = 200, import_iterations: int = 5,
+        curated_pool_counts: List[int] = (1, 10, 100, 1000)) -> Dict[str, dict]:
+    results = {'cold_import': cold_import(import_iterations)}
+    context = FakeContext()
+    device_farm = fakes.FakeDeviceFarm(curated_pool_names=curated_pool_names(10))
+
+    handlers = [('project', project_resource.lambda_handler, project_events(device_farm)),
+                ('device_pool', device_pool_resource.lambda_handler, device_pool_events(device_farm))]
+    with fake_environment(device_farm):
+        for resource_name, handler, events in handlers:
+            for request_type, make_event in events.items():
+                name = f'{resource_name}.{request_type}'
+                results[name] = harness.measure(lambda: handler(make_event(), context), iterations).to_dict()
+                results[name + '.allocations'] = harness.measure_allocations(
+                    lambda: handler(make_event(), context)).to_dict()
+
+        # a cold curated pool cache lists all curated pools on every Create
+        for count in curated_pool_counts:
+            # the fake lists these for the projects created from now on
+            device_farm.curated_pool_names = curated_pool_names(count)
+
+            def create_project():
+                project_resource.curated_pool_cache.clear()
+                project_resource.lambda_handler(event('Create', {'ProjectName': 'benchmark'}), context)
+
+            results[f'project.Create.curated_pools.{count}'] = harness.measure(
+                create_project, max(10, iterations // 10)).to_dict()
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(iterations=20, import_iterations=1), indent=2))
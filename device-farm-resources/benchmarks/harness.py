@@ -0,0 +1,168 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+RESULTS_VERSION = 1
+
+
+class Timing(NamedTuple):
+    iterations: int
+    min: float
+    median: float
+    mean: float
+    p95: float
+
+    def to_dict(self) -> dict:
+        return dict(self._asdict(), unit='ms')
+
+
+class Allocations(NamedTuple):
+    peak_bytes: int
+    retained_bytes: int
+
+    def to_dict(self) -> dict:
+        return dict(self._asdict(), unit='bytes')
+
+
+class Regression(NamedTuple):
+    name: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float('inf')
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    # the handlers print and log every request, which would dominate the measurements
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            yield
+    finally:
+        root.setLevel(level)
+
+
+def measure(function: Callable[[], object], iterations: int, warmup: int = 3) -> Timing:
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+
+def summarize(samples: List[float]) -> Timing:
+    ordered = sorted(samples)
+    return Timing(
+        iterations=len(ordered),
+        min=round(ordered[0], 4),
+        median=round(statistics.median(ordered), 4),
+        mean=round(statistics.mean(ordered), 4),
+        p95=round(percentile(ordered, 0.95), 4),
+    )
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    # nearest rank of sorted samples
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure_allocations(function: Callable[[], object], warmup: int = 3) -> Allocations:
+    # one call after warming up, so caches and lazily created clients are not counted
+    for _ in range(warmup):
+        function()
+    tracemalloc.start()
+    try:
+        function()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Allocations(peak_bytes=peak, retained_bytes=retained)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('utf-8').strip()
+
+
+def results_document(benchmarks: Dict[str, dict]) -> dict:
+    return {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': benchmarks,
+    }
+
+
+def save(path: str, document: dict) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def load(path: str) -> dict:
+    with open(path, 'r') as f:
+        document = json.load(f)
+    if document.get('version') != RESULTS_VERSION:
+        raise ValueError(f'{path} is not a benchmark results file')
+    return document
+
+
+def _value(result: dict) -> Optional[float]:
+    # timings are compared by their median, allocations by their peak
+    for key in ('median', 'peak_bytes', 'value'):
+        if key in result:
+            return result[key]
+    return None
+
+
+def compare(baseline: dict, current: dict, threshold: float = 1.25, min_delta: float = 0.25) -> List[Regression]:
+    # a benchmark regressed when it got slower (or bigger) by more than threshold and by more than min_delta,
+    # which keeps the jitter of sub-millisecond timings from failing the comparison
+    regressions = []
+    for name, result in sorted(current['benchmarks'].items()):
+        baseline_result = baseline['benchmarks'].get(name)
+        if baseline_result is None:
+            continue
+        baseline_value = _value(baseline_result)
+        current_value = _value(result)
+        if baseline_value is None or current_value is None:
+            continue
+        if current_value > baseline_value * threshold and current_value - baseline_value > min_delta:
+            regressions.append(Regression(name=name, baseline=baseline_value, current=current_value))
+    return regressions
+
+
+def report(document: dict, baseline: Optional[dict] = None, output=sys.stdout) -> None:
+    for name, result in sorted(document['benchmarks'].items()):
+        value = _value(result)
+        line = f'{name:<45} {value:>14.4f} {result.get("unit", "")}'
+        baseline_result = baseline['benchmarks'].get(name) if baseline else None
+        if baseline_result is not None and _value(baseline_result):
+            line += f'  ({value / _value(baseline_result):.2f}x baseline)'
+        output.write(line + '\n')
@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import re
+import sys
+import time
+from multiprocessing.managers import BaseManager
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from device_farm import clients, cloudformation, device_pool_resource, idempotency, project_resource, rate_limit
+from device_farm_testing import fakes
+
+from . import handlers, harness
+
+RULES = handlers.RULES[:1]
+DEFAULT_FAULTS = fakes.Faults(latency=0.01, jitter=0.01, max_rate=20)
+
+# the features a replay can turn off, to show what each of them is worth
+SCENARIOS = {
+    'all features': {},
+    'no client reuse': {'client_reuse': False},
+    'no curated pool cache': {'cache': False},
+    'no rate limiting': {'client_rate': None},
+}
+
+
+class Outcome(NamedTuple):
+    operation: str
+    latency: float
+    status: str
+    error: Optional[str]
+
+
+def error_code(reason: str) -> str:
+    # e.g. An error occurred (ThrottlingException) when calling the create_project operation
+    match = re.search(r'\((\w+)\)', reason or '')
+    return match.group(1) if match else 'Other'
+
+
+class SharedDeviceFarm(fakes.FakeDeviceFarm):
+    # the one Device Farm all containers call, its throttling sees their combined rate
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            'calls': sum(self.calls.values()),
+            'throttled': sum(self.throttled.values()),
+            'failed': sum(self.failed.values()),
+            'projects': len(self.projects),
+        }
+
+
+class ServiceManager(BaseManager):
+    pass
+
+
+ServiceManager.register('DeviceFarm', SharedDeviceFarm)
+
+
+class ServiceClient:
+    # The Device Farm client of a container, calls go to the shared fake in the manager process.
+    # Paginators run in the container and fetch page by page, like botocore's.
+
+    def __init__(self, service):
+        self._service = service
+
+    def get_paginator(self, operation_name: str) -> fakes.FakePaginator:
+        return fakes.FakePaginator(getattr(self._service, operation_name))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._service, name)
+
+
+class Replay:
+    # Runs the events of one stack after the other, like CloudFormation does for the
+    # resources of a stack. Each container replays one stack at a time.
+
+    def __init__(self, cloud_formation: fakes.FakeCloudFormation, client_reuse: bool = True, cache: bool = True):
+        self.cloud_formation = cloud_formation
+        self.client_reuse = client_reuse
+        self.cache = cache
+        self.context = handlers.FakeContext()
+
+    def send(self, operation: str, handler: Callable[[dict, object], object], event: dict) -> Tuple[Outcome, dict]:
+        # a cold container has neither clients nor cached curated pools
+        if not self.client_reuse:
+            clients.reset()
+        if not self.cache:
+            project_resource.curated_pool_cache.clear()
+        start = time.perf_counter()
+        handler(event, self.context)
+        latency = (time.perf_counter() - start) * 1000
+        response = self.cloud_formation.response_for(event['RequestId'])
+        if response is None:
+            return Outcome(operation, latency, 'NoResponse', 'NoResponse'), {}
+        error = error_code(response.get('Reason')) if response['Status'] == 'FAILED' else None
+        return Outcome(operation, latency, response['Status'], error), response
+
+    def stack(self, index: int) -> List[Outcome]:
+        outcomes = []
+
+        def send(operation, handler, event):
+            outcome, response = self.send(operation, handler, event)
+            outcomes.append(outcome)
+            return response.get('PhysicalResourceId') if outcome.status == 'SUCCESS' else None
+
+        project = {'ProjectName': f'stack-{index}'}
+        project_arn = send('project.Create', project_resource.lambda_handler, handlers.event('Create', project))
+        if project_arn is None:
+            return outcomes
+        pool = {'ProjectArn': project_arn, 'Name': f'pool-{index}', 'Rules': RULES}
+        pool_arn = send('device_pool.Create', device_pool_resource.lambda_handler, handlers.event('Create', pool))
+        if pool_arn is not None:
+            send('device_pool.Update', device_pool_resource.lambda_handler,
+                 handlers.event('Update', dict(pool, MaxDevices=2), pool, pool_arn))
+        renamed = {'ProjectName': f'stack-{index}-renamed'}
+        send('project.Update', project_resource.lambda_handler,
+             handlers.event('Update', renamed, project, project_arn))
+        if pool_arn is not None:
+            send('device_pool.Delete', device_pool_resource.lambda_handler,
+                 handlers.event('Delete', pool, physical_resource_id=pool_arn))
+        send('project.Delete', project_resource.lambda_handler,
+             handlers.event('Delete', renamed, physical_resource_id=project_arn))
+        return outcomes
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    ordered = sorted(latencies)
+    if not ordered:
+        return {'count': 0}
+    return {
+        'count': len(ordered),
+        'p50': round(harness.percentile(ordered, 0.5), 3),
+        'p95': round(harness.percentile(ordered, 0.95), 3),
+        'p99': round(harness.percentile(ordered, 0.99), 3),
+        'max': round(ordered[-1], 3),
+    }
+
+
+def count_errors(outcomes: List[Outcome]) -> Dict[str, int]:
+    errors = {}  # type: Dict[str, int]
+    for outcome in outcomes:
+        if outcome.error is not None:
+            errors[outcome.error] = errors.get(outcome.error, 0) + 1
+    return errors
+
+
+_replay = None  # type: Optional[Replay]
+_container_context = contextlib.ExitStack()
+
+
+def start_container(service, client_reuse: bool, cache: bool, client_rate: Optional[float],
+                    client_latency: float, response_latency: float) -> None:
+    # Every simulated Lambda container is a process of its own, with its own clients, rate limiter,
+    # deadline, metrics, idempotency store and curated pool cache, like the containers of a function.
+    global _replay
+    import boto3
+    create_client = boto3.client
+    device_farm = ServiceClient(service)
+
+    def client(service_name, *args, **kwargs):
+        if service_name == 'devicefarm':
+            if client_latency > 0:
+                time.sleep(client_latency)
+            return device_farm
+        return create_client(service_name, *args, **kwargs)
+
+    boto3.client = client
+    cloud_formation = fakes.FakeCloudFormation(latency=response_latency)
+    cloud_formation.mount(cloudformation.get_transport().session)
+    idempotency.set_store(idempotency.LocalIdempotencyStore())
+    rate_limit.set_limiter(rate_limit.RateLimiter(rates={}, default_rate=client_rate or 1e9))
+    # the container lives as long as the process, so does the quiet logging
+    _container_context.enter_context(harness.quiet())
+    _replay = Replay(cloud_formation, client_reuse=client_reuse, cache=cache)
+
+
+CONTAINER_STATS = ('throttles', 'wait_time', 'hits', 'misses')
+
+
+def container_stats() -> Dict[str, float]:
+    limiter_stats = rate_limit.stats().values()
+    cache_stats = project_resource.curated_pool_cache.stats()
+    return {
+        'throttles': sum(stats.throttles for stats in limiter_stats),
+        'wait_time': sum(stats.wait_time for stats in limiter_stats),
+        'hits': cache_stats.hits,
+        'misses': cache_stats.misses,
+    }
+
+
+def replay_stack(index: int) -> Tuple[List[Outcome], Dict[str, float]]:
+    # runs in a container, returns the outcomes and what the stack added to the container stats
+    before = container_stats()
+    outcomes = _replay.stack(index)
+    after = container_stats()
+    return outcomes, {key: after[key] - before[key] for key in after}
+
+
+def run(stacks: int = 200, concurrency: int = 32, faults: fakes.Faults = DEFAULT_FAULTS,
+        operation_faults: Optional[Dict[str, fakes.Faults]] = None, client_reuse: bool = True, cache: bool = True,
+        client_rate: Optional[float] = 10, client_latency: float = 0.05, response_latency: float = 0.005) -> dict:
+    # concurrency is the number of containers. client_rate is what the rate limiter of each container
+    # allows per operation, None turns it off. The duration includes the cold starts of the containers.
+    context = multiprocessing.get_context('spawn')
+    with ServiceManager(ctx=context) as manager:
+        service = manager.DeviceFarm(faults=faults, operation_faults=operation_faults)
+        start = time.perf_counter()
+        initargs = (service, client_reuse, cache, client_rate, client_latency, response_latency)
+        with context.Pool(processes=concurrency, initializer=start_container, initargs=initargs) as pool:
+            # a stack at a time, to whichever container is free
+            replayed = pool.map(replay_stack, range(stacks), chunksize=1)
+        duration = time.perf_counter() - start
+        service_counters = service.counters()
+
+    outcomes = [outcome for stack_outcomes, _ in replayed for outcome in stack_outcomes]
+    stats = {key: sum(stack_stats[key] for _, stack_stats in replayed) for key in CONTAINER_STATS}
+    operations = {}
+    for operation in sorted({outcome.operation for outcome in outcomes}):
+        selected = [outcome for outcome in outcomes if outcome.operation == operation]
+        operations[operation] = dict(latency_summary([outcome.latency for outcome in selected]),
+                                     errors=count_errors(selected))
+    return {
+        'config': {
+            'stacks': stacks,
+            'concurrency': concurrency,
+            'client_reuse': client_reuse,
+            'cache': cache,
+            'client_rate': client_rate,
+            'service': faults._asdict(),
+        },
+        'duration': round(duration, 3),
+        'events': len(outcomes),
+        'throughput': round(len(outcomes) / duration, 2) if duration else None,
+        'latency': latency_summary([outcome.latency for outcome in outcomes]),
+        'errors': count_errors(outcomes),
+        'operations': operations,
+        'service': service_counters,
+        'rate_limiter': {
+            'throttles': int(stats['throttles']),
+            'wait_time': round(stats['wait_time'], 3),
+        },
+        'curated_pool_cache': {'hits': int(stats['hits']), 'misses': int(stats['misses'])},
+    }
+
+
+def report(name: str, result: dict, output=sys.stdout) -> None:
+    latency = result['latency']
+    errors = ', '.join(f'{code}: {count}' for code, count in sorted(result['errors'].items())) or 'none'
+    output.write(f'{name:<24} {result["events"]:>6} events {result["throughput"]:>8.1f}/s  '
+                 f'p50 {latency["p50"]:>8.2f}ms  p95 {latency["p95"]:>8.2f}ms  p99 {latency["p99"]:>8.2f}ms  '
+                 f'throttled {result["service"]["throttled"]:>5}  errors {errors}\n')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load',
+                                     description='Replay concurrent stack deployments against a fake Device Farm.')
+    parser.add_argument('--stacks', type=int, default=200, help='stacks to deploy, 6 events each (default: 200)')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='Lambda containers, one process each, deploying a stack at a time (default: 32)')
+    parser.add_argument('--latency', type=float, default=0.01, help='Device Farm latency in seconds (default: 0.01)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of calls throttled at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of calls failing with a server error')
+    parser.add_argument('--service-rate', type=float, default=20,
+                        help='calls per second and operation before Device Farm throttles (default: 20)')
+    # every container has a rate limiter of its own, the service sees up to --concurrency times this rate
+    parser.add_argument('--client-rate', type=float, default=10,
+                        help='calls per second and operation the rate limiter of a container allows (default: 10)')
+    parser.add_argument('--scenarios', action='store_true',
+                        help='also replay with client reuse, caching and rate limiting turned off')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args(argv)
+
+    faults = fakes.Faults(latency=args.latency, jitter=args.latency, error_rate=args.error_rate,
+                          throttle_rate=args.throttle_rate, max_rate=args.service_rate)
+    results = {}
+    for name, options in (SCENARIOS.items() if args.scenarios else [('all features', {})]):
+        options = dict({'client_rate': args.client_rate}, **options)
+        results[name] = run(args.stacks, args.concurrency, faults=faults, **options)
+        report(name, results[name])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import pytest
+
+from device_farm import (artifacts, clients, cloudformation, continuation, deadline, idempotency, metrics,
+                         project_resource, rate_limit, upload)
+
+
+def _reset_shared_state():
+    clients.reset()
+    cloudformation.reset_transport()
+    deadline.reset()
+    continuation.set_invoker(None)
+    rate_limit.set_limiter(None)
+    metrics.reset()
+    project_resource.curated_pool_cache.clear()
+    idempotency.set_store(None)
+    upload.reset_session()
+    upload.upload_index.clear()
+    artifacts.reset_session()
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_state():
+    _reset_shared_state()
+    yield
+    _reset_shared_state()
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
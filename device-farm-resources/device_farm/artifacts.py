@@ -0,0 +1,241 @@
+import concurrent.futures
+import logging
+import os
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Collection, List, NamedTuple, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import clients, deadline, metrics, structured_log
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+# the categories list_artifacts takes, videos are FILE artifacts of type VIDEO
+ARTIFACT_CATEGORIES = ('FILE', 'LOG', 'SCREENSHOT')
+# held in memory per download, so the memory ceiling is max_concurrency * CHUNK_SIZE
+CHUNK_SIZE = 1024 * 1024
+# bytes per ranged GET, a dropped connection costs at most the rest of a part
+PART_SIZE = 16 * 1024 * 1024
+MAX_CONCURRENCY = 8
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+PARTIAL_SUFFIX = '.part'
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+UNSATISFIED_RANGE_PATTERN = re.compile(r'^bytes \*/(\d+)$')
+UNSAFE_CHARACTERS = re.compile(r'[^\w.-]+')
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _RetryableError(DownloadError):
+    pass
+
+
+class Artifact(NamedTuple):
+    arn: str
+    name: str
+    type: str
+    extension: str
+    url: str
+    job_arn: str
+    device: Optional[str] = None
+
+    @property
+    def path(self) -> str:
+        # relative to the download directory, e.g. Google_Pixel_4-00001/Logcat-00002-00000.logcat
+        job_id = self.job_arn.split('/')[-1]
+        directory = f'{_safe_name(self.device)}-{job_id}' if self.device else job_id
+        # artifacts of different suites and tests share names, the ARN below the job tells them apart
+        artifact_id = '-'.join(self.arn.split(':')[-1].split('/')[3:]) or self.arn.split('/')[-1]
+        name = f'{_safe_name(self.name)}-{artifact_id}'
+        return os.path.join(directory, f'{name}.{self.extension}' if self.extension else name)
+
+
+class DownloadResult(NamedTuple):
+    artifact: Artifact
+    path: str
+    size: int
+    resumed_from: int
+    seconds: float
+    skipped: bool = False
+
+
+_session_lock = threading.Lock()
+_session = None  # type: Optional[requests.Session]
+
+
+def get_session() -> requests.Session:
+    # one connection per download thread, kept between the downloads
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENCY)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def reset_session() -> None:
+    global _session
+    with _session_lock:
+        _session = None
+
+
+def download_run_artifacts(run_arn: str, directory: str, client: Optional['BaseClient'] = None,
+                           categories: Collection[str] = ARTIFACT_CATEGORIES, types: Optional[Collection[str]] = None,
+                           exclude_types: Collection[str] = (), max_concurrency: int = MAX_CONCURRENCY,
+                           **kwargs) -> List[DownloadResult]:
+    # e.g. download_run_artifacts(run_arn, 'artifacts', exclude_types={'VIDEO'}) for logs and screenshots.
+    # Downloaded artifacts are skipped and interrupted ones resumed when called again.
+    with metrics.span('ArtifactDownload'):
+        found = list_artifacts(run_arn, client, categories, types, exclude_types, max_concurrency)
+        return download_artifacts(found, directory, max_concurrency, **kwargs)
+
+
+def list_artifacts(run_arn: str, client: Optional['BaseClient'] = None,
+                   categories: Collection[str] = ARTIFACT_CATEGORIES, types: Optional[Collection[str]] = None,
+                   exclude_types: Collection[str] = (), max_concurrency: int = MAX_CONCURRENCY) -> List[Artifact]:
+    # the artifacts of each job, with those of its suites and tests, listed concurrently
+    client = client or clients.get_device_farm_client()
+    jobs = _list(client, 'list_jobs', 'jobs', arn=run_arn)
+    listings = [(job, category) for job in jobs for category in categories]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pages = executor.map(deadline.bound(lambda listing: _list(client, 'list_artifacts', 'artifacts',
+                                                                  arn=listing[0]['arn'], type=listing[1])),
+                             listings)
+        found = []
+        for (job, _), job_artifacts in zip(listings, pages):
+            for artifact in job_artifacts:
+                if types is not None and artifact['type'] not in types or artifact['type'] in exclude_types:
+                    continue
+                found.append(Artifact(arn=artifact['arn'], name=artifact['name'], type=artifact['type'],
+                                      extension=artifact.get('extension', ''), url=artifact['url'],
+                                      job_arn=job['arn'], device=job.get('device', {}).get('name')))
+    logger.info(f'Found {len(found)} artifacts in {len(jobs)} jobs of {run_arn}')
+    return found
+
+
+def download_artifacts(artifacts: List[Artifact], directory: str, max_concurrency: int = MAX_CONCURRENCY,
+                       chunk_size: int = CHUNK_SIZE, part_size: int = PART_SIZE,
+                       max_attempts: int = 3) -> List[DownloadResult]:
+    # A failed download does not stop the others, the DownloadError is raised once they are done
+    def download(artifact: Artifact) -> DownloadResult:
+        path = os.path.join(directory, artifact.path)
+        if os.path.exists(path):
+            return DownloadResult(artifact=artifact, path=path, size=os.path.getsize(path), resumed_from=0,
+                                  seconds=0.0, skipped=True)
+        start = time.monotonic()
+        size, resumed_from = download_file(artifact.url, path, chunk_size, part_size, max_attempts)
+        return DownloadResult(artifact=artifact, path=path, size=size, resumed_from=resumed_from,
+                              seconds=time.monotonic() - start)
+
+    results = []
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [executor.submit(deadline.bound(download), artifact) for artifact in artifacts]
+        for artifact, future in zip(artifacts, futures):
+            try:
+                results.append(future.result())
+            except DownloadError as e:
+                logger.error(f'Downloading {artifact.arn} failed: {e}')
+                errors.append(e)
+    if errors:
+        raise DownloadError(f'{len(errors)} of {len(artifacts)} artifacts failed to download: {errors[0]}')
+
+    size = sum(result.size for result in results if not result.skipped)
+    logger.info(f'Downloaded {len(results)} artifacts, {size / 1e6:.1f} MB, '
+                f'{sum(result.skipped for result in results)} already downloaded')
+    return results
+
+
+def download_file(url: str, path: str, chunk_size: int = CHUNK_SIZE, part_size: int = PART_SIZE,
+                  max_attempts: int = 3) -> Tuple[int, int]:
+    # Downloads url in ranged parts of part_size, written to path.part chunk by chunk. A later call
+    # resumes from the size of path.part, path only appears once the download is complete.
+    # Returns the size and the offset the download resumed from.
+    partial = path + PARTIAL_SUFFIX
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # presigned URLs are credentials, only their path is logged or raised, exception texts included
+    name = url.split('?')[0]
+    with open(partial, 'ab') as f:
+        resumed_from = f.tell()
+        size = None
+        failures = 0
+        while size is None or f.tell() < size:
+            deadline.check()
+            offset = f.tell()
+            try:
+                size = _get_part(url, f, offset, part_size, chunk_size)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    _RetryableError) as e:
+                # only attempts without any progress count, large files may see more than one dropped connection
+                failures = 0 if f.tell() > offset else failures + 1
+                error = f'{type(e).__name__}: {structured_log.redact_urls(str(e))}'
+                if failures >= max_attempts:
+                    raise DownloadError(f'Downloading {name} failed: {error}')
+                logger.warning(f'Downloading {name} failed at byte {f.tell()}: {error}')
+                time.sleep(deadline.timeout(random.uniform(0, 2 ** failures)))
+    os.replace(partial, path)
+    return size, resumed_from
+
+
+def _get_part(url: str, f, offset: int, part_size: int, chunk_size: int) -> int:
+    # writes the part at offset to f and returns the size of the whole content
+    headers = {'Range': f'bytes={offset}-{offset + part_size - 1}'}
+    with get_session().get(url, headers=headers, stream=True, timeout=(5, 60)) as response:
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            raise _RetryableError(f'HTTP {response.status_code}')
+        if response.status_code == 416:
+            # the partial file is complete, or is from a different content and starts over
+            match = UNSATISFIED_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+            if match is None:
+                raise DownloadError('HTTP 416 without the size of the content')
+            if int(match.group(1)) == offset:
+                return offset
+            f.seek(0)
+            f.truncate()
+            raise _RetryableError(f'The partial download has {offset} of {match.group(1)} bytes')
+
+        if response.status_code == 206:
+            match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+            if match is None or int(match.group(1)) != offset:
+                raise DownloadError(f'Unexpected Content-Range: {response.headers.get("Content-Range")}')
+            expected = int(match.group(2)) + 1 - offset
+            size = int(match.group(3))
+        elif response.status_code == 200:
+            # the whole content, from a server without range support
+            f.seek(0)
+            f.truncate()
+            offset = 0
+            expected = size = int(response.headers['Content-Length']) if 'Content-Length' in response.headers \
+                else None
+        else:
+            raise DownloadError(f'HTTP {response.status_code}')
+
+        received = 0
+        for chunk in response.iter_content(chunk_size):
+            f.write(chunk)
+            received += len(chunk)
+        if expected is not None and received < expected:
+            raise _RetryableError(f'The connection closed after {received} of {expected} bytes')
+        return size if size is not None else offset + received
+
+
+def _list(client: 'BaseClient', operation_name: str, key: str, **kwargs) -> List[dict]:
+    # a throttled page starts the listing over
+    paginator = client.get_paginator(operation_name)
+    pages = clients.call_with_backoff(lambda: list(paginator.paginate(**kwargs)))
+    return [item for page in pages for item in page[key]]
+
+
+def _safe_name(name: str) -> str:
+    return UNSAFE_CHARACTERS.sub('_', name).strip('_') or 'artifact'
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger()
+
+CACHE_DIR_VARIABLE = 'DEVICE_FARM_CACHE_DIR'
+
+
+class CacheStats(NamedTuple):
+    hits: int
+    misses: int
+
+
+def persist_path(file_name: str) -> Optional[str]:
+    cache_dir = os.environ.get(CACHE_DIR_VARIABLE)
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, file_name)
+
+
+def read_json_file(path: str) -> Any:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f'Ignoring unreadable cache file {path}: {e}')
+        return None
+
+
+def write_json_file(path: str, data: Any) -> None:
+    # write to a temporary file first, so concurrent readers never see a partial file
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f'Could not write cache file {path}: {e}')
+
+
+class TtlCache:
+
+    def __init__(self, ttl: float, persist_path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._entries = {}  # type: Dict[str, List[Any]]
+        self._loaded = False
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._load()
+            self._evict_expired()
+            self._entries[key] = [self._clock() + self.ttl, value]
+            self._store()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._load()
+            if self._entries.pop(key, None) is not None:
+                self._store()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._loaded = True
+            self._hits = 0
+            self._misses = 0
+            if self.persist_path and os.path.exists(self.persist_path):
+                os.remove(self.persist_path)
+
+    def stats(self) -> CacheStats:
+        return CacheStats(hits=self._hits, misses=self._misses)
+
+    def _evict_expired(self) -> None:
+        now = self._clock()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.persist_path:
+            return
+        self._entries = read_json_file(self.persist_path) or {}
+        self._evict_expired()
+
+    def _store(self) -> None:
+        if self.persist_path:
+            write_json_file(self.persist_path, self._entries)
@@ -0,0 +1,65 @@
+import json
+from typing import Any, Iterable, List, Optional
+
+IGNORED_PROPERTIES = frozenset({'ServiceToken'})
+
+# rules are combined with AND and IN/NOT_IN values are sets, so neither order matters
+UNORDERED_VALUE_OPERATORS = frozenset({'IN', 'NOT_IN'})
+
+
+def properties_changed(old_properties: Optional[dict], new_properties: Optional[dict],
+                       ignored: Iterable[str] = IGNORED_PROPERTIES) -> bool:
+    if old_properties is None:
+        return True
+    return normalize_properties(old_properties, ignored) != normalize_properties(new_properties or {}, ignored)
+
+
+def normalize_properties(properties: dict, ignored: Iterable[str] = IGNORED_PROPERTIES) -> dict:
+    ignored = set(ignored)
+    normalized = {}
+    for key, value in properties.items():
+        if key in ignored or value is None:
+            continue
+        if key == 'Rules':
+            normalized[key] = normalize_rules(value)
+        else:
+            normalized[key] = _normalize_value(value)
+    return normalized
+
+
+def normalize_rules(rules: Any) -> Any:
+    if not isinstance(rules, list):
+        return _normalize_value(rules)
+    return sorted(json.dumps(_normalize_rule(rule), sort_keys=True) for rule in rules)
+
+
+def _normalize_rule(rule: Any) -> Any:
+    if not isinstance(rule, dict):
+        return _normalize_value(rule)
+    normalized = {key: _normalize_value(value) for key, value in rule.items()}
+    if str(rule.get('operator', '')).upper() in UNORDERED_VALUE_OPERATORS:
+        values = _parse_json_list(rule.get('value'))
+        if values is not None:
+            normalized['value'] = sorted(json.dumps(value, sort_keys=True) for value in values)
+    return normalized
+
+
+def _parse_json_list(value: Any) -> Optional[List[Any]]:
+    if isinstance(value, list):
+        return value
+    try:
+        parsed = json.loads(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if isinstance(parsed, list) else None
+
+
+def _normalize_value(value: Any) -> Any:
+    # CloudFormation passes scalar properties as strings, even when they were written as numbers
+    if isinstance(value, dict):
+        return {key: _normalize_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize_value(item) for item in value]
+    if isinstance(value, bool):
+        return str(value).lower()
+    return str(value)
@@ -0,0 +1,153 @@
+import logging
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from . import deadline, metrics
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+DEFAULT_REGION = 'us-west-2'
+
+THROTTLING_ERROR_CODES = frozenset({
+    'LimitExceededException',
+    'ThrottlingException',
+    'Throttling',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+})
+
+logger = logging.getLogger()
+
+
+class ClientSettings(NamedTuple):
+    max_pool_connections: int = 10
+    connect_timeout: float = 5
+    read_timeout: float = 30
+
+
+class ClientStats(NamedTuple):
+    cold: int
+    warm: int
+
+
+_lock = threading.Lock()
+_settings = ClientSettings()
+_clients = {}  # type: Dict[Tuple[str, str], 'BaseClient']
+_cold = 0
+_warm = 0
+_last_was_warm = None  # type: Optional[bool]
+
+
+def configure(max_pool_connections: Optional[int] = None, connect_timeout: Optional[float] = None,
+              read_timeout: Optional[float] = None) -> None:
+    global _settings
+    with _lock:
+        changes = {}
+        if max_pool_connections is not None:
+            changes['max_pool_connections'] = max_pool_connections
+        if connect_timeout is not None:
+            changes['connect_timeout'] = connect_timeout
+        if read_timeout is not None:
+            changes['read_timeout'] = read_timeout
+        settings = _settings._replace(**changes)
+        if settings != _settings:
+            # clients keep the config they were created with, so drop them
+            _settings = settings
+            _clients.clear()
+
+
+def get_client(service_name: str, region_name: str = DEFAULT_REGION) -> 'BaseClient':
+    global _cold, _warm, _last_was_warm
+    key = (service_name, region_name)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _warm += 1
+            _last_was_warm = True
+            logger.debug('Reusing warm %s client', service_name)
+            return client
+        # boto3 is imported here rather than at module load so that requests which fail
+        # validation never pay for it on a cold start
+        with metrics.span('ClientCreate'):
+            import boto3
+            from botocore.config import Config
+            client = boto3.client(service_name, region_name=region_name, config=Config(
+                max_pool_connections=_settings.max_pool_connections,
+                connect_timeout=_settings.connect_timeout,
+                read_timeout=_settings.read_timeout,
+            ))
+        if service_name == 'devicefarm':
+            from . import rate_limit
+            client = rate_limit.RateLimitedClient(client)
+        _clients[key] = client
+        _cold += 1
+        _last_was_warm = False
+        logger.info(f'Created cold {service_name} client')
+        return client
+
+
+def get_device_farm_client() -> 'BaseClient':
+    return get_client('devicefarm')
+
+
+def last_client_was_warm() -> Optional[bool]:
+    return _last_was_warm
+
+
+def stats() -> ClientStats:
+    return ClientStats(cold=_cold, warm=_warm)
+
+
+def reset() -> None:
+    global _settings, _cold, _warm, _last_was_warm
+    with _lock:
+        _clients.clear()
+        _settings = ClientSettings()
+        _cold = 0
+        _warm = 0
+        _last_was_warm = None
+
+
+def error_code(error: Exception) -> Optional[str]:
+    # works for botocore's ClientError without importing botocore
+    response = getattr(error, 'response', None)
+    if not isinstance(response, dict):
+        return None
+    return response.get('Error', {}).get('Code')
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return error_code(error) in THROTTLING_ERROR_CODES
+
+
+def call_with_backoff(operation: Callable[..., Any], *args, max_attempts: int = 6, backoff_base: float = 0.25,
+                      backoff_cap: float = 10, **kwargs) -> Any:
+    attempt = 0
+    while True:
+        attempt += 1
+        deadline.check()
+        try:
+            return operation(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_attempts or not is_throttling_error(e):
+                raise
+            delay = random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+            if deadline.timeout(delay) < delay:
+                # no time left to wait for another attempt
+                raise
+            logger.warning(f'Throttled by {error_code(e)}, retrying in {delay:.2f}s')
+            time.sleep(delay)
+
+
+def import_sdk() -> None:
+    import boto3  # noqa: F401
+    import botocore.config  # noqa: F401
+
+
+if os.environ.get('DEVICE_FARM_EAGER_IMPORTS') == '1':
+    # e.g. with provisioned concurrency, where init time is not billed to a request
+    import_sdk()
@@ -1,38 +1,201 @@
+import collections
 import enum
 import json
 import logging
-from typing import Optional
+import random
+import re
+import threading
+import time
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from . import deadline, idempotency, metrics, structured_log
 
 logger = logging.getLogger()
 
 RESOURCE_NOT_CREATED = 'ResourceNotCreated'
 
+# CloudFormation rejects custom resource responses larger than 4096 bytes
+MAX_RESPONSE_SIZE = 4096
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
 
 class Status(enum.Enum):
     SUCCESS = 'SUCCESS'
     FAILED = 'FAILED'
 
 
+class ResponseRecord(NamedTuple):
+    request_id: str
+    status_code: Optional[int]
+    attempts: int
+    duration: float
+
+
+class ResponseTransport:
+
+    def __init__(self, pool_size: int = 4, connect_timeout: float = 3.05, read_timeout: float = 10,
+                 max_attempts: int = 5, backoff_base: float = 0.2, backoff_cap: float = 5,
+                 history_size: int = 100):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.history = collections.deque(maxlen=history_size)  # type: Deque[ResponseRecord]
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def put(self, url: str, body: bytes, request_id: str) -> Optional[requests.Response]:
+        start = time.monotonic()
+        response = None
+        attempt = 0
+        while attempt < self.max_attempts:
+            attempt += 1
+            try:
+                response = self.session.put(url=url, data=body, timeout=self._timeout())
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # the exception text holds the presigned ResponseURL
+                logger.warning(f'Sending CloudFormation response failed on attempt {attempt}: '
+                               f'{type(e).__name__}: {structured_log.redact_urls(str(e))}')
+                response = None
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                logger.warning(f'CloudFormation response rejected with HTTP {response.status_code} '
+                               f'on attempt {attempt}')
+            if attempt < self.max_attempts:
+                delay = self._backoff(attempt)
+                if not self._has_time_for(delay):
+                    logger.warning('Not retrying the CloudFormation response, the Lambda deadline is near')
+                    break
+                time.sleep(delay)
+        self.history.append(ResponseRecord(
+            request_id=request_id,
+            status_code=response.status_code if response is not None else None,
+            attempts=attempt,
+            duration=time.monotonic() - start,
+        ))
+        return response
+
+    def _timeout(self) -> Tuple[float, float]:
+        # the response is sent within the deadline's safety margin, so it is bounded by the invocation end
+        current = deadline.current()
+        time_left = current.time_left() if current is not None else None
+        if time_left is None:
+            return self.timeout
+        connect_timeout, read_timeout = self.timeout
+        return min(connect_timeout, max(time_left, 0.1)), min(read_timeout, max(time_left - connect_timeout, 0.1))
+
+    def _has_time_for(self, delay: float) -> bool:
+        current = deadline.current()
+        time_left = current.time_left() if current is not None else None
+        return time_left is None or time_left > delay + self.timeout[0]
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter, see https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+
+_transport_lock = threading.Lock()
+_transport = None  # type: Optional[ResponseTransport]
+
+
+def get_transport() -> ResponseTransport:
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = ResponseTransport()
+        return _transport
+
+
+def configure_transport(**kwargs) -> ResponseTransport:
+    global _transport
+    with _transport_lock:
+        _transport = ResponseTransport(**kwargs)
+        return _transport
+
+
+def reset_transport() -> None:
+    global _transport
+    with _transport_lock:
+        _transport = None
+
+
+def attribute_name(name: str) -> str:
+    # response data keys are read with Fn::GetAtt, keep them alphanumeric
+    return re.sub('[^A-Za-z0-9]', '', name)
+
+
+def fit_data(event: dict, context, data: dict, optional_data: Dict[str, str],
+             physical_resource_id: Optional[str] = None) -> dict:
+    # Adds optional_data in key order while the SUCCESS response stays within MAX_RESPONSE_SIZE.
+    # Entries that do not fit are skipped, later and smaller ones may still fit, and the result
+    # only depends on the entries, not on their order in optional_data.
+    fitted = dict(data)
+    size = len(_encode(_response_body(event, context, Status.SUCCESS, None, fitted, physical_resource_id, False)))
+    dropped = 0
+    for key in sorted(optional_data):
+        # '"key": "value", '
+        entry_size = len(json.dumps(key)) + len(json.dumps(optional_data[key])) + 4
+        if size + entry_size > MAX_RESPONSE_SIZE:
+            dropped += 1
+            continue
+        size += entry_size
+        fitted[key] = optional_data[key]
+    if dropped:
+        logger.warning(f'Dropped {dropped} response data entries to stay within {MAX_RESPONSE_SIZE} bytes')
+    return fitted
+
+
 def send_response(event: dict, context, status: Status, reason: Optional[str] = None,
                   data=None, physical_resource_id: Optional[str] = None,
                   no_echo: bool = False) -> None:
-    if data is None:
-        data = {}
+    response_body = _response_body(event, context, status, reason, data, physical_resource_id, no_echo)
+    # recorded before sending, so a redelivered event is answered even if this PUT is lost
+    idempotency.get_store().put(event['RequestId'], response_body)
+    _put_response(event, response_body)
+
+
+def replay_response(event: dict) -> bool:
+    response_body = idempotency.get_store().get(event['RequestId'])
+    if response_body is None:
+        return False
+    logger.info(f"Request {event['RequestId']} was already handled, replaying the recorded response")
+    _put_response(event, response_body)
+    return True
+
 
-    response_body = {
+def _put_response(event: dict, response_body: dict) -> None:
+    logger.info(structured_log.Message('Sending CloudFormation response', payload=response_body,
+                                       status=response_body['Status'], request_id=event['RequestId']))
+    with metrics.span('ResponsePut'):
+        response = get_transport().put(url=event['ResponseURL'],
+                                       body=_encode(response_body),
+                                       request_id=event['RequestId'])
+    if response is None:
+        logger.error('CloudFormation response could not be sent')
+    else:
+        logger.info('CloudFormation response sent. HTTP status was ' + str(response.status_code))
+
+
+def _response_body(event: dict, context, status: Status, reason: Optional[str], data: Optional[dict],
+                   physical_resource_id: Optional[str], no_echo: bool) -> dict:
+    return {
         'Status': status.name,
         'Reason': reason or 'See the details in CloudWatch Log Stream: ' + context.log_stream_name,
         'PhysicalResourceId': physical_resource_id or RESOURCE_NOT_CREATED,
         'StackId': event['StackId'],
         'RequestId': event['RequestId'],
         'LogicalResourceId': event['LogicalResourceId'],
-        'Data': data,
+        'Data': data if data is not None else {},
         'NoEcho': no_echo
     }
 
-    logger.info(f"Sending CloudFormation Response {response_body}")
-    response = requests.put(url=event['ResponseURL'],
-                            data=json.dumps(response_body).encode('utf-8'))
-    logger.info('CloudFormation response sent. HTTP status was ' + str(response.status_code))
+
+def _encode(response_body: dict) -> bytes:
+    return json.dumps(response_body).encode('utf-8')
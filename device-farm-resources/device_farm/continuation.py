@@ -0,0 +1,113 @@
+import abc
+import collections
+import copy
+import json
+import os
+import threading
+from typing import Callable, Iterable, Optional, TypeVar
+
+from . import clients, deadline
+
+# the checkpoint travels in the event of the next invocation
+STATE_KEY = 'DeviceFarmContinuation'
+ENABLED_VARIABLE = 'DEVICE_FARM_CONTINUATIONS'
+
+MAX_INVOCATIONS = 50
+# stop this long before the deadline's safety margin, to checkpoint and invoke the next invocation
+DEFAULT_RESERVE = 5.0
+
+T = TypeVar('T')
+
+
+class Continue(Exception):
+    # raised by an operation that checkpointed its progress in state and has to go on in a new invocation
+
+    def __init__(self, state: dict):
+        super().__init__('Continuing in a new invocation')
+        self.state = state
+
+
+class Invoker(abc.ABC):
+
+    @abc.abstractmethod
+    def invoke(self, event: dict, context) -> None:
+        pass
+
+
+class LambdaInvoker(Invoker):
+    # invokes the running function asynchronously, the event is at most 256 KB
+
+    def invoke(self, event: dict, context) -> None:
+        function_arn = context.invoked_function_arn
+        client = clients.get_client('lambda', region_name=function_arn.split(':')[3])
+        client.invoke(FunctionName=function_arn, InvocationType='Event',
+                      Payload=json.dumps(event).encode('utf-8'))
+
+
+class LocalInvoker(Invoker):
+    # keeps the events, so that continuations can be run locally, e.g. in tests
+
+    def __init__(self):
+        self.events = collections.deque()  # type: collections.deque
+
+    def invoke(self, event: dict, context) -> None:
+        self.events.append(event)
+
+    def run(self, handler: Callable[[dict, object], object], context) -> int:
+        invocations = 0
+        while self.events:
+            handler(self.events.popleft(), context)
+            invocations += 1
+        return invocations
+
+
+_invoker_lock = threading.Lock()
+_invoker = None  # type: Optional[Invoker]
+
+
+def get_invoker() -> Invoker:
+    global _invoker
+    with _invoker_lock:
+        if _invoker is None:
+            _invoker = LambdaInvoker()
+        return _invoker
+
+
+def set_invoker(invoker: Optional[Invoker]) -> None:
+    global _invoker
+    with _invoker_lock:
+        _invoker = invoker
+
+
+def enabled() -> bool:
+    return os.environ.get(ENABLED_VARIABLE, '').lower() in ('1', 'true')
+
+
+def get_state(event: dict) -> dict:
+    return copy.deepcopy(event.get(STATE_KEY) or {})
+
+
+def next_event(event: dict, state: dict) -> dict:
+    invocation = state.get('Invocation', 0) + 1
+    if invocation > MAX_INVOCATIONS:
+        raise RuntimeError(f'Not finished after {MAX_INVOCATIONS} invocations')
+    next_state = dict(state, Invocation=invocation)
+    return dict(event, **{STATE_KEY: next_state})
+
+
+def should_continue(reserve: float = DEFAULT_RESERVE) -> bool:
+    current = deadline.current()
+    remaining = current.remaining() if current is not None else None
+    return remaining is not None and remaining < reserve
+
+
+def remove_all(items: Iterable[T], remove: Callable[[T], None], state: dict, name: str,
+               reserve: float = DEFAULT_RESERVE) -> None:
+    # Removes the items one by one, counting them in state['Removed'][name]. Removed items are
+    # not listed again, so the next invocation goes on with the remaining ones.
+    removed = state.setdefault('Removed', {})
+    for item in items:
+        if should_continue(reserve):
+            raise Continue(state)
+        remove(item)
+        removed[name] = removed.get(name, 0) + 1
@@ -0,0 +1,161 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Iterator, Optional, TypeVar
+
+logger = logging.getLogger()
+
+SAFETY_MARGIN_VARIABLE = 'DEVICE_FARM_DEADLINE_MARGIN'
+# time left for sending the CloudFormation response, including a retry or two
+DEFAULT_SAFETY_MARGIN = 10.0
+
+T = TypeVar('T')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    # The end of the Lambda invocation, as seen by a handler. Work has to stop safety_margin
+    # seconds before the invocation ends, so that there is time left to answer CloudFormation.
+
+    def __init__(self, remaining: Optional[float], safety_margin: float = DEFAULT_SAFETY_MARGIN,
+                 clock: Callable[[], float] = time.monotonic):
+        # remaining is None for an unbounded deadline, e.g. outside of Lambda
+        self.clock = clock
+        self.safety_margin = safety_margin
+        self.ends_at = clock() + remaining if remaining is not None else None  # type: Optional[float]
+        self._cancelled = threading.Event()
+
+    @classmethod
+    def from_context(cls, context, safety_margin: Optional[float] = None) -> 'Deadline':
+        if safety_margin is None:
+            safety_margin = float(os.environ.get(SAFETY_MARGIN_VARIABLE, DEFAULT_SAFETY_MARGIN))
+        get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+        remaining = get_remaining_time() if callable(get_remaining_time) else None
+        if not isinstance(remaining, (int, float)):
+            return cls(None, safety_margin)
+        return cls(remaining / 1000, safety_margin)
+
+    def time_left(self) -> Optional[float]:
+        # until the invocation ends
+        if self.ends_at is None:
+            return None
+        return max(0.0, self.ends_at - self.clock())
+
+    def remaining(self) -> Optional[float]:
+        # until work has to stop
+        if self.ends_at is None:
+            return None
+        return max(0.0, self.ends_at - self.safety_margin - self.clock())
+
+    def timeout(self, default: float) -> float:
+        remaining = self.remaining()
+        return default if remaining is None else min(default, remaining)
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise DeadlineExceeded('Cancelled, the Lambda deadline is near')
+        if self.expired:
+            raise DeadlineExceeded(f'Stopped {self.safety_margin:g}s before the Lambda deadline')
+
+
+# The deadline of the invocation being handled. Worker threads read the deadline bound to them by
+# run() or bound() instead: a worker abandoned by a timed out invocation keeps seeing its own,
+# cancelled deadline after the next invocation has set its deadline here.
+_current = None  # type: Optional[Deadline]
+_bound = threading.local()
+
+
+def current() -> Optional[Deadline]:
+    deadline = getattr(_bound, 'deadline', None)
+    return deadline if deadline is not None else _current
+
+
+def check() -> None:
+    deadline = current()
+    if deadline is not None:
+        deadline.check()
+
+
+def reset() -> None:
+    global _current
+    _current = None
+    _bound.deadline = None
+
+
+def timeout(default: float) -> float:
+    deadline = current()
+    return default if deadline is None else deadline.timeout(default)
+
+
+@contextlib.contextmanager
+def active(deadline: Deadline) -> Iterator[Deadline]:
+    global _current
+    previous = _current
+    _current = deadline
+    try:
+        yield deadline
+    finally:
+        _current = previous
+
+
+def bound(function: Callable[..., T]) -> Callable[..., T]:
+    # Binds the deadline of the calling thread to function wherever it runs, e.g. for the
+    # functions handed to a thread pool: executor.map(deadline.bound(create), device_pools)
+    deadline = current()
+
+    def call(*args, **kwargs) -> T:
+        return _call_bound(deadline, function, *args, **kwargs)
+
+    return call
+
+
+def _call_bound(deadline: Optional[Deadline], function: Callable[..., T], *args, **kwargs) -> T:
+    previous = getattr(_bound, 'deadline', None)
+    _bound.deadline = deadline
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _bound.deadline = previous
+
+
+def run(function: Callable[[], T], deadline: Deadline) -> T:
+    # Runs function in a worker thread and waits at most until the deadline. A worker that is still
+    # running then is cancelled: it stops at its next check(), e.g. before the next API call.
+    if deadline.ends_at is None:
+        return _call_bound(deadline, function)
+
+    outcome = {}  # type: dict
+
+    def target() -> None:
+        try:
+            outcome['result'] = _call_bound(deadline, function)
+        except BaseException as e:
+            outcome['error'] = e
+
+    worker = threading.Thread(target=target, name='deadline-worker', daemon=True)
+    worker.start()
+    worker.join(deadline.remaining())
+    if worker.is_alive():
+        deadline.cancel()
+        logger.warning(f'Cancelling work {deadline.safety_margin:g}s before the Lambda deadline')
+        raise DeadlineExceeded(f'Timed out, stopped {deadline.safety_margin:g}s before the Lambda deadline')
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
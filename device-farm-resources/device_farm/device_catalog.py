@@ -0,0 +1,314 @@
+import argparse
+import json
+import mmap
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from . import deadline, rule_engine
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+SNAPSHOT_VERSION = 2
+# holds the time of the last sync next to the snapshot, an unchanged catalog leaves the snapshot as it is
+SYNCED_SUFFIX = '.synced'
+
+CATALOG_PATH_VARIABLE = 'DEVICE_CATALOG_PATH'
+MAX_AGE_VARIABLE = 'DEVICE_CATALOG_MAX_AGE'
+
+# query argument -> rule attribute, every one of them has an inverted index in the snapshot header
+INDEXED_ATTRIBUTES = {
+    'platform': 'PLATFORM',
+    'os_version': 'OS_VERSION',
+    'manufacturer': 'MANUFACTURER',
+    'form_factor': 'FORM_FACTOR',
+    'availability': 'AVAILABILITY',
+}
+# the header indexes every rule attribute, so that rules are evaluated without decoding device records.
+# ARNs are unique, their column is built from the ARN list.
+HEADER_ATTRIBUTES = tuple(attribute for attribute in rule_engine.DEVICE_ATTRIBUTES if attribute != 'ARN')
+
+
+class SyncResult(NamedTuple):
+    refreshed: bool
+    added: int = 0
+    removed: int = 0
+    changed: int = 0
+    unchanged: int = 0
+
+
+class DeviceCatalogSnapshot:
+    # File layout: one JSON header line with the device ARNs, the record offsets and the inverted
+    # indexes (attribute -> value -> hex bit mask of rows), followed by one JSON line per device,
+    # sorted by ARN. Only the header is parsed on load, device records are decoded on demand from
+    # the memory mapped file.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_end = self._mmap.find(b'\n')
+        header = json.loads(self._mmap[:header_end].decode('utf-8'))
+        if header.get('snapshot_version') != SNAPSHOT_VERSION:
+            raise ValueError(f'{path} is not a device catalog snapshot')
+        self._body_start = header_end + 1
+        self.arns = header['arns']  # type: List[str]
+        self._offsets = header['offsets']  # type: List[int]
+        self.indexes = {
+            attribute: rule_engine.Column({key: int(mask, 16) for key, mask in masks.items()})
+            for attribute, masks in header['index'].items()
+        }  # type: Dict[str, rule_engine.Column]
+        self._all_mask = (1 << len(self.arns)) - 1
+        self._catalog = None  # type: Optional[rule_engine.DeviceCatalog]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.arns)
+
+    def close(self) -> None:
+        self._mmap.close()
+
+    def record(self, row: int) -> bytes:
+        start = self._body_start + self._offsets[row]
+        end = self._mmap.find(b'\n', start)
+        return self._mmap[start:end if end >= 0 else len(self._mmap)]
+
+    def device(self, row: int) -> dict:
+        return json.loads(self.record(row).decode('utf-8'))
+
+    def devices(self) -> Iterable[dict]:
+        for row in range(len(self.arns)):
+            yield self.device(row)
+
+    def find_mask(self, **criteria: Union[None, str, Iterable[str]]) -> int:
+        mask = self._all_mask
+        for argument, values in criteria.items():
+            if values is None:
+                continue
+            attribute = INDEXED_ATTRIBUTES[argument]
+            if isinstance(values, str):
+                values = [values]
+            index = self.indexes[attribute]
+            value_mask = 0
+            for value in values:
+                value_mask |= index.mask(rule_engine.value_key(attribute, value))
+            mask &= value_mask
+        return mask
+
+    def find(self, **criteria: Union[None, str, Iterable[str]]) -> List[str]:
+        # e.g. find(platform='ANDROID', os_version=['9', '10'], availability='HIGHLY_AVAILABLE')
+        mask = self.find_mask(**criteria)
+        return [self.arns[row] for row in rule_engine.rows(mask)]
+
+    def catalog(self) -> rule_engine.DeviceCatalog:
+        with self._lock:
+            if self._catalog is None:
+                columns = dict(self.indexes)
+                columns['ARN'] = rule_engine.Column({arn: 1 << row for row, arn in enumerate(self.arns)})
+                self._catalog = rule_engine.DeviceCatalog(self.arns, columns)
+            return self._catalog
+
+
+def encode_device(device: dict) -> bytes:
+    return json.dumps(device, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def write_snapshot(path: str, devices: Iterable[dict], records: Optional[Dict[str, bytes]] = None) -> None:
+    # records may hold already encoded devices by ARN, which are written as they are
+    records = dict(records or {})
+    devices_by_arn = {device['arn']: device for device in devices}
+    arns = sorted(devices_by_arn)
+    index_rows = {attribute: {} for attribute in HEADER_ATTRIBUTES}  # type: Dict[str, Dict[str, List[int]]]
+    offsets = []
+    lines = []
+    offset = 0
+    for row, arn in enumerate(arns):
+        device = devices_by_arn[arn]
+        for attribute, rows in index_rows.items():
+            for value in rule_engine.DEVICE_ATTRIBUTES[attribute](device):
+                if value is not None:
+                    rows.setdefault(rule_engine.value_key(attribute, value), []).append(row)
+        line = records.get(arn) or encode_device(device)
+        offsets.append(offset)
+        lines.append(line)
+        offset += len(line) + 1
+    header = {
+        'snapshot_version': SNAPSHOT_VERSION,
+        'arns': arns,
+        'offsets': offsets,
+        'index': {
+            attribute: {key: format(mask, 'x')
+                        for key, mask in rule_engine.Column.from_rows(rows, len(arns)).masks.items()}
+            for attribute, rows in index_rows.items()
+        },
+    }
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(json.dumps(header, separators=(',', ':')).encode('utf-8'))
+        f.write(b'\n')
+        for line in lines:
+            f.write(line)
+            f.write(b'\n')
+    os.replace(temp_path, path)
+
+
+def sync(client: 'BaseClient', path: str, max_age: Optional[float] = None,
+         clock: Callable[[], float] = time.time) -> SyncResult:
+    # list_devices has no "changed since" filter, so a refresh always lists the whole catalog.
+    # max_age limits how often that happens, and an unchanged catalog is not rewritten.
+    if max_age is not None and _is_fresh(path, max_age, clock()):
+        return SyncResult(refreshed=False)
+
+    previous = {}  # type: Dict[str, bytes]
+    if os.path.exists(path):
+        try:
+            snapshot = DeviceCatalogSnapshot(path)
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable device catalog snapshot {path}: {e}')
+        else:
+            previous = {arn: snapshot.record(row) for row, arn in enumerate(snapshot.arns)}
+            snapshot.close()
+
+    devices = []
+    records = {}
+    added = changed = unchanged = 0
+    paginator = client.get_paginator('list_devices')
+    for page in paginator.paginate():
+        deadline.check()
+        for device in page['devices']:
+            record = encode_device(device)
+            old_record = previous.get(device['arn'])
+            if old_record is None:
+                added += 1
+            elif old_record == record:
+                unchanged += 1
+            else:
+                changed += 1
+            devices.append(device)
+            records[device['arn']] = record
+    removed = len(set(previous).difference(records))
+
+    if not previous or added or removed or changed:
+        write_snapshot(path, devices, records)
+        with _snapshots_lock:
+            _replace_snapshot(path, None)
+    _write_synced_at(path, clock())
+    return SyncResult(refreshed=True, added=added, removed=removed, changed=changed, unchanged=unchanged)
+
+
+def synced_at(path: str) -> Optional[float]:
+    # snapshots without a sync time, e.g. written by write_snapshot, are as old as the file
+    try:
+        with open(path + SYNCED_SUFFIX, 'r') as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        pass
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def _is_fresh(path: str, max_age: float, now: float) -> bool:
+    synced = synced_at(path)
+    return synced is not None and now - synced < max_age
+
+
+def _write_synced_at(path: str, timestamp: float) -> None:
+    temp_path = f'{path}{SYNCED_SUFFIX}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(repr(timestamp))
+    os.replace(temp_path, path + SYNCED_SUFFIX)
+
+
+_snapshots_lock = threading.Lock()
+_snapshots = {}  # type: Dict[str, DeviceCatalogSnapshot]
+
+
+def load(path: str) -> DeviceCatalogSnapshot:
+    # snapshots stay mapped across warm invocations until the file is replaced
+    with _snapshots_lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is not None and snapshot.mtime == os.path.getmtime(path):
+            return snapshot
+        snapshot = DeviceCatalogSnapshot(path)
+        _replace_snapshot(path, snapshot)
+        return snapshot
+
+
+def _replace_snapshot(path: str, snapshot: Optional[DeviceCatalogSnapshot]) -> None:
+    # unmaps the replaced file, catalogs built from it keep working as they only hold the header indexes
+    old_snapshot = _snapshots.pop(path, None)
+    if old_snapshot is not None:
+        old_snapshot.close()
+    if snapshot is not None:
+        _snapshots[path] = snapshot
+
+
+def load_or_sync(path: str, client_factory: Callable[[], 'BaseClient'],
+                 max_age: Optional[float]) -> Tuple[DeviceCatalogSnapshot, SyncResult]:
+    if os.path.exists(path) and (max_age is None or _is_fresh(path, max_age, time.time())):
+        return load(path), SyncResult(refreshed=False)
+    result = sync(client_factory(), path)
+    return load(path), result
+
+
+def is_snapshot(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return f.read(len(b'{"snapshot_version"')) == b'{"snapshot_version"'
+
+
+_device_lists_lock = threading.Lock()
+_device_lists = {}  # type: Dict[str, Tuple[float, rule_engine.DeviceCatalog]]
+
+
+def load_catalog(client_factory: Callable[[], 'BaseClient']) -> Optional[rule_engine.DeviceCatalog]:
+    # DEVICE_CATALOG_PATH is either a snapshot, which is synced when DEVICE_CATALOG_MAX_AGE is set,
+    # or a plain JSON list of devices as returned by list_devices
+    path = os.environ.get(CATALOG_PATH_VARIABLE)
+    if not path:
+        return None
+    max_age = os.environ.get(MAX_AGE_VARIABLE)
+    if max_age or is_snapshot(path):
+        snapshot, _ = load_or_sync(path, client_factory, float(max_age) if max_age else None)
+        return snapshot.catalog()
+
+    mtime = os.path.getmtime(path)
+    with _device_lists_lock:
+        cached = _device_lists.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r') as f:
+            devices = json.load(f)
+        if isinstance(devices, dict):
+            devices = devices.get('devices', [])
+        catalog = rule_engine.DeviceCatalog.from_devices(devices)
+        _device_lists[path] = (mtime, catalog)
+        return catalog
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Sync and query a local Device Farm device catalog snapshot')
+    subparsers = parser.add_subparsers(dest='command')
+    sync_parser = subparsers.add_parser('sync')
+    sync_parser.add_argument('path')
+    sync_parser.add_argument('--max-age', type=float)
+    find_parser = subparsers.add_parser('find')
+    find_parser.add_argument('path')
+    for argument in INDEXED_ATTRIBUTES:
+        find_parser.add_argument('--' + argument.replace('_', '-'), action='append')
+    args = parser.parse_args(argv)
+
+    if args.command == 'sync':
+        from . import clients
+        print(sync(clients.get_device_farm_client(), args.path, max_age=args.max_age))
+    elif args.command == 'find':
+        snapshot = load(args.path)
+        for arn in snapshot.find(**{argument: getattr(args, argument) for argument in INDEXED_ATTRIBUTES}):
+            print(arn)
+    else:
+        parser.print_usage()
+
+
+if __name__ == '__main__':
+    main()
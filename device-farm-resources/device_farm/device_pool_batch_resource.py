@@ -0,0 +1,277 @@
+import concurrent.futures
+import logging
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
+
+from . import changes, clients, cloudformation, deadline, device_pool_rules, resource
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+KNOWN_POOL_PROPERTIES = {'Name', 'Rules', 'Description', 'MaxDevices'}
+# tags the pools of a batch with the batch ID, the last part of the physical resource ID
+BATCH_TAG_KEY = 'DevicePoolBatch'
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Every pool ARN is returned as DevicePool.<Name>.Arn and has to fit in the response with the rest of it,
+# the stack ID, physical resource ID and reason take well under the bytes kept for them.
+MAX_POOL_DATA_SIZE = cloudformation.MAX_RESPONSE_SIZE - 1024
+# arn:aws:devicefarm:<region>:<account>:devicepool:<project ID>/<pool ID>
+MAX_POOL_ARN_LENGTH = len('arn:aws:devicefarm:us-west-2:123456789012:devicepool:') + 2 * 36 + 1
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def create_batch(request: resource.Request) -> resource.Result:
+    client = _get_device_farm_client()
+    # the Create request ID tells the pools of this batch from same-named pools of other stacks
+    batch_id = request.event['RequestId']
+    arns = create_device_pools(client, request['ProjectArn'], request['DevicePools'], batch_id,
+                               request['MaxConcurrency'])
+    return _batch_result(get_physical_resource_id(request['ProjectArn'], request.logical_resource_id, batch_id),
+                         request['DevicePools'], arns)
+
+
+def update_batch(request: resource.Request) -> resource.Result:
+    if request.old_properties.get('ProjectArn') != request['ProjectArn']:
+        # a new project means a new physical resource, CloudFormation deletes the old pools afterwards
+        return create_batch(request)
+    client = _get_device_farm_client()
+    arns = update_device_pools(client, request['ProjectArn'], get_batch_id(request.physical_resource_id),
+                               request.old_properties.get('DevicePools', []), request['DevicePools'],
+                               request['MaxConcurrency'])
+    return _batch_result(request.physical_resource_id, request['DevicePools'], arns)
+
+
+def delete_batch(request: resource.Request) -> resource.Result:
+    client = _get_device_farm_client()
+    delete_device_pools(client, request['ProjectArn'], get_batch_id(request.physical_resource_id),
+                        [pool['Name'] for pool in request['DevicePools']], request['MaxConcurrency'])
+    return resource.Result(physical_resource_id=request.physical_resource_id)
+
+
+def _batch_result(physical_resource_id: str, device_pools: List[dict], arns: Dict[str, str]) -> resource.Result:
+    # validation keeps the per-pool ARNs within the response, the joined Arns are only added when they fit as well
+    data = {_arn_attribute(pool['Name']): arns[pool['Name']] for pool in device_pools}
+    optional_data = {'Arns': ','.join(arns[pool['Name']] for pool in device_pools)} if arns else {}
+    return resource.Result(physical_resource_id=physical_resource_id, data=data, optional_data=optional_data)
+
+
+def _arn_attribute(name: str) -> str:
+    return f'DevicePool.{cloudformation.attribute_name(name)}.Arn'
+
+
+DEVICE_POOL_BATCH = resource.CustomResource(
+    name='Device pool batch',
+    properties=[
+        resource.Property('ProjectArn', required=True),
+        resource.Property('DevicePools', required=True, validate=lambda pools: validate_device_pools(pools)),
+        resource.Property('MaxConcurrency', default=DEFAULT_MAX_CONCURRENCY, parse=int),
+    ],
+    create=create_batch,
+    update=update_batch,
+    delete=delete_batch,
+)
+
+KNOWN_PROPERTIES = DEVICE_POOL_BATCH.known_properties
+
+
+def lambda_handler(event: dict, context):
+    return DEVICE_POOL_BATCH.handle(event, context)
+
+
+def validate_device_pools(device_pools) -> List[str]:
+    if not isinstance(device_pools, list):
+        return ['DevicePools must be a list']
+    errors = []
+    names = set()
+    for index, device_pool in enumerate(device_pools, start=1):
+        if not isinstance(device_pool, dict):
+            errors.append(f'device pool {index}: must be an object')
+            continue
+        name = device_pool.get('Name')
+        label = f'device pool {name or index}'
+        if not name:
+            errors.append(f'{label}: required property Name not set')
+        elif name in names:
+            errors.append(f'{label}: duplicate name')
+        names.add(name)
+        if not device_pool.get('Rules'):
+            errors.append(f'{label}: required property Rules not set')
+        else:
+            errors.extend(f'{label}: {error}' for error in device_pool_rules.validate_rules(device_pool['Rules']))
+        extra_properties = set(device_pool).difference(KNOWN_POOL_PROPERTIES)
+        if extra_properties:
+            errors.append(f'{label}: unknown properties {", ".join(sorted(extra_properties))}')
+    if not errors:
+        errors.extend(_validate_response_size([pool['Name'] for pool in device_pools]))
+    return errors
+
+
+def _validate_response_size(names: List[str]) -> List[str]:
+    size = 0
+    too_many = []
+    for name in names:
+        # "<key>": "<arn>", in the JSON response
+        size += len(_arn_attribute(name)) + MAX_POOL_ARN_LENGTH + 8
+        if size > MAX_POOL_DATA_SIZE:
+            too_many.append(name)
+    if too_many:
+        return [f'the ARNs of device pools {", ".join(too_many)} do not fit in the {cloudformation.MAX_RESPONSE_SIZE} '
+                f'bytes of a CloudFormation response, split DevicePools into more batches']
+    return []
+
+
+def create_device_pools(client: 'BaseClient', project_arn: str, device_pools: List[dict], batch_id: str,
+                        max_concurrency: int) -> Dict[str, str]:
+    def create(device_pool: dict) -> str:
+        return create_device_pool(client, project_arn, device_pool, batch_id)
+
+    results = _run_concurrently(create, {pool['Name']: pool for pool in device_pools}, max_concurrency)
+    arns = {name: result for name, result in results.items() if not isinstance(result, Exception)}
+    errors = {name: result for name, result in results.items() if isinstance(result, Exception)}
+    if errors:
+        # nothing is left behind for a failed Create, CloudFormation would not know about the pools
+        _run_concurrently(lambda arn: delete_device_pool(client, arn), arns, max_concurrency)
+        raise _batch_error('create', errors)
+    return arns
+
+
+def update_device_pools(client: 'BaseClient', project_arn: str, batch_id: str, old_device_pools: List[dict],
+                        device_pools: List[dict], max_concurrency: int) -> Dict[str, str]:
+    old_by_name = {pool['Name']: pool for pool in old_device_pools if isinstance(pool, dict) and 'Name' in pool}
+    new_names = {pool['Name'] for pool in device_pools}
+    owned = list_batch_device_pools(client, project_arn, batch_id, new_names.union(old_by_name), max_concurrency)
+    existing = {}  # type: Dict[str, str]
+    for arn, name in owned.items():
+        existing.setdefault(name, arn)
+    operations = {}  # type: Dict[str, Callable[[], Optional[str]]]
+    for device_pool in device_pools:
+        name = device_pool['Name']
+        arn = existing.get(name)
+        if arn is None:
+            operations[name] = lambda pool=device_pool: create_device_pool(client, project_arn, pool, batch_id)
+        elif changes.properties_changed(old_by_name.get(name), device_pool):
+            operations[name] = lambda pool=device_pool, arn=arn: update_device_pool(client, arn, pool)
+        else:
+            operations[name] = lambda arn=arn: arn
+    for arn, name in owned.items():
+        if name not in new_names or existing[name] != arn:
+            operations[arn] = lambda arn=arn: delete_device_pool(client, arn)
+    print(f'Updating {len(operations)} device pools')
+
+    results = _run_concurrently(lambda operation: operation(), operations, max_concurrency)
+    errors = {name: result for name, result in results.items() if isinstance(result, Exception)}
+    if errors:
+        raise _batch_error('update', errors)
+    return {name: results[name] for name in new_names}
+
+
+def delete_device_pools(client: 'BaseClient', project_arn: str, batch_id: str, names: List[str],
+                        max_concurrency: int) -> None:
+    arns = list_batch_device_pools(client, project_arn, batch_id, set(names), max_concurrency)
+    results = _run_concurrently(lambda arn: delete_device_pool(client, arn), {arn: arn for arn in arns},
+                                max_concurrency)
+    errors = {arns[arn]: result for arn, result in results.items()
+              if isinstance(result, Exception) and clients.error_code(result) != 'NotFoundException'}
+    if errors:
+        raise _batch_error('delete', errors)
+
+
+def list_batch_device_pools(client: 'BaseClient', project_arn: str, batch_id: str, names: Set[str],
+                            max_concurrency: int) -> Dict[str, str]:
+    # The pools of the batch by ARN, with their names. Same-named pools of other batches and
+    # stacks in the project are told apart by the tag create_device_pool adds.
+    candidates = {pool['arn']: pool['name'] for pool in list_private_device_pools(client, project_arn)
+                  if pool['name'] in names}
+    tags = _run_concurrently(lambda arn: clients.call_with_backoff(client.list_tags_for_resource, ResourceARN=arn),
+                             {arn: arn for arn in candidates}, max_concurrency)
+    errors = {candidates[arn]: result for arn, result in tags.items() if isinstance(result, Exception)}
+    if errors:
+        raise _batch_error('list', errors)
+    batch_tag = {'Key': BATCH_TAG_KEY, 'Value': batch_id}
+    return {arn: name for arn, name in candidates.items() if batch_tag in tags[arn].get('Tags', [])}
+
+
+def list_private_device_pools(client: 'BaseClient', project_arn: str) -> List[dict]:
+    paginator = client.get_paginator('list_device_pools')
+    pages = clients.call_with_backoff(lambda: list(paginator.paginate(arn=project_arn, type='PRIVATE')))
+    return [device_pool for page in pages for device_pool in page['devicePools']]
+
+
+def create_device_pool(client: 'BaseClient', project_arn: str, device_pool: dict, batch_id: str) -> str:
+    params = {
+        'projectArn': project_arn,
+        'name': device_pool['Name'],
+        'rules': device_pool['Rules'],
+    }
+    if device_pool.get('Description') is not None:
+        params['description'] = device_pool['Description']
+    if device_pool.get('MaxDevices') is not None:
+        params['maxDevices'] = int(device_pool['MaxDevices'])
+    response = clients.call_with_backoff(client.create_device_pool, **params)
+    arn = response['devicePool']['arn']
+    try:
+        clients.call_with_backoff(client.tag_resource, ResourceARN=arn,
+                                  Tags=[{'Key': BATCH_TAG_KEY, 'Value': batch_id}])
+    except Exception:
+        # an untagged pool would not be found by later updates and deletes
+        delete_device_pool(client, arn)
+        raise
+    return arn
+
+
+def update_device_pool(client: 'BaseClient', arn: str, device_pool: dict) -> str:
+    params = {
+        'arn': arn,
+        'name': device_pool['Name'],
+        'rules': device_pool['Rules'],
+    }
+    if device_pool.get('MaxDevices') is not None:
+        params['maxDevices'] = int(device_pool['MaxDevices'])
+    else:
+        params['clearMaxDevices'] = True
+    if device_pool.get('Description') is not None:
+        params['description'] = device_pool['Description']
+    clients.call_with_backoff(client.update_device_pool, **params)
+    return arn
+
+
+def delete_device_pool(client: 'BaseClient', arn: str) -> None:
+    clients.call_with_backoff(client.delete_device_pool, arn=arn)
+
+
+def get_physical_resource_id(project_arn: str, logical_resource_id: str, batch_id: str) -> str:
+    return f'{project_arn}/device-pool-batch/{logical_resource_id}/{batch_id}'
+
+
+def get_batch_id(physical_resource_id: str) -> str:
+    return physical_resource_id.split('/')[-1]
+
+
+def _run_concurrently(function: Callable, items: Dict[str, object], max_concurrency: int) -> Dict[str, object]:
+    # returns the result or the raised exception for every item
+    results = {}
+    if not items:
+        return results
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(items)))) as executor:
+        # the workers stop with the invocation that started them
+        function = deadline.bound(function)
+        futures = {executor.submit(function, item): name for name, item in items.items()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                print(f'Device pool {futures[future]} failed: {e}')
+                results[futures[future]] = e
+    return results
+
+
+def _batch_error(action: str, errors: Dict[str, Exception]) -> Exception:
+    details = '; '.join(f'{name}: {errors[name]}' for name in sorted(errors))
+    return RuntimeError(f'Failed to {action} {len(errors)} device pools: {details}')
+
+
+def _get_device_farm_client() -> 'BaseClient':
+    return clients.get_device_farm_client()
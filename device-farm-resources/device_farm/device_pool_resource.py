@@ -1,129 +1,105 @@
 import logging
-import traceback
-from typing import Optional
+from typing import TYPE_CHECKING, List, Optional
 
-import boto3
-from botocore.client import BaseClient
+from . import clients, device_catalog, device_pool_rules, resource
 
-from . import cloudformation
-
-KNOWN_PROPERTIES = {'Name', 'Rules', 'ProjectArn', 'Description', 'MaxDevices', 'ServiceToken'}
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def create_device_pool(request: resource.Request) -> resource.Result:
+    data = _matching_devices_data(request)
+    client = _get_device_farm_client()
+    params = {
+        'projectArn': request['ProjectArn'],
+        'name': request['Name'],
+        'rules': request['Rules'],
+    }
+    if request['Description'] is not None:
+        params['description'] = request['Description']
+    if request['MaxDevices'] is not None:
+        params['maxDevices'] = request['MaxDevices']
+    response = clients.call_with_backoff(client.create_device_pool, **params)
+    device_pool_arn = response['devicePool']['arn']
+    data['Arn'] = device_pool_arn
+    return resource.Result(physical_resource_id=device_pool_arn, data=data)
+
+
+def update_device_pool(request: resource.Request) -> resource.Result:
+    data = _matching_devices_data(request)
+    client = _get_device_farm_client()
+    params = {
+        'arn': request.physical_resource_id,
+        'name': request['Name'],
+        'rules': request['Rules'],
+    }
+    if request['MaxDevices'] is not None:
+        params['maxDevices'] = request['MaxDevices']
+    else:
+        params['clearMaxDevices'] = True
+    if request['Description'] is not None:
+        params['description'] = request['Description']
+    clients.call_with_backoff(client.update_device_pool, **params)
+    data['Arn'] = request.physical_resource_id
+    return resource.Result(physical_resource_id=request.physical_resource_id, data=data)
+
+
+def keep_device_pool(request: resource.Request) -> resource.Result:
+    # the same outputs as the Create, MatchingDevices may be read with Fn::GetAtt
+    data = _matching_devices_data(request)
+    data['Arn'] = request.physical_resource_id
+    return resource.Result(physical_resource_id=request.physical_resource_id, data=data)
+
+
+def delete_device_pool(request: resource.Request) -> resource.Result:
+    client = _get_device_farm_client()
+    clients.call_with_backoff(client.delete_device_pool, arn=request.physical_resource_id)
+    return resource.Result(physical_resource_id=request.physical_resource_id,
+                           data={'Arn': request.physical_resource_id})
+
+
+def _matching_devices_data(request: resource.Request) -> dict:
+    if not request['RequireMatchingDevices']:
+        return {}
+    return {'MatchingDevices': preview_matching_devices(request['Rules'], request['MaxDevices'])}
+
+
+DEVICE_POOL = resource.CustomResource(
+    name='Device pool',
+    properties=[
+        resource.Property('ProjectArn', required=True),
+        resource.Property('Name', required=True),
+        resource.Property('Rules', required=True, validate=device_pool_rules.validate_rules),
+        resource.Property('Description'),
+        resource.Property('MaxDevices'),
+        resource.Property('RequireMatchingDevices', default=False, parse=resource.parse_bool),
+    ],
+    create=create_device_pool,
+    update=update_device_pool,
+    delete=delete_device_pool,
+    unchanged=keep_device_pool,
+)
+
+KNOWN_PROPERTIES = DEVICE_POOL.known_properties
+
+
 def lambda_handler(event: dict, context):
-    logging.info(f"Handling Request {event}")
-    physical_resource_id = event.get('PhysicalResourceId')
-    project_arn = event.get('ResourceProperties', {}).get('ProjectArn', None)
-    name = event.get('ResourceProperties', {}).get('Name', None)
-    rules = event.get('ResourceProperties', {}).get('Rules', None)
-    description = event.get('ResourceProperties', {}).get('Description', None)
-    max_devices = event.get('ResourceProperties', {}).get('MaxDevices', None)
-    extra_properties = set(event.get('ResourceProperties', {}).keys()).difference(KNOWN_PROPERTIES)
-
-    def send_error(reason):
-        cloudformation.send_response(
-            event=event,
-            context=context,
-            status=cloudformation.Status.FAILED,
-            reason=reason,
-            physical_resource_id=cloudformation.RESOURCE_NOT_CREATED
-        )
-
-    def send_missing_property_response(property_name: str):
-        send_error(f'Required property {property_name} not set')
-
-    try:
-        if not project_arn:
-            send_missing_property_response('ProjectArn')
-        elif not name:
-            send_missing_property_response('Name')
-        elif not rules:
-            send_missing_property_response('Rules')
-        elif extra_properties:
-            send_error(f'Unknown properties found: {", ".join(extra_properties)}')
-        else:
-            if event['RequestType'] == 'Delete' and physical_resource_id == cloudformation.RESOURCE_NOT_CREATED:
-                cloudformation.send_response(
-                    event=event, context=context,
-                    status=cloudformation.Status.SUCCESS,
-                    physical_resource_id=physical_resource_id
-                )
-            else:
-                if event['RequestType'] == 'Delete':
-                    client = _get_device_farm_client()
-                    client.delete_device_pool(arn=physical_resource_id)
-                elif event['RequestType'] == 'Create':
-                    client = _get_device_farm_client()
-                    params = {
-                        'projectArn': project_arn,
-                        'name': name,
-                        'rules': rules,
-                    }
-                    if description is not None:
-                        params['description'] = description
-                    if max_devices is not None:
-                        params['maxDevices'] = max_devices
-                    response = client.create_device_pool(**params)
-                    physical_resource_id = response['devicePool']['arn']
-                elif event['RequestType'] == 'Update':
-                    client = _get_device_farm_client()
-                    params = {
-                        'arn': physical_resource_id,
-                        'name': name,
-                        'rules': rules,
-                    }
-                    if max_devices is not None:
-                        params['maxDevices'] = max_devices
-                    else:
-                        params['clearMaxDevices'] = True
-                    if description is not None:
-                        params['description'] = description
-                    client.update_device_pool(**params)
-                else:
-                    raise ValueError('Unknown RequestType ' + event['RequestType'])
-
-                cloudformation.send_response(
-                    event=event, context=context,
-                    status=cloudformation.Status.SUCCESS,
-                    physical_resource_id=physical_resource_id,
-                    data={
-                        'Arn': physical_resource_id,
-                    },
-                )
-
-    except Exception as e:
-        print(e)
-        traceback.print_exc()
-        physical_resource_id = physical_resource_id or cloudformation.RESOURCE_NOT_CREATED
-        cloudformation.send_response(
-            event=event,
-            context=context,
-            status=cloudformation.Status.FAILED,
-            reason=str(e),
-            physical_resource_id=physical_resource_id,
-        )
-
-    print('Finished')
-    return 'ok'
-
-
-def get_top_device_pool_arn(client: BaseClient, project_arn: str) -> Optional[str]:
-    paginator = client.get_paginator('list_device_pools')
-    for page in paginator.paginate(arn=project_arn, type='CURATED'):
-        for device_pool in page['devicePools']:
-            if device_pool['name'] == 'Top Devices':
-                return device_pool['arn']
-    print('Top Devices device pool not found')
-    return None
-
-
-def get_project_id(project_arn: str) -> str:
-    arn_parts = project_arn.split(':')
-    return arn_parts[-1]
-
-
-def _get_device_farm_client() -> BaseClient:
-    return boto3.client('devicefarm', region_name='us-west-2')
+    return DEVICE_POOL.handle(event, context)
+
+
+def preview_matching_devices(rules: List[dict], max_devices: Optional[int]) -> int:
+    catalog = device_catalog.load_catalog(_get_device_farm_client)
+    if catalog is None:
+        raise ValueError(f'RequireMatchingDevices needs a device catalog, set {device_catalog.CATALOG_PATH_VARIABLE}')
+    result = catalog.evaluate(rules, max_devices=max_devices)
+    print(f'Rules match {result.total} of {len(catalog)} devices in the catalog')
+    if result.count == 0:
+        raise ValueError('Rules do not match any device in the device catalog')
+    return result.count
+
+
+def _get_device_farm_client() -> 'BaseClient':
+    return clients.get_device_farm_client()
@@ -0,0 +1,116 @@
+import json
+import re
+from typing import Any, FrozenSet, List, NamedTuple, Optional
+
+EQUALS = 'EQUALS'
+LESS_THAN = 'LESS_THAN'
+LESS_THAN_OR_EQUALS = 'LESS_THAN_OR_EQUALS'
+GREATER_THAN = 'GREATER_THAN'
+GREATER_THAN_OR_EQUALS = 'GREATER_THAN_OR_EQUALS'
+IN = 'IN'
+NOT_IN = 'NOT_IN'
+CONTAINS = 'CONTAINS'
+
+LIST_OPERATORS = frozenset({IN, NOT_IN})
+COMPARISON_OPERATORS = frozenset({LESS_THAN, LESS_THAN_OR_EQUALS, GREATER_THAN, GREATER_THAN_OR_EQUALS})
+
+RULE_KEYS = frozenset({'attribute', 'operator', 'value'})
+
+_VERSION_PATTERN = re.compile(r'^\d+(\.\d+)*$')
+
+
+class AttributeGrammar(NamedTuple):
+    operators: FrozenSet[str]
+    # allowed values (upper case) for enumerated attributes, None if any string is allowed
+    values: Optional[FrozenSet[str]] = None
+    version: bool = False
+
+
+def _grammar(operators, values=None, version=False) -> AttributeGrammar:
+    return AttributeGrammar(
+        operators=frozenset(operators),
+        values=frozenset(values) if values is not None else None,
+        version=version,
+    )
+
+
+# see https://docs.aws.amazon.com/devicefarm/latest/APIReference/API_Rule.html
+RULE_GRAMMAR = {
+    # deprecated, still accepted by the API
+    'APPIUM_VERSION': _grammar({CONTAINS}),
+    'ARN': _grammar({EQUALS, IN, NOT_IN}),
+    'AVAILABILITY': _grammar({EQUALS}, {'AVAILABLE', 'HIGHLY_AVAILABLE', 'BUSY', 'TEMPORARY_NOT_AVAILABLE'}),
+    'FLEET_TYPE': _grammar({EQUALS}, {'PUBLIC', 'PRIVATE'}),
+    'FORM_FACTOR': _grammar({EQUALS, IN, NOT_IN}, {'PHONE', 'TABLET'}),
+    'INSTANCE_ARN': _grammar({EQUALS, IN, NOT_IN}),
+    'INSTANCE_LABELS': _grammar({CONTAINS}),
+    'MANUFACTURER': _grammar({EQUALS, IN, NOT_IN}),
+    'MODEL': _grammar({CONTAINS, EQUALS, IN, NOT_IN}),
+    'OS_VERSION': _grammar({EQUALS, IN, NOT_IN} | COMPARISON_OPERATORS, version=True),
+    'PLATFORM': _grammar({EQUALS, IN, NOT_IN}, {'ANDROID', 'IOS'}),
+    'REMOTE_ACCESS_ENABLED': _grammar({EQUALS}, {'TRUE', 'FALSE'}),
+    'REMOTE_DEBUG_ENABLED': _grammar({EQUALS}, {'TRUE', 'FALSE'}),
+}
+
+
+def parse_value(value: Any) -> Any:
+    # rule values are JSON encoded strings, e.g. '"ANDROID"' or '["PHONE", "TABLET"]',
+    # but plain strings such as 'True' are accepted as well
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def validate_rules(rules: Any) -> List[str]:
+    if not isinstance(rules, list):
+        return ['Rules must be a list']
+    errors = []
+    for index, rule in enumerate(rules, start=1):
+        errors.extend(f'rule {index}: {error}' for error in validate_rule(rule))
+    return errors
+
+
+def validate_rule(rule: Any) -> List[str]:
+    if not isinstance(rule, dict):
+        return ['must be an object with attribute, operator and value']
+    errors = []
+    missing_keys = RULE_KEYS.difference(rule)
+    if missing_keys:
+        errors.append(f'missing {", ".join(sorted(missing_keys))}')
+    unknown_keys = set(rule).difference(RULE_KEYS)
+    if unknown_keys:
+        errors.append(f'unknown keys {", ".join(sorted(unknown_keys))}')
+
+    attribute = rule.get('attribute')
+    grammar = RULE_GRAMMAR.get(attribute)
+    if 'attribute' in rule and grammar is None:
+        errors.append(f'unknown attribute {attribute}')
+    operator = rule.get('operator')
+    if grammar is not None and 'operator' in rule and operator not in grammar.operators:
+        errors.append(f'operator {operator} is not allowed for {attribute}, '
+                      f'use one of {", ".join(sorted(grammar.operators))}')
+        return errors
+    if grammar is None or 'operator' not in rule or 'value' not in rule:
+        return errors
+
+    value = parse_value(rule['value'])
+    if operator in LIST_OPERATORS:
+        if not isinstance(value, list) or not value:
+            return errors + [f'value for {operator} must be a non-empty JSON list']
+        values = value
+    elif isinstance(value, (list, dict)):
+        return errors + [f'value for {operator} must be a single value']
+    else:
+        values = [value]
+
+    for item in values:
+        if isinstance(item, (list, dict)) or item is None:
+            errors.append(f'invalid value {json.dumps(item)} for {attribute}')
+        elif grammar.values is not None and str(item).upper() not in grammar.values:
+            errors.append(f'invalid value {item} for {attribute}, use one of {", ".join(sorted(grammar.values))}')
+        elif grammar.version and operator in COMPARISON_OPERATORS and not _VERSION_PATTERN.match(str(item)):
+            errors.append(f'invalid version {item} for {attribute}')
+    return errors
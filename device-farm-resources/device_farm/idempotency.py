@@ -0,0 +1,104 @@
+import abc
+import collections
+import threading
+import time
+from typing import Callable, Optional
+
+from . import cache
+
+DEFAULT_MAX_ENTRIES = 256
+# CloudFormation gives up on a custom resource after one hour
+DEFAULT_TTL = 2 * 60 * 60
+
+
+class IdempotencyStore(abc.ABC):
+    # Records the response sent for each CloudFormation RequestId. Implement this for a
+    # store shared between containers, e.g. a DynamoDB table, and install it with set_store.
+
+    @abc.abstractmethod
+    def get(self, request_id: str) -> Optional[dict]:
+        pass
+
+    @abc.abstractmethod
+    def put(self, request_id: str, response_body: dict) -> None:
+        pass
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        pass
+
+
+class LocalIdempotencyStore(IdempotencyStore):
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 persist_path: Optional[str] = None, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # type: collections.OrderedDict
+        self._loaded = False
+
+    def get(self, request_id: str) -> Optional[dict]:
+        with self._lock:
+            self._load()
+            entry = self._entries.get(request_id)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[request_id]
+                return None
+            return entry[1]
+
+    def put(self, request_id: str, response_body: dict) -> None:
+        with self._lock:
+            self._load()
+            self._entries.pop(request_id, None)
+            self._entries[request_id] = [self._clock() + self.ttl, response_body]
+            self._evict()
+            if self.persist_path:
+                cache.write_json_file(self.persist_path, list(self._entries.items()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._loaded = True
+            if self.persist_path:
+                cache.write_json_file(self.persist_path, [])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self) -> None:
+        now = self._clock()
+        for request_id in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[request_id]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if self.persist_path:
+            self._entries.update(cache.read_json_file(self.persist_path) or [])
+            self._evict()
+
+
+_store_lock = threading.Lock()
+_store = None  # type: Optional[IdempotencyStore]
+
+
+def get_store() -> IdempotencyStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LocalIdempotencyStore(persist_path=cache.persist_path('idempotency.json'))
+        return _store
+
+
+def set_store(store: Optional[IdempotencyStore]) -> None:
+    global _store
+    with _store_lock:
+        _store = store
@@ -0,0 +1,151 @@
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, Iterator, Optional, TextIO
+
+ENABLED_VARIABLE = 'DEVICE_FARM_METRICS'
+SAMPLE_RATE_VARIABLE = 'DEVICE_FARM_METRICS_SAMPLE_RATE'
+NAMESPACE = 'DeviceFarmCustomResources'
+
+
+class _NoopSpan:
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+
+    def __init__(self, recorder: 'Recorder', name: str):
+        self._recorder = recorder
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> '_Span':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._recorder.add(self._name, (time.perf_counter() - self._start) * 1000)
+
+
+class NoopRecorder:
+    # used when metrics are disabled or the invocation is not sampled
+
+    def span(self, name: str) -> _NoopSpan:
+        return _NOOP_SPAN
+
+    def add(self, name: str, milliseconds: float) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1) -> None:
+        pass
+
+
+class Recorder(NoopRecorder):
+    # Sums the durations and counts of one invocation, spans with the same name add up
+
+    def __init__(self, dimensions: Dict[str, str], sample_rate: float = 1.0):
+        self.dimensions = dimensions
+        self.sample_rate = sample_rate
+        self.timings = {}  # type: Dict[str, float]
+        self.counts = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def add(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + milliseconds
+            self.counts[name + 'Calls'] = self.counts.get(name + 'Calls', 0) + 1
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def record(self) -> dict:
+        # CloudWatch embedded metric format, CloudWatch Logs extracts the metrics from the log line
+        with self._lock:
+            timings = dict(self.timings)
+            counts = dict(self.counts)
+        definitions = [{'Name': name, 'Unit': 'Milliseconds'} for name in sorted(timings)]
+        definitions.extend({'Name': name, 'Unit': 'Count'} for name in sorted(counts))
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': definitions,
+                }],
+            },
+            'SampleRate': self.sample_rate,
+        }
+        record.update(self.dimensions)
+        record.update({name: round(value, 3) for name, value in timings.items()})
+        record.update(counts)
+        return record
+
+
+_NOOP_RECORDER = NoopRecorder()
+
+# Lambda handles one event at a time per process, so worker threads record into the same invocation
+_current = _NOOP_RECORDER  # type: NoopRecorder
+
+
+def span(name: str):
+    # with metrics.span('ListDevicePools'): ...
+    return _current.span(name)
+
+
+def add(name: str, milliseconds: float) -> None:
+    _current.add(name, milliseconds)
+
+
+def count(name: str, value: int = 1) -> None:
+    _current.count(name, value)
+
+
+def enabled() -> bool:
+    return os.environ.get(ENABLED_VARIABLE, '').lower() in ('1', 'true')
+
+
+def sample_rate() -> float:
+    return float(os.environ.get(SAMPLE_RATE_VARIABLE, '1'))
+
+
+@contextlib.contextmanager
+def invocation(resource: str, request_type: str, output: Optional[TextIO] = None) -> Iterator[NoopRecorder]:
+    # records the metrics of one handler invocation and writes them to stdout as one line at the end
+    global _current
+    recorder = _NOOP_RECORDER  # type: NoopRecorder
+    if enabled():
+        rate = sample_rate()
+        if rate >= 1 or random.random() < rate:
+            recorder = Recorder({'Resource': resource, 'RequestType': request_type}, rate)
+    previous = _current
+    _current = recorder
+    try:
+        yield recorder
+    finally:
+        _current = previous
+        if isinstance(recorder, Recorder):
+            output = output or sys.stdout
+            output.write(json.dumps(recorder.record()) + '\n')
+            output.flush()
+
+
+def reset() -> None:
+    global _current
+    _current = _NOOP_RECORDER
@@ -1,98 +1,144 @@
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Dict, Iterator, Optional
 
-import boto3
-import traceback
+from . import cache, clients, cloudformation, continuation, deadline, metrics, resource
 
-from botocore.client import BaseClient
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
 
-from . import cloudformation
+TOP_DEVICES_DEVICE_POOL_NAME = 'Top Devices'
 
-KNOWN_PROPERTIES = {'ProjectName', 'ServiceToken'}
+CURATED_POOL_CACHE_TTL = 6 * 60 * 60
+
+curated_pool_cache = cache.TtlCache(ttl=CURATED_POOL_CACHE_TTL,
+                                    persist_path=cache.persist_path('curated_device_pool_index.json'))
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def create_project(request: resource.Request) -> resource.Result:
+    client = _get_device_farm_client()
+    response = clients.call_with_backoff(client.create_project, name=request['ProjectName'])
+    return get_project_result(client, response['project']['arn'])
+
+
+def update_project(request: resource.Request) -> resource.Result:
+    client = _get_device_farm_client()
+    clients.call_with_backoff(client.update_project, arn=request.physical_resource_id, name=request['ProjectName'])
+    return get_project_result(client, request.physical_resource_id)
+
+
+def keep_project(request: resource.Request) -> resource.Result:
+    # the previous outputs are rebuilt from the curated pool cache when it is warm
+    return get_project_result(None, request.physical_resource_id)
+
+
+def delete_project(request: resource.Request) -> resource.Result:
+    project_arn = request.physical_resource_id
+    client = _get_device_farm_client()
+    if continuation.enabled():
+        delete_project_contents(client, project_arn, request.continuation)
+    clients.call_with_backoff(client.delete_project, arn=project_arn)
+    curated_pool_cache.invalidate(project_arn)
+    # CloudFormation ignores the data of a Delete, and the pools of a deleted project can't be listed
+    return resource.Result(physical_resource_id=project_arn)
+
+
+def delete_project_contents(client: 'BaseClient', project_arn: str, state: dict) -> None:
+    # Removes the finished runs and the private device pools before the project itself, so that
+    # delete_project stays short. Raises continuation.Continue when the invocation runs out of time.
+    if state.get('Phase', 'Runs') == 'Runs':
+        state['Phase'] = 'Runs'
+        continuation.remove_all(
+            (run['arn'] for run in _list(client, 'list_runs', 'runs', arn=project_arn)
+             if run.get('status') == 'COMPLETED'),
+            lambda arn: clients.call_with_backoff(client.delete_run, arn=arn),
+            state, 'Runs')
+        state['Phase'] = 'DevicePools'
+    continuation.remove_all(
+        (device_pool['arn'] for device_pool in _list(client, 'list_device_pools', 'devicePools',
+                                                     arn=project_arn, type='PRIVATE')),
+        lambda arn: clients.call_with_backoff(client.delete_device_pool, arn=arn),
+        state, 'DevicePools')
+
+
+def get_project_result(client: Optional['BaseClient'], project_arn: str) -> resource.Result:
+    curated_pools = curated_pool_cache.get_or_load(
+        project_arn, lambda: get_curated_device_pools(client or _get_device_farm_client(), project_arn))
+    return _project_result(project_arn, curated_pools)
+
+
+def _project_result(project_arn: str, curated_pools: Dict[str, str]) -> resource.Result:
+    top_devices_device_pool_arn = curated_pools.get(TOP_DEVICES_DEVICE_POOL_NAME)
+    if top_devices_device_pool_arn is None:
+        print('Top Devices device pool not found')
+    return resource.Result(
+        physical_resource_id=project_arn,
+        data={
+            'Arn': project_arn,
+            'ProjectId': get_project_id(project_arn),
+            'TopDevicesDevicePoolArn': top_devices_device_pool_arn,
+        },
+        optional_data=get_curated_device_pool_data(curated_pools),
+    )
+
+
+PROJECT = resource.CustomResource(
+    name='Project',
+    properties=[
+        resource.Property('ProjectName', required=True),
+    ],
+    create=create_project,
+    update=update_project,
+    delete=delete_project,
+    unchanged=keep_project,
+)
+
+KNOWN_PROPERTIES = PROJECT.known_properties
+
+
 def lambda_handler(event: dict, context):
-    logging.info(f"Handling Request {event}")
-    physical_resource_id = event.get('PhysicalResourceId')
-    project_name = event.get('ResourceProperties', {}).get('ProjectName', None)
-    extra_properties = set(event.get('ResourceProperties', {}).keys()).difference(KNOWN_PROPERTIES)
-
-    try:
-        if not project_name:
-            cloudformation.send_response(
-                event=event,
-                context=context,
-                status=cloudformation.Status.FAILED,
-                reason='ProjectName is not set',
-                physical_resource_id=cloudformation.RESOURCE_NOT_CREATED
-            )
-        elif extra_properties:
-            cloudformation.send_response(
-                event=event,
-                context=context,
-                status=cloudformation.Status.FAILED,
-                reason=f'Unknown properties found: {", ".join(extra_properties)}',
-                physical_resource_id=cloudformation.RESOURCE_NOT_CREATED
-            )
-        else:
-            if event['RequestType'] == 'Delete' and physical_resource_id == cloudformation.RESOURCE_NOT_CREATED:
-                cloudformation.send_response(
-                    event=event, context=context,
-                    status=cloudformation.Status.SUCCESS,
-                    physical_resource_id=physical_resource_id
-                )
-            else:
-                if event['RequestType'] == 'Delete':
-                    client = _get_device_farm_client()
-                    client.delete_project(arn=physical_resource_id)
-                elif event['RequestType'] == 'Create':
-                    client = _get_device_farm_client()
-                    response = client.create_project(name=project_name)
-                    physical_resource_id = response['project']['arn']
-                elif event['RequestType'] == 'Update':
-                    client = _get_device_farm_client()
-                    client.update_project(arn=physical_resource_id, name=project_name)
-                else:
-                    raise ValueError('Unknown RequestType ' + event['RequestType'])
-
-                top_devices_device_pool_arn = get_top_device_pool_arn(client, physical_resource_id)
-                cloudformation.send_response(
-                    event=event, context=context,
-                    status=cloudformation.Status.SUCCESS,
-                    physical_resource_id=physical_resource_id,
-                    data={
-                        'Arn': physical_resource_id,
-                        'ProjectId': get_project_id(physical_resource_id),
-                        'TopDevicesDevicePoolArn': top_devices_device_pool_arn,
-                    },
-                )
-    except Exception as e:
-        print(e)
-        traceback.print_exc()
-        physical_resource_id = physical_resource_id or cloudformation.RESOURCE_NOT_CREATED
-        cloudformation.send_response(
-            event=event,
-            context=context,
-            status=cloudformation.Status.FAILED,
-            reason=str(e),
-            physical_resource_id=physical_resource_id,
-        )
-
-    print('Finished')
-    return 'ok'
-
-
-def get_top_device_pool_arn(client: BaseClient, project_arn: str) -> Optional[str]:
+    return PROJECT.handle(event, context)
+
+
+def get_top_device_pool_arn(client: 'BaseClient', project_arn: str) -> Optional[str]:
+    top_devices_device_pool_arn = get_curated_device_pools(client, project_arn).get(TOP_DEVICES_DEVICE_POOL_NAME)
+    if top_devices_device_pool_arn is None:
+        print('Top Devices device pool not found')
+    return top_devices_device_pool_arn
+
+
+def get_curated_device_pools(client: 'BaseClient', project_arn: str) -> Dict[str, str]:
+    with metrics.span('ListCuratedPools'):
+        # a throttled page starts the listing over
+        return clients.call_with_backoff(_list_curated_device_pools, client, project_arn)
+
+
+def _list_curated_device_pools(client: 'BaseClient', project_arn: str) -> Dict[str, str]:
+    curated_pools = {}
     paginator = client.get_paginator('list_device_pools')
     for page in paginator.paginate(arn=project_arn, type='CURATED'):
+        deadline.check()
         for device_pool in page['devicePools']:
-            if device_pool['name'] == 'Top Devices':
-                return device_pool['arn']
-    print('Top Devices device pool not found')
-    return None
+            curated_pools.setdefault(device_pool['name'], device_pool['arn'])
+    return curated_pools
+
+
+def get_curated_device_pool_data(curated_pools: Dict[str, str]) -> Dict[str, str]:
+    # e.g. CuratedPool.TopDevices.Arn
+    data = {}
+    for name in sorted(curated_pools):
+        key = 'CuratedPool.' + cloudformation.attribute_name(name) + '.Arn'
+        data.setdefault(key, curated_pools[name])
+    return data
+
+
+def _list(client: 'BaseClient', operation_name: str, key: str, **kwargs) -> Iterator[dict]:
+    paginator = client.get_paginator(operation_name)
+    for page in paginator.paginate(**kwargs):
+        deadline.check()
+        yield from page[key]
 
 
 def get_project_id(project_arn: str) -> str:
@@ -100,5 +146,5 @@ def get_project_id(project_arn: str) -> str:
     return arn_parts[-1]
 
 
-def _get_device_farm_client() -> BaseClient:
-    return boto3.client('devicefarm', region_name='us-west-2')
+def _get_device_farm_client() -> 'BaseClient':
+    return clients.get_device_farm_client()
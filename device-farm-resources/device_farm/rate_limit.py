@@ -0,0 +1,207 @@
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, NamedTuple, Optional
+
+from . import clients, deadline, metrics
+
+logger = logging.getLogger()
+
+RATE_LIMITS_VARIABLE = 'DEVICE_FARM_RATE_LIMITS'
+
+# requests per second, Device Farm does not publish its limits
+DEFAULT_RATE = 10.0
+DEFAULT_RATES = {
+    'create_project': 2.0,
+    'update_project': 2.0,
+    'delete_project': 2.0,
+    'create_device_pool': 5.0,
+    'update_device_pool': 5.0,
+    'delete_device_pool': 5.0,
+}
+
+# client methods that do not call the API
+_UNLIMITED_METHODS = frozenset({'can_paginate', 'close', 'generate_presigned_url', 'get_waiter'})
+
+
+class LimiterStats(NamedTuple):
+    rate: float
+    calls: int
+    throttles: int
+    wait_time: float
+
+
+class TokenBucket:
+    # Allows rate calls per second with bursts of up to burst calls. The rate is halved on every
+    # throttled call and recovers slowly on successful calls (AIMD), between min_rate and max_rate.
+    # max_rate defaults to rate, a higher max_rate lets the rate grow past it while calls succeed.
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: Optional[float] = None,
+                 max_rate: Optional[float] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Optional[Callable[[float], Any]] = None):
+        self.initial_rate = rate
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.min_rate = min_rate if min_rate is not None else rate / 16
+        self.max_rate = max_rate if max_rate is not None else rate
+        self.tokens = self.burst
+        self.calls = 0
+        self.throttles = 0
+        self.wait_time = 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # a negative balance queues the caller behind the ones already waiting
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait > deadline.timeout(wait):
+                # the caller would still be asleep when its invocation has to answer, it leaves the queue
+                self.tokens += 1
+                raise deadline.DeadlineExceeded(f'A rate limit wait of {wait:.1f}s would pass the Lambda deadline')
+            self.calls += 1
+            self.wait_time += wait
+        if wait > 0:
+            (self._sleep or time.sleep)(wait)
+        return wait
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.initial_rate / 20)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            self.throttles += 1
+
+    def stats(self) -> LimiterStats:
+        with self._lock:
+            return LimiterStats(rate=self.rate, calls=self.calls, throttles=self.throttles, wait_time=self.wait_time)
+
+
+class RateLimiter:
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default_rate: float = DEFAULT_RATE,
+                 clock: Callable[[], float] = time.monotonic, sleep: Optional[Callable[[float], Any]] = None):
+        self.rates = dict(rates if rates is not None else DEFAULT_RATES)
+        self.default_rate = default_rate
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}  # type: Dict[str, TokenBucket]
+        self._lock = threading.Lock()
+
+    def bucket(self, operation_name: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(operation_name)
+            if bucket is None:
+                bucket = TokenBucket(self.rates.get(operation_name, self.default_rate),
+                                     clock=self._clock, sleep=self._sleep)
+                self._buckets[operation_name] = bucket
+            return bucket
+
+    def call(self, operation_name: str, function: Callable[..., Any], *args, **kwargs) -> Any:
+        bucket = self.bucket(operation_name)
+        wait = bucket.acquire()
+        if wait:
+            metrics.add('RateLimitWait', wait * 1000)
+        deadline.check()
+        try:
+            with metrics.span('DeviceFarm.' + operation_name):
+                result = function(*args, **kwargs)
+        except Exception as e:
+            if clients.is_throttling_error(e):
+                metrics.count('Throttles')
+                bucket.on_throttle()
+                logger.warning(f'{operation_name} throttled, lowering its rate to {bucket.rate:.2f}/s')
+            raise
+        bucket.on_success()
+        return result
+
+    def stats(self) -> Dict[str, LimiterStats]:
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {operation_name: bucket.stats() for operation_name, bucket in sorted(buckets.items())}
+
+
+class RateLimitedClient:
+    # Proxy for a botocore client, every API call and every page of a paginator takes a token first.
+    # Without a limiter, the shared one from get_limiter is used.
+
+    def __init__(self, client, limiter: Optional[RateLimiter] = None):
+        self._client = client
+        self._limiter = limiter
+
+    @property
+    def limiter(self) -> RateLimiter:
+        return self._limiter or get_limiter()
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._client, name)
+        if name == 'get_paginator':
+            return functools.partial(self._get_paginator, attribute)
+        if name.startswith('_') or name in _UNLIMITED_METHODS or not callable(attribute):
+            return attribute
+        return functools.partial(self.limiter.call, name, attribute)
+
+    def _get_paginator(self, get_paginator: Callable[[str], Any], operation_name: str) -> 'RateLimitedPaginator':
+        return RateLimitedPaginator(get_paginator(operation_name), operation_name, self.limiter)
+
+
+class RateLimitedPaginator:
+
+    def __init__(self, paginator, operation_name: str, limiter: RateLimiter):
+        self._paginator = paginator
+        self._operation_name = operation_name
+        self._limiter = limiter
+
+    def paginate(self, **kwargs) -> Iterator[dict]:
+        pages = iter(self._paginator.paginate(**kwargs))
+        end = object()
+        while True:
+            page = self._limiter.call(self._operation_name, next, pages, end)
+            if page is end:
+                return
+            yield page
+
+
+def parse_rates(value: str) -> Dict[str, float]:
+    # e.g. 'create_device_pool=2,list_device_pools=5'
+    rates = {}
+    for item in value.split(','):
+        if item.strip():
+            operation_name, rate = item.split('=')
+            rates[operation_name.strip()] = float(rate)
+    return rates
+
+
+_limiter_lock = threading.Lock()
+_limiter = None  # type: Optional[RateLimiter]
+
+
+def get_limiter() -> RateLimiter:
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            rates = dict(DEFAULT_RATES)
+            rates.update(parse_rates(os.environ.get(RATE_LIMITS_VARIABLE, '')))
+            _limiter = RateLimiter(rates)
+        return _limiter
+
+
+def set_limiter(limiter: Optional[RateLimiter]) -> None:
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+
+def stats() -> Dict[str, LimiterStats]:
+    return get_limiter().stats()
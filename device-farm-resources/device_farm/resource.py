@@ -0,0 +1,191 @@
+import logging
+import traceback
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from . import changes, cloudformation, continuation, deadline, metrics, structured_log
+
+logger = logging.getLogger()
+
+SERVICE_TOKEN = 'ServiceToken'
+
+
+class Property(NamedTuple):
+    name: str
+    required: bool = False
+    default: Any = None
+    # converts the raw value, a raised ValueError is reported as invalid property
+    parse: Optional[Callable[[Any], Any]] = None
+    # returns a list of errors for the parsed value
+    validate: Optional[Callable[[Any], List[str]]] = None
+
+
+class Result(NamedTuple):
+    physical_resource_id: str
+    data: Optional[Dict[str, Any]] = None
+    # added in key order as long as the response stays within CloudFormation's size limit
+    optional_data: Optional[Dict[str, Any]] = None
+
+
+class Request:
+
+    def __init__(self, event: dict, context, properties: Dict[str, Any]):
+        self.event = event
+        self.context = context
+        self.request_type = event['RequestType']  # type: str
+        self.physical_resource_id = event.get('PhysicalResourceId')  # type: Optional[str]
+        self.logical_resource_id = event.get('LogicalResourceId')  # type: Optional[str]
+        self.properties = properties
+        self.old_properties = event.get('OldResourceProperties') or {}  # type: dict
+        # checkpoint of an operation continued from a previous invocation, empty at first
+        self.continuation = continuation.get_state(event)  # type: dict
+
+    def __getitem__(self, name: str) -> Any:
+        return self.properties[name]
+
+
+class PropertyError(Exception):
+    pass
+
+
+Operation = Callable[[Request], Result]
+
+
+def parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('true', 'false'):
+        return str(value).lower() == 'true'
+    raise ValueError(f'{value} is not a boolean')
+
+
+class CustomResource:
+
+    def __init__(self, name: str, properties: Iterable[Property], create: Operation, update: Operation,
+                 delete: Operation, unchanged: Optional[Operation] = None):
+        # unchanged answers updates whose properties did not change, see changes.properties_changed
+        self.name = name
+        self.properties = tuple(properties)
+        self.create = create
+        self.update = update
+        self.delete = delete
+        self.unchanged = unchanged
+        # compiled once at import, so parsing an event is a single pass over its properties
+        self.known_properties = frozenset(prop.name for prop in self.properties) | {SERVICE_TOKEN}
+        self._by_name = {prop.name: prop for prop in self.properties}
+        self._required = tuple(prop.name for prop in self.properties if prop.required)
+        self._defaults = {prop.name: prop.default for prop in self.properties}
+        self._operations = {'Create': create, 'Update': update, 'Delete': delete}
+
+    def parse(self, raw_properties: Optional[dict], validate: bool = True) -> Dict[str, Any]:
+        # Deletes skip validation, a resource created before a validation rule was added must stay deletable
+        properties = dict(self._defaults)
+        unknown = []
+        invalid = set()
+        errors = []
+        for key, value in (raw_properties or {}).items():
+            prop = self._by_name.get(key)
+            if prop is None:
+                if key != SERVICE_TOKEN:
+                    unknown.append(key)
+                continue
+            if value is None:
+                continue
+            if prop.parse is not None:
+                try:
+                    value = prop.parse(value)
+                except (TypeError, ValueError) as e:
+                    errors.append(f'Invalid {key}: {e}')
+                    invalid.add(key)
+                    continue
+            if validate and prop.validate is not None:
+                prop_errors = prop.validate(value)
+                if prop_errors:
+                    errors.append(f'Invalid {key}: {"; ".join(prop_errors)}')
+            properties[key] = value
+
+        for name in self._required:
+            if name not in invalid and not properties.get(name):
+                raise PropertyError(f'Required property {name} not set')
+        if unknown:
+            raise PropertyError(f'Unknown properties found: {", ".join(unknown)}')
+        if errors:
+            raise PropertyError('; '.join(errors))
+        return properties
+
+    def handle(self, event: dict, context) -> str:
+        logger.info(structured_log.Message('Handling request', payload=event, **structured_log.request_fields(event)))
+        with metrics.invocation(self.name, event.get('RequestType', 'Unknown')), metrics.span('Invocation'), \
+                deadline.active(deadline.Deadline.from_context(context)) as invocation_deadline:
+            return self._handle(event, context, invocation_deadline)
+
+    def _handle(self, event: dict, context, invocation_deadline: deadline.Deadline) -> str:
+        if cloudformation.replay_response(event):
+            metrics.count('Replayed')
+            return 'ok'
+        physical_resource_id = event.get('PhysicalResourceId')
+
+        try:
+            try:
+                with metrics.span('Validate'):
+                    request = Request(event, context, self.parse(event.get('ResourceProperties'),
+                                                                 validate=event.get('RequestType') != 'Delete'))
+            except PropertyError as e:
+                metrics.count('Invalid')
+                cloudformation.send_response(
+                    event=event,
+                    context=context,
+                    status=cloudformation.Status.FAILED,
+                    reason=str(e),
+                    physical_resource_id=physical_resource_id or cloudformation.RESOURCE_NOT_CREATED,
+                )
+                return 'ok'
+
+            if request.request_type == 'Delete' and physical_resource_id == cloudformation.RESOURCE_NOT_CREATED:
+                result = Result(physical_resource_id=physical_resource_id)
+            else:
+                operation = self._operations.get(request.request_type)
+                if operation is None:
+                    raise ValueError('Unknown RequestType ' + request.request_type)
+                if request.request_type == 'Update' and self.unchanged is not None:
+                    if not changes.properties_changed(event.get('OldResourceProperties'),
+                                                      event.get('ResourceProperties')):
+                        print(f'{self.name} properties unchanged, skipping update')
+                        operation = self.unchanged
+                try:
+                    with metrics.span('Execute'):
+                        result = deadline.run(lambda: operation(request), invocation_deadline)
+                except continuation.Continue as e:
+                    metrics.count('Continued')
+                    # the response is sent by the invocation that finishes the operation
+                    continuation.get_invoker().invoke(continuation.next_event(event, e.state), context)
+                    print(f'{self.name} {request.request_type} continues in a new invocation: {e.state}')
+                    return 'ok'
+                physical_resource_id = result.physical_resource_id
+
+            cloudformation.send_response(
+                event=event, context=context,
+                status=cloudformation.Status.SUCCESS,
+                physical_resource_id=result.physical_resource_id,
+                data=cloudformation.fit_data(
+                    event=event, context=context,
+                    physical_resource_id=result.physical_resource_id,
+                    data=result.data or {},
+                    optional_data=result.optional_data,
+                ) if result.optional_data else result.data or {},
+            )
+
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            metrics.count('Failed')
+            physical_resource_id = physical_resource_id or cloudformation.RESOURCE_NOT_CREATED
+            cloudformation.send_response(
+                event=event,
+                context=context,
+                status=cloudformation.Status.FAILED,
+                reason=str(e),
+                physical_resource_id=physical_resource_id,
+            )
+
+        print('Finished')
+        return 'ok'
@@ -0,0 +1,184 @@
+import re
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from . import device_pool_rules
+
+# rule attribute -> function returning the values of a device from list_devices for that attribute
+DEVICE_ATTRIBUTES = {
+    'ARN': lambda device: [device.get('arn')],
+    'AVAILABILITY': lambda device: [device.get('availability')],
+    'FLEET_TYPE': lambda device: [device.get('fleetType')],
+    'FORM_FACTOR': lambda device: [device.get('formFactor')],
+    'INSTANCE_ARN': lambda device: [instance.get('arn') for instance in device.get('instances') or []],
+    'INSTANCE_LABELS': lambda device: [label for instance in device.get('instances') or []
+                                       for label in instance.get('labels') or []],
+    'MANUFACTURER': lambda device: [device.get('manufacturer')],
+    'MODEL': lambda device: [device.get('model')],
+    'OS_VERSION': lambda device: [device.get('os')],
+    'PLATFORM': lambda device: [device.get('platform')],
+    'REMOTE_ACCESS_ENABLED': lambda device: [device.get('remoteAccessEnabled')],
+    'REMOTE_DEBUG_ENABLED': lambda device: [device.get('remoteDebugEnabled')],
+}  # type: Dict[str, Callable[[dict], List[Any]]]
+
+_VERSION_PART = re.compile(r'\d+')
+
+
+# enumerated attributes are matched case insensitively
+_UPPER_CASE_ATTRIBUTES = frozenset(attribute for attribute, grammar in device_pool_rules.RULE_GRAMMAR.items()
+                                   if grammar.values is not None)
+
+
+def value_key(attribute: str, value: Any) -> str:
+    if attribute in _UPPER_CASE_ATTRIBUTES or isinstance(value, bool):
+        return str(value).upper()
+    return str(value)
+
+
+def version_tuple(value: str) -> Optional[Tuple[int, ...]]:
+    if not _VERSION_PART.match(value):
+        return None
+    return tuple(int(part) for part in _VERSION_PART.findall(value))
+
+
+class Column:
+    # One dictionary encoded attribute column. Instead of a code per device, every distinct value
+    # keeps a bit mask of the devices having it, so rules are evaluated with integer bit operations
+    # over the distinct values rather than by looping over all devices.
+
+    def __init__(self, masks: Optional[Dict[str, int]] = None):
+        self.masks = masks or {}  # type: Dict[str, int]
+
+    @classmethod
+    def from_rows(cls, rows: Dict[str, List[int]], size: int) -> 'Column':
+        masks = {}
+        for key, key_rows in rows.items():
+            if len(key_rows) <= 8:
+                # nearly unique values, e.g. ARNs
+                mask = 0
+                for row in key_rows:
+                    mask |= 1 << row
+            else:
+                # set the bits in a byte array first, or'ing growing ints row by row is quadratic
+                bits = bytearray((size + 7) // 8)
+                for row in key_rows:
+                    bits[row >> 3] |= 1 << (row & 7)
+                mask = int.from_bytes(bits, 'little')
+            masks[key] = mask
+        return cls(masks)
+
+    def mask(self, key: str) -> int:
+        return self.masks.get(key, 0)
+
+    def mask_where(self, predicate: Callable[[str], bool]) -> int:
+        mask = 0
+        for key, key_mask in self.masks.items():
+            if predicate(key):
+                mask |= key_mask
+        return mask
+
+
+class MatchResult(NamedTuple):
+    total: int
+    count: int
+    arns: List[str]
+
+
+class DeviceCatalog:
+
+    def __init__(self, arns: List[str], columns: Dict[str, Column]):
+        self.arns = arns
+        self.columns = columns
+        self.all_mask = (1 << len(arns)) - 1
+
+    @classmethod
+    def from_devices(cls, devices: Iterable[dict]) -> 'DeviceCatalog':
+        arns = []
+        rows = {attribute: {} for attribute in DEVICE_ATTRIBUTES}  # type: Dict[str, Dict[str, List[int]]]
+        for row, device in enumerate(devices):
+            arns.append(device['arn'])
+            for attribute, values in DEVICE_ATTRIBUTES.items():
+                attribute_rows = rows[attribute]
+                for value in values(device):
+                    if value is not None:
+                        attribute_rows.setdefault(value_key(attribute, value), []).append(row)
+        return cls(arns, {attribute: Column.from_rows(attribute_rows, len(arns))
+                          for attribute, attribute_rows in rows.items()})
+
+    def __len__(self) -> int:
+        return len(self.arns)
+
+    def match_mask(self, rules: List[dict]) -> int:
+        mask = self.all_mask
+        for rule in rules:
+            mask &= self.rule_mask(rule)
+            if not mask:
+                break
+        return mask
+
+    def rule_mask(self, rule: dict) -> int:
+        attribute = rule['attribute']
+        operator = rule['operator']
+        column = self.columns.get(attribute)
+        if column is None:
+            # attributes devices do not have, e.g. the deprecated APPIUM_VERSION, select every device
+            return self.all_mask
+        value = device_pool_rules.parse_value(rule['value'])
+        values = value if isinstance(value, list) else [value]
+        keys = {value_key(attribute, item) for item in values}
+
+        if operator == device_pool_rules.EQUALS or operator == device_pool_rules.IN:
+            return _union(column.mask(key) for key in keys)
+        if operator == device_pool_rules.NOT_IN:
+            return self.all_mask & ~_union(column.mask(key) for key in keys)
+        if operator == device_pool_rules.CONTAINS:
+            if attribute == 'INSTANCE_LABELS':
+                return _union(column.mask(key) for key in keys)
+            return column.mask_where(lambda key: any(needle in key for needle in keys))
+        if operator in device_pool_rules.COMPARISON_OPERATORS:
+            bound = version_tuple(str(value))
+            compare = _COMPARISONS[operator]
+            return column.mask_where(lambda key: _compare_versions(key, bound, compare))
+        raise ValueError(f'Unsupported operator {operator}')
+
+    def evaluate(self, rules: List[dict], max_devices: Optional[int] = None) -> MatchResult:
+        mask = self.match_mask(rules)
+        total = bin(mask).count('1')
+        count = total if max_devices is None else min(total, int(max_devices))
+        arns = []
+        for row in rows(mask):
+            if len(arns) >= count:
+                break
+            arns.append(self.arns[row])
+        return MatchResult(total=total, count=count, arns=arns)
+
+
+_COMPARISONS = {
+    device_pool_rules.LESS_THAN: lambda a, b: a < b,
+    device_pool_rules.LESS_THAN_OR_EQUALS: lambda a, b: a <= b,
+    device_pool_rules.GREATER_THAN: lambda a, b: a > b,
+    device_pool_rules.GREATER_THAN_OR_EQUALS: lambda a, b: a >= b,
+}
+
+
+def _compare_versions(key: str, bound: Optional[Tuple[int, ...]], compare) -> bool:
+    version = version_tuple(key)
+    if version is None or bound is None:
+        return False
+    # pad, so that 9 == 9.0
+    length = max(len(version), len(bound))
+    return compare(version + (0,) * (length - len(version)), bound + (0,) * (length - len(bound)))
+
+
+def rows(mask: int) -> Iterable[int]:
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+
+def _union(masks: Iterable[int]) -> int:
+    result = 0
+    for mask in masks:
+        result |= mask
+    return result
+
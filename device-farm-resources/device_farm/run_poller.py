@@ -0,0 +1,179 @@
+import concurrent.futures
+import logging
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from . import clients, deadline
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+# runs waiting for devices have no jobs yet, there is nothing to fetch but the run
+QUEUED_STATUSES = frozenset({'PENDING', 'PENDING_CONCURRENCY', 'PENDING_DEVICE', 'SCHEDULING', 'PREPARING'})
+BACKOFF_FACTOR = 1.5
+# Device Farm adds these around the suites of the test package
+SETUP_SUITES = frozenset({'Setup Suite', 'Teardown Suite'})
+
+
+class Progress(NamedTuple):
+    # kind is 'run' or 'job' when the status or counters changed, 'job_completed' with the
+    # suites and tests of a finished job, and 'run_completed' once all jobs of a run were reported
+    kind: str
+    run_arn: str
+    status: str
+    result: Optional[str]
+    counters: Dict[str, int]
+    job_arn: Optional[str] = None
+    device: Optional[str] = None
+    suites: Optional[List[dict]] = None
+    tests: Optional[Dict[str, List[dict]]] = None
+
+
+class RunPoller:
+    # Polls runs until they complete and yields Progress events as they happen. The interval
+    # drops to min_interval when something changed, grows while nothing does, and follows the
+    # expected end of runs when expected_seconds are known, e.g. from sharding.Shard.
+
+    def __init__(self, run_arns: List[str], client: Optional['BaseClient'] = None, min_interval: float = 5,
+                 max_interval: float = 60, max_concurrency: int = 8,
+                 expected_seconds: Optional[Dict[str, float]] = None, timeout: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Optional[Callable[[float], None]] = None):
+        self.client = client or clients.get_device_farm_client()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_concurrency = max_concurrency
+        self.expected_seconds = dict(expected_seconds or {})
+        self.timeout = timeout
+        self.interval = min_interval
+        self.polls = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._active = list(dict.fromkeys(run_arns))
+        self._runs = {}  # type: Dict[str, Tuple[str, Optional[str], dict]]
+        self._jobs = {}  # type: Dict[str, Tuple[str, Optional[str], dict]]
+        self._completed_jobs = set()
+        self._running_since = {}  # type: Dict[str, float]
+
+    def poll(self) -> Iterator[Progress]:
+        give_up = self._clock() + self.timeout if self.timeout is not None else None
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            while self._active:
+                self.polls += 1
+                changed = False
+                for progress in self._poll_once(executor):
+                    changed = True
+                    yield progress
+                if not self._active:
+                    return
+                self.interval = self._next_interval(changed)
+                if give_up is not None and self._clock() + self.interval > give_up:
+                    raise TimeoutError(f'{len(self._active)} runs still running after {self.timeout:g}s')
+                (self._sleep or time.sleep)(deadline.timeout(self.interval))
+
+    def _poll_once(self, executor: concurrent.futures.Executor) -> Iterator[Progress]:
+        deadline.check()
+        runs = list(executor.map(deadline.bound(self._get_run), self._active))
+        started = [run for run in runs if run['status'] not in QUEUED_STATUSES]
+        # jobs of completed runs are listed once more, so their last jobs are reported
+        job_lists = dict(zip([run['arn'] for run in started], executor.map(deadline.bound(self._list_jobs), started)))
+
+        for run in runs:
+            state = (run['status'], run.get('result'), run.get('counters', {}))
+            if self._runs.get(run['arn']) != state:
+                self._runs[run['arn']] = state
+                yield Progress('run', run['arn'], *state)
+            if run['status'] not in QUEUED_STATUSES:
+                self._running_since.setdefault(run['arn'], self._clock())
+
+            completed_jobs = []
+            for job in job_lists.get(run['arn'], []):
+                if job['arn'] in self._completed_jobs:
+                    continue
+                state = (job['status'], job.get('result'), job.get('counters', {}))
+                if self._jobs.get(job['arn']) != state:
+                    self._jobs[job['arn']] = state
+                    yield Progress('job', run['arn'], *state, job_arn=job['arn'], device=_device_name(job))
+                if job['status'] == 'COMPLETED':
+                    completed_jobs.append(job)
+
+            # completed jobs are fetched once with their suites and tests, then no longer polled
+            details = executor.map(deadline.bound(self._job_details), completed_jobs)
+            for job, (suites, tests) in zip(completed_jobs, details):
+                self._completed_jobs.add(job['arn'])
+                self._jobs.pop(job['arn'], None)
+                yield Progress('job_completed', run['arn'], job['status'], job.get('result'),
+                               job.get('counters', {}), job_arn=job['arn'], device=_device_name(job),
+                               suites=suites, tests=tests)
+
+            if run['status'] == 'COMPLETED':
+                self._active.remove(run['arn'])
+                yield Progress('run_completed', run['arn'], *self._runs[run['arn']])
+
+    def _next_interval(self, changed: bool) -> float:
+        remaining = self._remaining_seconds()
+        if remaining is not None:
+            # halve the distance to the earliest expected end, or poll closely once a run is overdue
+            interval = remaining / 2 if remaining > 0 else self.min_interval
+        elif changed:
+            interval = self.min_interval
+        else:
+            interval = self.interval * BACKOFF_FACTOR
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def _remaining_seconds(self) -> Optional[float]:
+        now = self._clock()
+        remaining = [self.expected_seconds[arn] - (now - self._running_since[arn]) for arn in self._active
+                     if arn in self.expected_seconds and arn in self._running_since]
+        return min(remaining) if remaining else None
+
+    def _get_run(self, run_arn: str) -> dict:
+        return clients.call_with_backoff(self.client.get_run, arn=run_arn)['run']
+
+    def _list_jobs(self, run: dict) -> List[dict]:
+        return self._list('list_jobs', 'jobs', run['arn'])
+
+    def _job_details(self, job: dict) -> Tuple[List[dict], Dict[str, List[dict]]]:
+        suites = self._list('list_suites', 'suites', job['arn'])
+        return suites, {suite['arn']: self._list('list_tests', 'tests', suite['arn']) for suite in suites}
+
+    def _list(self, operation_name: str, key: str, arn: str) -> List[dict]:
+        # a throttled page starts the listing over
+        paginator = self.client.get_paginator(operation_name)
+        pages = clients.call_with_backoff(lambda: list(paginator.paginate(arn=arn)))
+        return [item for page in pages for item in page[key]]
+
+
+def poll_runs(run_arns: List[str], **kwargs) -> Iterator[Progress]:
+    return RunPoller(run_arns, **kwargs).poll()
+
+
+def measured_test_durations(events: List[Progress]) -> Dict[str, float]:
+    # Measured seconds per test, averaged over devices, in the form sharding.update_durations takes.
+    # Tests are named <suite>#<test>, e.g. com.example.LoginTest#testLogin.
+    measured = {}  # type: Dict[str, List[float]]
+    for event in events:
+        if event.kind != 'job_completed':
+            continue
+        for suite in event.suites:
+            if suite['name'] in SETUP_SUITES:
+                continue
+            for test in event.tests.get(suite['arn'], []):
+                seconds = _test_seconds(test)
+                if seconds is not None:
+                    measured.setdefault(f'{suite["name"]}#{test["name"]}', []).append(seconds)
+    return {name: sum(samples) / len(samples) for name, samples in measured.items()}
+
+
+def _test_seconds(test: dict) -> Optional[float]:
+    if test.get('started') is not None and test.get('stopped') is not None:
+        elapsed = test['stopped'] - test['started']
+        # datetimes from boto3, numbers from recorded data
+        return elapsed.total_seconds() if hasattr(elapsed, 'total_seconds') else float(elapsed)
+    total = test.get('deviceMinutes', {}).get('total')
+    return total * 60 if total is not None else None
+
+
+def _device_name(job: dict) -> Optional[str]:
+    return job.get('device', {}).get('name')
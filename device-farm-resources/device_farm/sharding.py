@@ -0,0 +1,130 @@
+import heapq
+import logging
+import statistics
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional
+
+from . import cache, clients, deadline
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+# for tests without any recorded duration at all
+DEFAULT_TEST_DURATION = 10.0
+
+COUNTER_NAMES = ('total', 'passed', 'failed', 'warned', 'errored', 'stopped', 'skipped')
+# a merged result is the worst result of its runs
+RESULT_SEVERITY = ('PASSED', 'SKIPPED', 'WARNED', 'STOPPED', 'FAILED', 'ERRORED', 'PENDING')
+
+
+class Shard(NamedTuple):
+    index: int
+    tests: List[str]
+    estimated_seconds: float
+
+    @property
+    def filter(self) -> str:
+        # the instrumentation test filter of Device Farm, e.g. com.example.LoginTest#testLogin,com.example.CartTest
+        return ','.join(self.tests)
+
+
+class ShardRun(NamedTuple):
+    shard: Shard
+    device_pool_arn: str
+    run_arn: str
+
+
+class MergedResult(NamedTuple):
+    status: str
+    result: str
+    counters: Dict[str, int]
+    runs: Dict[str, dict]
+
+
+def load_durations(path: str) -> Dict[str, float]:
+    # recorded test durations in seconds, e.g. {"com.example.LoginTest#testLogin": 12.5}
+    durations = cache.read_json_file(path)
+    if not isinstance(durations, dict):
+        return {}
+    return {test: float(seconds) for test, seconds in durations.items() if isinstance(seconds, (int, float))}
+
+
+def save_durations(path: str, durations: Dict[str, float]) -> None:
+    cache.write_json_file(path, {test: round(seconds, 3) for test, seconds in sorted(durations.items())})
+
+
+def update_durations(durations: Dict[str, float], measured: Dict[str, float], weight: float = 0.5) -> Dict[str, float]:
+    # exponentially weighted, so one slow run does not reshape every later plan
+    updated = dict(durations)
+    for test, seconds in measured.items():
+        previous = updated.get(test)
+        updated[test] = seconds if previous is None else previous + weight * (seconds - previous)
+    return updated
+
+
+def plan_shards(tests: List[str], durations: Dict[str, float], shard_count: int,
+                default_duration: Optional[float] = None) -> List[Shard]:
+    # Longest processing time first: the longest test goes to the shard with the least work so far.
+    # Tests without a recorded duration are assumed to take the median of the recorded ones.
+    if shard_count < 1:
+        raise ValueError(f'Invalid shard count: {shard_count}')
+    if default_duration is None:
+        known = [durations[test] for test in tests if test in durations]
+        default_duration = statistics.median(known) if known else DEFAULT_TEST_DURATION
+    estimates = {test: durations.get(test, default_duration) for test in set(tests)}
+
+    shards = [(0.0, index, []) for index in range(min(shard_count, len(estimates)))]
+    heapq.heapify(shards)
+    for test in sorted(estimates, key=lambda test: (-estimates[test], test)):
+        load, index, shard_tests = heapq.heappop(shards)
+        shard_tests.append(test)
+        heapq.heappush(shards, (load + estimates[test], index, shard_tests))
+    return [Shard(index=index, tests=sorted(shard_tests), estimated_seconds=load)
+            for load, index, shard_tests in sorted(shards, key=lambda shard: shard[1])]
+
+
+def schedule_shards(project_arn: str, app_arn: str, test_package_arn: str, device_pool_arns: List[str],
+                    shards: List[Shard], name: str = 'Instrumentation', client: Optional['BaseClient'] = None,
+                    test_type: str = 'INSTRUMENTATION', **schedule_run_kwargs) -> List[ShardRun]:
+    # Every shard runs on every device pool, so each device still runs the whole suite across the shard runs
+    client = client or clients.get_device_farm_client()
+    shard_runs = []
+    for device_pool_arn in device_pool_arns:
+        for shard in shards:
+            deadline.check()
+            response = clients.call_with_backoff(
+                client.schedule_run, projectArn=project_arn, appArn=app_arn, devicePoolArn=device_pool_arn,
+                name=f'{name} shard {shard.index + 1}/{len(shards)}',
+                test={'type': test_type, 'testPackageArn': test_package_arn, 'filter': shard.filter},
+                **schedule_run_kwargs)
+            shard_runs.append(ShardRun(shard=shard, device_pool_arn=device_pool_arn,
+                                       run_arn=response['run']['arn']))
+            logger.info(f'Scheduled shard {shard.index + 1} with {len(shard.tests)} tests '
+                        f'(~{shard.estimated_seconds:.0f}s) as {response["run"]["arn"]}')
+    return shard_runs
+
+
+def merge_results(shard_runs: List[ShardRun], client: Optional['BaseClient'] = None) -> MergedResult:
+    client = client or clients.get_device_farm_client()
+    runs = {}
+    for shard_run in shard_runs:
+        runs[shard_run.run_arn] = clients.call_with_backoff(client.get_run, arn=shard_run.run_arn)['run']
+    return merge_runs(list(runs.values()))
+
+
+def merge_runs(runs: List[dict]) -> MergedResult:
+    counters = {name: 0 for name in COUNTER_NAMES}
+    for run in runs:
+        for name in COUNTER_NAMES:
+            counters[name] += run.get('counters', {}).get(name, 0)
+    completed = all(run['status'] == 'COMPLETED' for run in runs)
+    results = [run.get('result', 'PENDING') if run['status'] == 'COMPLETED' else 'PENDING' for run in runs]
+    result = max(results, key=_severity) if results else 'PENDING'
+    return MergedResult(status='COMPLETED' if completed else 'RUNNING', result=result, counters=counters,
+                        runs={run['arn']: run for run in runs})
+
+
+def _severity(result: str) -> int:
+    # unknown results count as errors
+    return RESULT_SEVERITY.index(result) if result in RESULT_SEVERITY else RESULT_SEVERITY.index('ERRORED')
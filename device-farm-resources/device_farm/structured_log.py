@@ -0,0 +1,111 @@
+import json
+import os
+import random
+import re
+from typing import Any
+
+REDACTED = '<redacted>'
+# the presigned ResponseURL lets anyone answer for the stack
+SENSITIVE_KEYS = frozenset({'ResponseURL'})
+# the query string of a presigned URL, e.g. in the text of a requests exception
+_QUERY_PATTERN = re.compile(r'\?[^\s\'"()<>]*=[^\s\'"()<>]*')
+
+PAYLOAD_SAMPLE_RATE_VARIABLE = 'DEVICE_FARM_LOG_PAYLOAD_SAMPLE_RATE'
+
+# bounds for logged payloads, so that the cost of a log line does not grow with the event
+MAX_STRING_LENGTH = 256
+MAX_ITEMS = 20
+MAX_DEPTH = 6
+MAX_NODES = 200
+
+
+class _Summarizer:
+
+    def __init__(self, max_string_length: int, max_items: int, max_depth: int, max_nodes: int):
+        self.max_string_length = max_string_length
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.nodes = max_nodes
+
+    def summarize(self, value: Any, depth: int = 0) -> Any:
+        self.nodes -= 1
+        if value is None or isinstance(value, (bool, int, float)):
+            return value
+        if isinstance(value, str):
+            value = redact_urls(value)
+            if len(value) <= self.max_string_length:
+                return value
+            return f'{value[:self.max_string_length]}... ({len(value)} characters)'
+        if isinstance(value, dict):
+            if depth >= self.max_depth or self.nodes <= 0:
+                return f'<{len(value)} keys>'
+            result = {}
+            for index, (key, item) in enumerate(value.items()):
+                if index >= self.max_items or self.nodes <= 0:
+                    result['...'] = f'{len(value) - index} more keys'
+                    break
+                key = str(key)
+                result[key] = REDACTED if key in SENSITIVE_KEYS else self.summarize(item, depth + 1)
+            return result
+        if isinstance(value, (list, tuple)):
+            if depth >= self.max_depth or self.nodes <= 0:
+                return f'<{len(value)} items>'
+            result = []
+            for index, item in enumerate(value):
+                if index >= self.max_items or self.nodes <= 0:
+                    result.append(f'... {len(value) - index} more items')
+                    break
+                result.append(self.summarize(item, depth + 1))
+            return result
+        return self.summarize(str(value), depth)
+
+
+def redact_urls(text: str) -> str:
+    # presigned URLs carry their credentials in the query string, the rest of the URL is kept
+    return _QUERY_PATTERN.sub('?' + REDACTED, text)
+
+
+def summarize(value: Any, max_string_length: int = MAX_STRING_LENGTH, max_items: int = MAX_ITEMS,
+              max_depth: int = MAX_DEPTH, max_nodes: int = MAX_NODES) -> Any:
+    # a JSON serializable copy of value with sensitive keys redacted and large parts truncated
+    return _Summarizer(max_string_length, max_items, max_depth, max_nodes).summarize(value)
+
+
+def payload_sample_rate() -> float:
+    return float(os.environ.get(PAYLOAD_SAMPLE_RATE_VARIABLE, '1'))
+
+
+class Message:
+    # A log message rendered as one JSON object. Nothing is formatted until a handler emits the
+    # record, so disabled log levels cost a function call. The payload is only included for a
+    # sample of the messages, see DEVICE_FARM_LOG_PAYLOAD_SAMPLE_RATE.
+
+    __slots__ = ('message', 'payload', 'fields')
+
+    def __init__(self, message: str, payload: Any = None, **fields: Any):
+        self.message = message
+        self.payload = payload
+        self.fields = fields
+
+    def to_dict(self) -> dict:
+        record = {'message': self.message}
+        record.update((key, summarize(value)) for key, value in self.fields.items())
+        if self.payload is not None:
+            rate = payload_sample_rate()
+            if rate >= 1 or random.random() < rate:
+                record['payload'] = summarize(self.payload)
+            else:
+                record['payload'] = '<not sampled>'
+        return record
+
+    def __str__(self) -> str:
+        return json.dumps(self.to_dict(), default=str)
+
+
+def request_fields(event: dict) -> dict:
+    # the fields identifying a CloudFormation request, logged with every payload sample
+    return {
+        'request_type': event.get('RequestType'),
+        'request_id': event.get('RequestId'),
+        'logical_resource_id': event.get('LogicalResourceId'),
+    }
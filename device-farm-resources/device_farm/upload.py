@@ -0,0 +1,246 @@
+import hashlib
+import logging
+import mmap
+import os
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import cache, clients, deadline, metrics, structured_log
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+logger = logging.getLogger()
+
+CHUNK_SIZE = 1024 * 1024
+PROCESSING_STATUSES = frozenset({'INITIALIZED', 'PROCESSING'})
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+
+# uploads are validated with get_upload before they are reused, the TTL only bounds the index size
+UPLOAD_INDEX_TTL = 7 * 24 * 60 * 60
+# e.g. 9f86d081...0f00a08-app-debug.apk, Device Farm checks the extension at the end of the name
+CONTENT_NAME_PATTERN = re.compile('^([0-9a-f]{64})-')
+
+# project ARN -> {'<upload type>:<sha256>': upload ARN}
+upload_index = cache.TtlCache(ttl=UPLOAD_INDEX_TTL, persist_path=cache.persist_path('upload_index.json'))
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadResult(NamedTuple):
+    arn: str
+    status: str
+    size: int
+    upload_seconds: float
+    processing_seconds: float
+    sha256: Optional[str] = None
+    reused: bool = False
+
+    @property
+    def throughput(self) -> float:
+        # bytes per second of the transfer, processing by Device Farm not included
+        return self.size / self.upload_seconds if self.upload_seconds else float('inf')
+
+
+class MappedFileReader:
+    # File-like view of a memory-mapped file for requests. The kernel pages the file in as it
+    # is sent, so memory use is bounded by the chunk size rather than by the size of the file.
+    # It has a length, so requests sends a Content-Length, which presigned S3 URLs require.
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._file = open(path, 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._position = 0
+        # empty files cannot be mapped
+        self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self._size else None
+        if self._mapped is not None and hasattr(self._mapped, 'madvise'):
+            self._mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+    def __len__(self) -> int:
+        return self._size - self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if self._mapped is None:
+            return b''
+        if size is None or size < 0:
+            size = self.chunk_size
+        end = min(self._size, self._position + min(size, self.chunk_size))
+        chunk = self._mapped[self._position:end]
+        self._position = end
+        return chunk
+
+    def close(self) -> None:
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        self._file.close()
+
+    def __enter__(self) -> 'MappedFileReader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_session_lock = threading.Lock()
+_session = None  # type: Optional[requests.Session]
+
+
+def get_session() -> requests.Session:
+    # shared between uploads, like the CloudFormation response transport
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def reset_session() -> None:
+    global _session
+    with _session_lock:
+        _session = None
+
+
+def file_sha256(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with MappedFileReader(path, chunk_size) as reader:
+        chunk = reader.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            chunk = reader.read(chunk_size)
+    return digest.hexdigest()
+
+
+def upload_file_once(project_arn: str, path: str, upload_type: str, name: Optional[str] = None,
+                     client: Optional['BaseClient'] = None, chunk_size: int = CHUNK_SIZE, **kwargs) -> UploadResult:
+    # Like upload_file, but reuses a processed upload of the same content in the project. The
+    # uploads are named after their content hash, so the index can be rebuilt from list_uploads.
+    client = client or clients.get_device_farm_client()
+    name = name or os.path.basename(path)
+    with metrics.span('UploadHash'):
+        sha256 = file_sha256(path, chunk_size)
+    key = f'{upload_type}:{sha256}'
+
+    index = upload_index.get_or_load(project_arn, lambda: load_upload_index(client, project_arn))
+    upload_arn = index.get(key)
+    if upload_arn is not None:
+        upload = _get_upload(client, upload_arn)
+        if upload is not None and upload['status'] == 'SUCCEEDED':
+            logger.info(f'Reusing upload {upload_arn} of {name}, the content is unchanged')
+            return UploadResult(arn=upload_arn, status=upload['status'], size=os.path.getsize(path),
+                                upload_seconds=0.0, processing_seconds=0.0, sha256=sha256, reused=True)
+        logger.info(f'Upload {upload_arn} can no longer be reused')
+
+    result = upload_file(project_arn, path, upload_type, name=f'{sha256}-{name}', client=client,
+                         chunk_size=chunk_size, **kwargs)
+    index = dict(upload_index.get_or_load(project_arn, lambda: {}))
+    index[key] = result.arn
+    upload_index.set(project_arn, index)
+    return result._replace(sha256=sha256)
+
+
+def load_upload_index(client: 'BaseClient', project_arn: str) -> Dict[str, str]:
+    # the newest processed upload of each content and type
+    uploads = {}  # type: Dict[str, dict]
+    paginator = client.get_paginator('list_uploads')
+    for page in paginator.paginate(arn=project_arn):
+        deadline.check()
+        for upload in page['uploads']:
+            match = CONTENT_NAME_PATTERN.match(upload.get('name', ''))
+            if match is None or upload.get('status') != 'SUCCEEDED':
+                continue
+            key = f'{upload["type"]}:{match.group(1)}'
+            if key not in uploads or upload.get('created', 0) > uploads[key].get('created', 0):
+                uploads[key] = upload
+    return {key: upload['arn'] for key, upload in uploads.items()}
+
+
+def _get_upload(client: 'BaseClient', upload_arn: str) -> Optional[dict]:
+    try:
+        return clients.call_with_backoff(client.get_upload, arn=upload_arn)['upload']
+    except Exception as e:
+        if clients.error_code(e) == 'NotFoundException':
+            return None
+        raise
+
+
+def upload_file(project_arn: str, path: str, upload_type: str, name: Optional[str] = None,
+                content_type: str = 'application/octet-stream', client: Optional['BaseClient'] = None,
+                chunk_size: int = CHUNK_SIZE, max_attempts: int = 3, poll_interval: float = 1,
+                max_poll_interval: float = 10, processing_timeout: float = 600) -> UploadResult:
+    # Uploads e.g. an ANDROID_APP or INSTRUMENTATION_TEST_PACKAGE and waits until Device Farm has processed it
+    client = client or clients.get_device_farm_client()
+    name = name or os.path.basename(path)
+    response = clients.call_with_backoff(client.create_upload, projectArn=project_arn, name=name,
+                                         type=upload_type, contentType=content_type)
+    upload_arn = response['upload']['arn']
+
+    start = time.monotonic()
+    with metrics.span('UploadPut'):
+        size = put_file(response['upload']['url'], path, content_type, chunk_size, max_attempts)
+    upload_seconds = time.monotonic() - start
+    logger.info(f'Uploaded {name}: {size / 1e6:.1f} MB in {upload_seconds:.2f}s '
+                f'({size / 1e6 / max(upload_seconds, 1e-6):.1f} MB/s)')
+
+    start = time.monotonic()
+    with metrics.span('UploadProcessing'):
+        upload = wait_for_upload(client, upload_arn, poll_interval, max_poll_interval, processing_timeout)
+    return UploadResult(arn=upload_arn, status=upload['status'], size=size, upload_seconds=upload_seconds,
+                        processing_seconds=time.monotonic() - start)
+
+
+def put_file(url: str, path: str, content_type: str, chunk_size: int = CHUNK_SIZE, max_attempts: int = 3) -> int:
+    attempt = 0
+    while True:
+        attempt += 1
+        deadline.check()
+        with MappedFileReader(path, chunk_size) as reader:
+            size = len(reader)
+            try:
+                response = get_session().put(url, data=reader, headers={'Content-Type': content_type},
+                                             timeout=(5, 60))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # the exception text holds the presigned upload URL
+                error = f'{type(e).__name__}: {structured_log.redact_urls(str(e))}'
+                if attempt >= max_attempts:
+                    raise UploadError(f'Uploading {path} failed: {error}')
+                logger.warning(f'Uploading {path} failed on attempt {attempt}: {error}')
+            else:
+                if response.status_code < 300:
+                    return size
+                if attempt >= max_attempts or response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise UploadError(f'Uploading {path} failed with HTTP {response.status_code}')
+                logger.warning(f'Uploading {path} failed with HTTP {response.status_code} on attempt {attempt}')
+        time.sleep(deadline.timeout(random.uniform(0, 2 ** attempt)))
+
+
+def wait_for_upload(client: 'BaseClient', upload_arn: str, poll_interval: float = 1, max_poll_interval: float = 10,
+                    timeout: float = 600) -> dict:
+    # polls get_upload with a growing interval, processing takes from seconds to minutes for large APKs
+    waited = 0.0
+    interval = poll_interval
+    while True:
+        upload = clients.call_with_backoff(client.get_upload, arn=upload_arn)['upload']
+        if upload['status'] == 'SUCCEEDED':
+            return upload
+        if upload['status'] not in PROCESSING_STATUSES:
+            raise UploadError(f'Processing upload {upload_arn} failed with status {upload["status"]}: '
+                              f'{upload.get("metadata") or upload.get("message", "")}')
+        if waited + interval > timeout:
+            raise UploadError(f'Upload {upload_arn} is still {upload["status"]} after {waited:g}s')
+        # get_upload checks the deadline before the next poll
+        time.sleep(deadline.timeout(interval))
+        waited += interval
+        interval = min(max_poll_interval, interval * 2)
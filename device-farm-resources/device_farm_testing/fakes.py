@@ -0,0 +1,818 @@
+import collections
+import contextlib
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Callable, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from device_farm import artifacts, clients, cloudformation, upload
+
+DEFAULT_ACCOUNT_ID = '123456789012'
+DEFAULT_PAGE_SIZE = 100
+CURATED_POOL_NAMES = ('Top Devices', 'Web Performance Test Devices')
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-(\d*)$')
+
+
+class Faults(NamedTuple):
+    # latency and jitter in seconds, rates as the probability of each call failing, and
+    # max_rate as the calls per second the service accepts before throttling (0 for no limit)
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    max_rate: float = 0.0
+
+
+def client_error(operation_name: str, code: str, message: str, status_code: int = 400) -> Exception:
+    # the error botocore raises for a failed call, imported here like boto3 in clients.get_client
+    from botocore.exceptions import ClientError
+    return ClientError({
+        'Error': {'Code': code, 'Message': message},
+        'ResponseMetadata': {'HTTPStatusCode': status_code},
+    }, operation_name)
+
+
+class _FaultInjector:
+
+    def __init__(self, faults: Faults, operation_faults: Optional[Dict[str, Faults]], seed: Optional[int],
+                 sleep: Optional[Callable[[float], None]], clock: Callable[[], float]):
+        self.faults = faults
+        self.operation_faults = dict(operation_faults or {})
+        self.throttled = {}  # type: Dict[str, int]
+        self.failed = {}  # type: Dict[str, int]
+        self._random = random.Random(seed)
+        self._sleep = sleep
+        self._clock = clock
+        self._accepted = {}  # type: Dict[str, Deque[float]]
+        self._lock = threading.Lock()
+
+    def inject(self, operation_name: str, throttle_code: str, error_code: str) -> None:
+        faults = self.operation_faults.get(operation_name, self.faults)
+        with self._lock:
+            delay = faults.latency + self._random.uniform(0, faults.jitter) if faults.jitter else faults.latency
+            draw = self._random.random()
+            throttled = draw < faults.throttle_rate or self._over_rate(operation_name, faults.max_rate)
+            failed = not throttled and draw < faults.throttle_rate + faults.error_rate
+            if throttled:
+                self.throttled[operation_name] = self.throttled.get(operation_name, 0) + 1
+            elif failed:
+                self.failed[operation_name] = self.failed.get(operation_name, 0) + 1
+        if delay > 0:
+            (self._sleep or time.sleep)(delay)
+        if throttled:
+            raise client_error(operation_name, throttle_code, 'Rate exceeded', 429)
+        if failed:
+            raise client_error(operation_name, error_code, 'Injected failure', 500)
+
+    def _over_rate(self, operation_name: str, max_rate: float) -> bool:
+        # the calls accepted during the last second, per operation
+        if max_rate <= 0:
+            return False
+        now = self._clock()
+        accepted = self._accepted.setdefault(operation_name, collections.deque())
+        while accepted and accepted[0] <= now - 1:
+            accepted.popleft()
+        if len(accepted) >= max_rate:
+            return True
+        accepted.append(now)
+        return False
+
+
+class FakePaginator:
+    # fetches one page per call to the operation, lazily like botocore's PageIterator
+
+    def __init__(self, operation: Callable[..., dict]):
+        self._operation = operation
+
+    def paginate(self, **kwargs) -> Iterator[dict]:
+        next_token = None
+        while True:
+            params = dict(kwargs, nextToken=next_token) if next_token else kwargs
+            page = self._operation(**params)
+            yield page
+            next_token = page.get('nextToken')
+            if not next_token:
+                return
+
+
+class FakeDeviceFarm:
+    # A stateful, in-process stand-in for the Device Farm operations of this package. Calls
+    # return the shapes boto3 returns, raise botocore ClientErrors, and go through the
+    # configured latency, throttling and errors. Install it with installed().
+
+    def __init__(self, page_size: int = DEFAULT_PAGE_SIZE, faults: Faults = Faults(),
+                 operation_faults: Optional[Dict[str, Faults]] = None, seed: Optional[int] = None,
+                 sleep: Optional[Callable[[float], None]] = None, clock: Callable[[], float] = time.monotonic,
+                 region: str = clients.DEFAULT_REGION, account_id: str = DEFAULT_ACCOUNT_ID,
+                 curated_pool_names: List[str] = CURATED_POOL_NAMES, processing_polls: int = 1):
+        self.page_size = page_size
+        # get_upload calls answered with PROCESSING before an upload is processed
+        self.processing_polls = processing_polls
+        self.region = region
+        self.account_id = account_id
+        self.curated_pool_names = list(curated_pool_names)
+        self.projects = {}  # type: Dict[str, dict]
+        self.device_pools = {}  # type: Dict[str, dict]
+        self.runs = {}  # type: Dict[str, dict]
+        self.devices = []  # type: List[dict]
+        self.uploads = {}  # type: Dict[str, dict]
+        # the jobs of runs, the suites of jobs and the tests of suites, by ARN
+        self.jobs = {}  # type: Dict[str, dict]
+        self.suites = {}  # type: Dict[str, dict]
+        self.tests = {}  # type: Dict[str, dict]
+        # artifacts of runs, jobs, suites and tests, by ARN
+        self.artifacts = {}  # type: Dict[str, dict]
+        self.storage = FakeUploadStorage(self)
+        self.artifact_storage = FakeArtifactStorage()
+        self.calls = {}  # type: Dict[str, int]
+        self._curated = {}  # type: Dict[str, List[dict]]
+        self._faults = _FaultInjector(faults, operation_faults, seed, sleep, clock)
+        self._ids = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def faults(self) -> Faults:
+        return self._faults.faults
+
+    @faults.setter
+    def faults(self, faults: Faults) -> None:
+        self._faults.faults = faults
+
+    @property
+    def throttled(self) -> Dict[str, int]:
+        return dict(self._faults.throttled)
+
+    @property
+    def failed(self) -> Dict[str, int]:
+        return dict(self._faults.failed)
+
+    def set_operation_faults(self, operation_name: str, faults: Optional[Faults]) -> None:
+        if faults is None:
+            self._faults.operation_faults.pop(operation_name, None)
+        else:
+            self._faults.operation_faults[operation_name] = faults
+
+    def get_paginator(self, operation_name: str) -> FakePaginator:
+        if operation_name not in ('list_artifacts', 'list_device_pools', 'list_devices', 'list_jobs', 'list_projects',
+                                  'list_runs', 'list_suites', 'list_tests', 'list_uploads'):
+            raise ValueError(f'Operation cannot be paginated: {operation_name}')
+        return FakePaginator(getattr(self, operation_name))
+
+    # projects
+
+    def create_project(self, name: str, **kwargs) -> dict:
+        self._call('create_project')
+        with self._lock:
+            project_arn = self._arn('project', self._id())
+            project = {'arn': project_arn, 'name': name, 'created': time.time()}
+            project.update(kwargs)
+            self.projects[project_arn] = project
+            return {'project': dict(project)}
+
+    def get_project(self, arn: str) -> dict:
+        self._call('get_project')
+        with self._lock:
+            return {'project': dict(self._project(arn, 'get_project'))}
+
+    def update_project(self, arn: str, name: Optional[str] = None, **kwargs) -> dict:
+        self._call('update_project')
+        with self._lock:
+            project = self._project(arn, 'update_project')
+            if name is not None:
+                project['name'] = name
+            project.update(kwargs)
+            return {'project': dict(project)}
+
+    def delete_project(self, arn: str) -> dict:
+        self._call('delete_project')
+        with self._lock:
+            self._project(arn, 'delete_project')
+            del self.projects[arn]
+            self._curated.pop(arn, None)
+            for device_pool_arn in [device_pool['arn'] for device_pool in self.device_pools.values()
+                                    if device_pool['projectArn'] == arn]:
+                del self.device_pools[device_pool_arn]
+            for run_arn in [run['arn'] for run in self.runs.values() if run['projectArn'] == arn]:
+                del self.runs[run_arn]
+            return {}
+
+    def list_projects(self, nextToken: Optional[str] = None) -> dict:
+        self._call('list_projects')
+        with self._lock:
+            return self._page('list_projects', 'projects', list(self.projects.values()), nextToken)
+
+    # device pools
+
+    def create_device_pool(self, projectArn: str, name: str, rules: List[dict], description: Optional[str] = None,
+                           maxDevices: Optional[int] = None) -> dict:
+        self._call('create_device_pool')
+        with self._lock:
+            self._project(projectArn, 'create_device_pool')
+            self._validate_rules('create_device_pool', rules)
+            device_pool = {
+                'arn': self._arn('devicepool', f'{projectArn.split(":")[-1]}/{self._id()}'),
+                'projectArn': projectArn,
+                'name': name,
+                'type': 'PRIVATE',
+                'rules': rules,
+            }
+            if description is not None:
+                device_pool['description'] = description
+            if maxDevices is not None:
+                device_pool['maxDevices'] = maxDevices
+            self.device_pools[device_pool['arn']] = device_pool
+            return {'devicePool': self._public(device_pool)}
+
+    def get_device_pool(self, arn: str) -> dict:
+        self._call('get_device_pool')
+        with self._lock:
+            return {'devicePool': self._public(self._device_pool(arn, 'get_device_pool'))}
+
+    def update_device_pool(self, arn: str, name: Optional[str] = None, description: Optional[str] = None,
+                           rules: Optional[List[dict]] = None, maxDevices: Optional[int] = None,
+                           clearMaxDevices: bool = False) -> dict:
+        self._call('update_device_pool')
+        with self._lock:
+            device_pool = self._device_pool(arn, 'update_device_pool')
+            if maxDevices is not None and clearMaxDevices:
+                raise client_error('update_device_pool', 'ArgumentException',
+                                   'maxDevices and clearMaxDevices are mutually exclusive')
+            if rules is not None:
+                self._validate_rules('update_device_pool', rules)
+                device_pool['rules'] = rules
+            if name is not None:
+                device_pool['name'] = name
+            if description is not None:
+                device_pool['description'] = description
+            if maxDevices is not None:
+                device_pool['maxDevices'] = maxDevices
+            if clearMaxDevices:
+                device_pool.pop('maxDevices', None)
+            return {'devicePool': self._public(device_pool)}
+
+    def delete_device_pool(self, arn: str) -> dict:
+        self._call('delete_device_pool')
+        with self._lock:
+            self._device_pool(arn, 'delete_device_pool')
+            del self.device_pools[arn]
+            return {}
+
+    def list_device_pools(self, arn: str, type: Optional[str] = None, nextToken: Optional[str] = None) -> dict:
+        self._call('list_device_pools')
+        with self._lock:
+            device_pools = []
+            if type in (None, 'CURATED'):
+                device_pools.extend(self._curated_pools(arn, 'list_device_pools'))
+            if type in (None, 'PRIVATE'):
+                self._project(arn, 'list_device_pools')
+                device_pools.extend(self._public(device_pool) for device_pool in self.device_pools.values()
+                                    if device_pool['projectArn'] == arn)
+            return self._page('list_device_pools', 'devicePools', device_pools, nextToken)
+
+    def add_curated_pools(self, project_arn: str, names: List[str]) -> None:
+        # e.g. to test pagination of curated pools, which the service defines per project
+        with self._lock:
+            pools = self._curated_pools(project_arn, 'list_device_pools')
+            pools.extend(self._curated_pool(project_arn, name) for name in names)
+
+    # runs
+
+    def add_run(self, project_arn: str, status: str = 'COMPLETED', name: Optional[str] = None) -> dict:
+        with self._lock:
+            self._project(project_arn, 'schedule_run')
+            run_id = self._id()
+            run = {
+                'arn': self._arn('run', f'{project_arn.split(":")[-1]}/{run_id}'),
+                'projectArn': project_arn,
+                'name': name or run_id,
+                'status': status,
+            }
+            self.runs[run['arn']] = run
+            return dict(run)
+
+    def schedule_run(self, projectArn: str, devicePoolArn: str, test: dict, appArn: Optional[str] = None,
+                     name: Optional[str] = None, **kwargs) -> dict:
+        self._call('schedule_run')
+        with self._lock:
+            self._project(projectArn, 'schedule_run')
+            curated_pools = self._curated_pools(projectArn, 'schedule_run')
+            known_pools = set(self.device_pools).union(pool['arn'] for pool in curated_pools)
+            if devicePoolArn not in known_pools:
+                raise client_error('schedule_run', 'NotFoundException', f'Device pool not found: {devicePoolArn}')
+            for upload_arn in (appArn, test.get('testPackageArn')):
+                if upload_arn is not None and self.uploads.get(upload_arn, {}).get('status') != 'SUCCEEDED':
+                    raise client_error('schedule_run', 'ArgumentException', f'Upload is not processed: {upload_arn}')
+            run_id = self._id()
+            run = {
+                'arn': self._arn('run', f'{projectArn.split(":")[-1]}/{run_id}'),
+                'projectArn': projectArn,
+                'name': name or run_id,
+                'type': test['type'],
+                'status': 'SCHEDULING',
+                'result': 'PENDING',
+                'devicePoolArn': devicePoolArn,
+                'appArn': appArn,
+                'test': dict(test),
+                'created': time.time(),
+                'counters': {},
+            }
+            self.runs[run['arn']] = run
+            return {'run': dict(run)}
+
+    def get_run(self, arn: str) -> dict:
+        self._call('get_run')
+        with self._lock:
+            run = self.runs.get(arn)
+            if run is None:
+                raise client_error('get_run', 'NotFoundException', f'Run not found: {arn}')
+            return {'run': dict(run)}
+
+    def complete_run(self, arn: str, result: str = 'PASSED', counters: Optional[Dict[str, int]] = None,
+                     **fields) -> None:
+        # e.g. when the devices have finished a scheduled run
+        with self._lock:
+            self.runs[arn].update(status='COMPLETED', result=result, counters=dict(counters or {}), **fields)
+
+    def add_job(self, run_arn: str, device_name: str, status: str = 'RUNNING', **fields) -> dict:
+        return self._add_child(self.runs, self.jobs, 'job', run_arn, device_name, status,
+                               device={'name': device_name}, **fields)
+
+    def add_suite(self, job_arn: str, name: str, status: str = 'RUNNING', **fields) -> dict:
+        return self._add_child(self.jobs, self.suites, 'suite', job_arn, name, status, **fields)
+
+    def add_test(self, suite_arn: str, name: str, status: str = 'COMPLETED', **fields) -> dict:
+        return self._add_child(self.suites, self.tests, 'test', suite_arn, name, status, **fields)
+
+    def update(self, arn: str, **fields) -> None:
+        # changes a run, job, suite or test, e.g. update(job_arn, status='COMPLETED', result='PASSED')
+        with self._lock:
+            for items in (self.runs, self.jobs, self.suites, self.tests):
+                if arn in items:
+                    items[arn].update(fields)
+                    return
+            raise KeyError(arn)
+
+    def list_jobs(self, arn: str, nextToken: Optional[str] = None) -> dict:
+        return self._list_children('list_jobs', 'jobs', self.runs, self.jobs, arn, nextToken)
+
+    def list_suites(self, arn: str, nextToken: Optional[str] = None) -> dict:
+        return self._list_children('list_suites', 'suites', self.jobs, self.suites, arn, nextToken)
+
+    def list_tests(self, arn: str, nextToken: Optional[str] = None) -> dict:
+        return self._list_children('list_tests', 'tests', self.suites, self.tests, arn, nextToken)
+
+    def _add_child(self, parents: Dict[str, dict], children: Dict[str, dict], resource_type: str, parent_arn: str,
+                   name: str, status: str, **fields) -> dict:
+        with self._lock:
+            if parent_arn not in parents:
+                raise KeyError(parent_arn)
+            child = {
+                'arn': self._arn(resource_type, f'{parent_arn.split(":")[-1]}/{self._id()}'),
+                'parentArn': parent_arn,
+                'name': name,
+                'status': status,
+                'result': 'PENDING',
+                'counters': {},
+            }
+            child.update(fields)
+            children[child['arn']] = child
+            return dict(child)
+
+    def _list_children(self, operation_name: str, key: str, parents: Dict[str, dict], children: Dict[str, dict],
+                       arn: str, next_token: Optional[str]) -> dict:
+        self._call(operation_name)
+        with self._lock:
+            if arn not in parents:
+                raise client_error(operation_name, 'NotFoundException', f'Not found: {arn}')
+            items = [{key: value for key, value in child.items() if key != 'parentArn'}
+                     for child in children.values() if child['parentArn'] == arn]
+            return self._page(operation_name, key, items, next_token)
+
+    def list_runs(self, arn: str, nextToken: Optional[str] = None) -> dict:
+        self._call('list_runs')
+        with self._lock:
+            self._project(arn, 'list_runs')
+            runs = [dict(run) for run in self.runs.values() if run['projectArn'] == arn]
+            return self._page('list_runs', 'runs', runs, nextToken)
+
+    def delete_run(self, arn: str) -> dict:
+        self._call('delete_run')
+        with self._lock:
+            run = self.runs.get(arn)
+            if run is None:
+                raise client_error('delete_run', 'NotFoundException', f'Run not found: {arn}')
+            if run['status'] != 'COMPLETED':
+                raise client_error('delete_run', 'ArgumentException', 'Run cannot be deleted while it is running')
+            del self.runs[arn]
+            return {}
+
+    # artifacts
+
+    def add_artifact(self, parent_arn: str, name: str, type: str, extension: str, content: bytes,
+                     category: Optional[str] = None) -> dict:
+        # e.g. add_artifact(job_arn, 'Video', 'VIDEO', 'mp4', b'...'), the content is served by artifact_storage
+        with self._lock:
+            if not any(parent_arn in items for items in (self.runs, self.jobs, self.suites, self.tests)):
+                raise KeyError(parent_arn)
+            artifact_arn = self._arn('artifact', f'{parent_arn.split(":")[-1]}/{self._id()}')
+            artifact = {
+                'arn': artifact_arn,
+                'parentArn': parent_arn,
+                'category': category or _artifact_category(type),
+                'name': name,
+                'type': type,
+                'extension': extension,
+                'url': f'https://prod-{self.region}-results.s3.amazonaws.com/{artifact_arn.split(":")[-1]}'
+                       f'?X-Amz-Signature={self._id()}',
+            }
+            self.artifacts[artifact_arn] = artifact
+        self.artifact_storage.put(artifact['url'], content)
+        return {key: value for key, value in artifact.items() if key not in ('parentArn', 'category')}
+
+    def list_artifacts(self, arn: str, type: str, nextToken: Optional[str] = None) -> dict:
+        # type is the category, FILE, LOG or SCREENSHOT, the artifacts of children are included
+        self._call('list_artifacts')
+        with self._lock:
+            if not any(arn in items for items in (self.runs, self.jobs, self.suites, self.tests)):
+                raise client_error('list_artifacts', 'NotFoundException', f'Not found: {arn}')
+            if type not in artifacts.ARTIFACT_CATEGORIES:
+                raise client_error('list_artifacts', 'ArgumentException', f'Invalid artifact category: {type}')
+            found = [{key: value for key, value in artifact.items() if key not in ('parentArn', 'category')}
+                     for artifact in self.artifacts.values()
+                     if artifact['category'] == type and arn in self._ancestors(artifact['parentArn'])]
+            return self._page('list_artifacts', 'artifacts', found, nextToken)
+
+    def _ancestors(self, arn: str) -> List[str]:
+        ancestors = [arn]
+        for items in (self.tests, self.suites, self.jobs):
+            if ancestors[-1] in items:
+                ancestors.append(items[ancestors[-1]]['parentArn'])
+        return ancestors
+
+    # uploads
+
+    def create_upload(self, projectArn: str, name: str, type: str, contentType: Optional[str] = None) -> dict:
+        self._call('create_upload')
+        with self._lock:
+            self._project(projectArn, 'create_upload')
+            upload_arn = self._arn('upload', f'{projectArn.split(":")[-1]}/{self._id()}')
+            upload = {
+                'arn': upload_arn,
+                'projectArn': projectArn,
+                'name': name,
+                'type': type,
+                'status': 'INITIALIZED',
+                'url': f'https://prod-{self.region}-uploads.s3.amazonaws.com/{upload_arn.split(":")[-1]}'
+                       f'?X-Amz-Signature={self._id()}',
+                'created': time.time(),
+                'polls': 0,
+            }
+            if contentType is not None:
+                upload['contentType'] = contentType
+            self.uploads[upload_arn] = upload
+            return {'upload': self._public_upload(upload)}
+
+    def get_upload(self, arn: str) -> dict:
+        self._call('get_upload')
+        with self._lock:
+            upload = self.uploads.get(arn)
+            if upload is None:
+                raise client_error('get_upload', 'NotFoundException', f'Upload not found: {arn}')
+            if upload['status'] == 'PROCESSING' or upload['status'] == 'INITIALIZED' and 'sha256' in upload:
+                upload['polls'] += 1
+                upload['status'] = 'SUCCEEDED' if upload['polls'] > self.processing_polls else 'PROCESSING'
+            return {'upload': self._public_upload(upload)}
+
+    def list_uploads(self, arn: str, type: Optional[str] = None, nextToken: Optional[str] = None) -> dict:
+        self._call('list_uploads')
+        with self._lock:
+            self._project(arn, 'list_uploads')
+            uploads = [self._public_upload(upload) for upload in self.uploads.values()
+                       if upload['projectArn'] == arn and type in (None, upload['type'])]
+            return self._page('list_uploads', 'uploads', uploads, nextToken)
+
+    def delete_upload(self, arn: str) -> dict:
+        self._call('delete_upload')
+        with self._lock:
+            if self.uploads.pop(arn, None) is None:
+                raise client_error('delete_upload', 'NotFoundException', f'Upload not found: {arn}')
+            return {}
+
+    def receive_upload(self, url: str, size: int, sha256: str) -> bool:
+        with self._lock:
+            for upload in self.uploads.values():
+                if upload['url'] == url and upload['status'] == 'INITIALIZED':
+                    upload.update(size=size, sha256=sha256)
+                    return True
+            return False
+
+    def fail_upload(self, arn: str, message: str) -> None:
+        # processing fails for the upload, e.g. an APK that cannot be parsed
+        with self._lock:
+            self.uploads[arn].update(status='FAILED', metadata=json.dumps({'errorMessage': message}))
+
+    # devices
+
+    def list_devices(self, nextToken: Optional[str] = None, **kwargs) -> dict:
+        self._call('list_devices')
+        with self._lock:
+            return self._page('list_devices', 'devices', list(self.devices), nextToken)
+
+    def _call(self, operation_name: str) -> None:
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        self._faults.inject(operation_name, 'ThrottlingException', 'ServiceUnavailableException')
+
+    def _id(self) -> str:
+        return str(uuid.UUID(int=self._ids.getrandbits(128), version=4))
+
+    def _arn(self, resource_type: str, resource_id: str) -> str:
+        return f'arn:aws:devicefarm:{self.region}:{self.account_id}:{resource_type}:{resource_id}'
+
+    def _page(self, operation_name: str, key: str, items: List[dict], next_token: Optional[str]) -> dict:
+        try:
+            start = int(next_token or 0)
+        except ValueError:
+            raise client_error(operation_name, 'ArgumentException', f'Invalid nextToken: {next_token}')
+        page = {key: items[start:start + self.page_size]}
+        if start + self.page_size < len(items):
+            page['nextToken'] = str(start + self.page_size)
+        return page
+
+    def _project(self, arn: str, operation_name: str) -> dict:
+        project = self.projects.get(arn)
+        if project is None:
+            raise client_error(operation_name, 'NotFoundException', f'Project not found: {arn}')
+        return project
+
+    def _device_pool(self, arn: str, operation_name: str) -> dict:
+        device_pool = self.device_pools.get(arn)
+        if device_pool is None:
+            raise client_error(operation_name, 'NotFoundException', f'Device pool not found: {arn}')
+        return device_pool
+
+    def _curated_pools(self, project_arn: str, operation_name: str) -> List[dict]:
+        self._project(project_arn, operation_name)
+        pools = self._curated.get(project_arn)
+        if pools is None:
+            pools = self._curated[project_arn] = [self._curated_pool(project_arn, name)
+                                                  for name in self.curated_pool_names]
+        return pools
+
+    def _curated_pool(self, project_arn: str, name: str) -> dict:
+        return {
+            'arn': self._arn('devicepool', f'{project_arn.split(":")[-1]}/{self._id()}'),
+            'name': name,
+            'type': 'CURATED',
+            'rules': [],
+        }
+
+    @staticmethod
+    def _public_upload(upload: dict) -> dict:
+        return {key: value for key, value in upload.items() if key not in ('projectArn', 'polls', 'size', 'sha256')}
+
+    @staticmethod
+    def _public(device_pool: dict) -> dict:
+        return {key: value for key, value in device_pool.items() if key != 'projectArn'}
+
+    @staticmethod
+    def _validate_rules(operation_name: str, rules: Any) -> None:
+        if not isinstance(rules, list) or not rules:
+            raise client_error(operation_name, 'ArgumentException', 'At least one rule is required')
+        for rule in rules:
+            if not isinstance(rule, dict) or not {'attribute', 'operator', 'value'}.issubset(rule):
+                raise client_error(operation_name, 'ArgumentException', f'Invalid rule: {rule}')
+
+
+def _artifact_category(artifact_type: str) -> str:
+    if artifact_type == 'SCREENSHOT':
+        return 'SCREENSHOT'
+    return 'LOG' if artifact_type.endswith('LOG') or artifact_type == 'LOGCAT' else 'FILE'
+
+
+class FakeUploadStorage(BaseAdapter):
+    # The presigned upload URLs of a FakeDeviceFarm. Reads request bodies chunk by chunk, like a
+    # socket would, and answers HTTP 503 for the next fail_next PUTs.
+
+    def __init__(self, device_farm: FakeDeviceFarm):
+        super().__init__()
+        self.device_farm = device_farm
+        self.fail_next = 0
+        self.attempts = 0
+        self.max_chunk_size = 0
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout: Any = None, verify: Any = True,
+             cert: Any = None, proxies: Any = None) -> requests.Response:
+        self.attempts += 1
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response._content = b''
+        if self.fail_next > 0:
+            self.fail_next -= 1
+            response.status_code = 503
+            return response
+
+        digest = hashlib.sha256()
+        size = 0
+        body = request.body
+        if hasattr(body, 'read'):
+            chunk = body.read(8192 * 128)
+            while chunk:
+                self.max_chunk_size = max(self.max_chunk_size, len(chunk))
+                digest.update(chunk)
+                size += len(chunk)
+                chunk = body.read(8192 * 128)
+        elif body:
+            body = body.encode('utf-8') if isinstance(body, str) else body
+            digest.update(body)
+            size = len(body)
+        found = self.device_farm.receive_upload(request.url, size, digest.hexdigest())
+        response.status_code = 200 if found else 403
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+class FakeArtifactStorage(BaseAdapter):
+    # The presigned artifact URLs of a FakeDeviceFarm. Answers GETs with Range headers like S3,
+    # streams the bodies, answers HTTP 503 for the next fail_next GETs and cuts the next
+    # response off after interrupt_after bytes, like a dropped connection.
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}  # type: Dict[str, bytes]
+        self.fail_next = 0
+        self.interrupt_after = None  # type: Optional[int]
+        self.attempts = 0
+        # (url, first byte, last byte) of the ranged GETs
+        self.ranges = []  # type: List[tuple]
+        self.max_read_size = 0
+        self._lock = threading.Lock()
+
+    def put(self, url: str, content: bytes) -> None:
+        with self._lock:
+            self.objects[url.split('?')[0]] = content
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout: Any = None, verify: Any = True,
+             cert: Any = None, proxies: Any = None) -> requests.Response:
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.headers = CaseInsensitiveDict()
+        response.raw = _ContentReader(self, b'', 0, 0)
+        with self._lock:
+            self.attempts += 1
+            content = self.objects.get(request.url.split('?')[0])
+            fail = self.fail_next > 0
+            self.fail_next = max(0, self.fail_next - 1)
+            interrupt_after = self.interrupt_after
+            self.interrupt_after = None
+        if fail or content is None:
+            response.status_code = 503 if fail else 404
+            response._content = b''
+            return response
+
+        start, end = 0, len(content) - 1
+        match = RANGE_PATTERN.match(request.headers.get('Range', ''))
+        if match is not None:
+            start = int(match.group(1))
+            end = min(end, int(match.group(2))) if match.group(2) else end
+            if start >= len(content):
+                response.status_code = 416
+                response.headers['Content-Range'] = f'bytes */{len(content)}'
+                response._content = b''
+                return response
+            response.status_code = 206
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{len(content)}'
+            with self._lock:
+                self.ranges.append((request.url, start, end))
+        else:
+            response.status_code = 200
+        response.headers['Content-Length'] = str(end + 1 - start)
+        cut = end + 1 if interrupt_after is None else min(end + 1, start + interrupt_after)
+        response.raw = _ContentReader(self, content, start, cut)
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+class _ContentReader:
+
+    def __init__(self, storage: FakeArtifactStorage, content: bytes, start: int, end: int):
+        self._storage = storage
+        self._content = memoryview(content)
+        self._position = start
+        self._end = end
+
+    def read(self, size: int = -1, **kwargs) -> bytes:
+        end = self._end if size is None or size < 0 else min(self._end, self._position + size)
+        chunk = bytes(self._content[self._position:end])
+        self._position = end
+        self._storage.max_read_size = max(self._storage.max_read_size, len(chunk))
+        return chunk
+
+    def close(self) -> None:
+        pass
+
+
+class FakeCloudFormation(BaseAdapter):
+    # A requests adapter standing in for the presigned S3 URLs CloudFormation hands out for
+    # custom resource responses. Mount it on cloudformation.get_transport().session, or use
+    # installed(). error_rate answers HTTP 503, failure_rate drops the connection.
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 failure_rate: float = 0.0, seed: Optional[int] = None,
+                 sleep: Optional[Callable[[float], None]] = None):
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.attempts = 0
+        self.responses = []  # type: List[dict]
+        self._random = random.Random(seed)
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout: Any = None, verify: Any = True,
+             cert: Any = None, proxies: Any = None) -> requests.Response:
+        with self._lock:
+            self.attempts += 1
+            delay = self.latency + self._random.uniform(0, self.jitter) if self.jitter else self.latency
+            draw = self._random.random()
+        if delay > 0:
+            (self._sleep or time.sleep)(delay)
+        if draw < self.failure_rate:
+            raise requests.ConnectionError('Injected connection failure', request=request)
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.status_code = 503 if draw < self.failure_rate + self.error_rate else 200
+        response._content = b''
+        if response.status_code == 200:
+            body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+            with self._lock:
+                self.responses.append(json.loads(body))
+        return response
+
+    def close(self) -> None:
+        pass
+
+    def mount(self, session: requests.Session) -> None:
+        session.mount('https://', self)
+        session.mount('http://', self)
+
+    def response_for(self, request_id: str) -> Optional[dict]:
+        with self._lock:
+            for response in reversed(self.responses):
+                if response.get('RequestId') == request_id:
+                    return response
+        return None
+
+
+@contextlib.contextmanager
+def installed(device_farm: FakeDeviceFarm, cloud_formation: Optional[FakeCloudFormation] = None,
+              client_latency: float = 0.0) -> Iterator[None]:
+    # Routes the package's Device Farm clients to device_farm and its CloudFormation responses
+    # to cloud_formation. Other services still get real boto3 clients. client_latency is what
+    # creating a Device Farm client costs, roughly 50-100ms for a real one.
+    import boto3
+    create_client = boto3.client
+
+    def client(service_name, *args, **kwargs):
+        if service_name == 'devicefarm':
+            if client_latency > 0:
+                time.sleep(client_latency)
+            return device_farm
+        return create_client(service_name, *args, **kwargs)
+
+    boto3.client = client
+    clients.reset()
+    cloudformation.reset_transport()
+    if cloud_formation is not None:
+        cloud_formation.mount(cloudformation.get_transport().session)
+    upload.reset_session()
+    upload.get_session().mount(f'https://prod-{device_farm.region}-uploads.s3.amazonaws.com/', device_farm.storage)
+    artifacts.reset_session()
+    artifacts.get_session().mount(f'https://prod-{device_farm.region}-results.s3.amazonaws.com/',
+                                  device_farm.artifact_storage)
+    try:
+        yield
+    finally:
+        boto3.client = create_client
+        clients.reset()
+        cloudformation.reset_transport()
+        upload.reset_session()
+        artifacts.reset_session()
@@ -0,0 +1,173 @@
+import os
+import tracemalloc
+
+import pytest
+import requests
+
+from device_farm import artifacts
+from device_farm_testing import fakes
+
+
+@pytest.fixture
+def device_farm():
+    fake = fakes.FakeDeviceFarm()
+    with fakes.installed(fake):
+        yield fake
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(artifacts.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+@pytest.fixture
+def run_arn(device_farm):
+    project_arn = device_farm.create_project(name='project')['project']['arn']
+    return device_farm.add_run(project_arn)['arn']
+
+
+def retries(caplog):
+    return sum(record.levelname == 'WARNING' and record.getMessage().startswith('Downloading')
+               for record in caplog.records)
+
+
+def content(size, seed=0):
+    return bytes((seed + index) % 251 for index in range(size))
+
+
+def add_job_artifacts(device_farm, run_arn, device_name):
+    job_arn = device_farm.add_job(run_arn, device_name, status='COMPLETED')['arn']
+    suite_arn = device_farm.add_suite(job_arn, 'com.example.LoginTest')['arn']
+    test_arn = device_farm.add_test(suite_arn, 'testLogin')['arn']
+    return {
+        'video': device_farm.add_artifact(job_arn, 'Video', 'VIDEO', 'mp4', content(5000, 1)),
+        'logcat': device_farm.add_artifact(suite_arn, 'Logcat', 'DEVICE_LOG', 'logcat', content(2500, 2)),
+        'test logcat': device_farm.add_artifact(test_arn, 'Logcat', 'DEVICE_LOG', 'logcat', content(700, 3)),
+        'screenshot': device_farm.add_artifact(test_arn, 'login screen', 'SCREENSHOT', 'png', content(1200, 4)),
+    }
+
+
+def test_download_run_artifacts(device_farm, run_arn, tmp_path, sleeps):
+    jobs = {device: add_job_artifacts(device_farm, run_arn, device) for device in ('Google Pixel 4', 'Galaxy S20')}
+
+    results = artifacts.download_run_artifacts(run_arn, str(tmp_path), exclude_types={'VIDEO'}, part_size=1000,
+                                               chunk_size=256)
+
+    assert len(results) == 6
+    for result in results:
+        assert open(result.path, 'rb').read() == device_farm.artifact_storage.objects[result.artifact.url.split('?')[0]]
+        assert result.size == os.path.getsize(result.path)
+        assert result.path.startswith(str(tmp_path))
+    # one directory per job, artifacts of the same name do not overwrite each other
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        f'{device.replace(" ", "_")}-{job["logcat"]["arn"].split("/")[2]}' for device, job in jobs.items())
+    assert len({result.path for result in results}) == 6
+    assert not any(name.endswith('.part') for _, _, names in os.walk(str(tmp_path)) for name in names)
+    # videos were not fetched, large files in ranges of part_size read in chunks of chunk_size
+    fetched = {url.split('?')[0] for url, _, _ in device_farm.artifact_storage.ranges}
+    assert all(job['video']['url'].split('?')[0] not in fetched for job in jobs.values())
+    logcat = jobs['Galaxy S20']['logcat']['url']
+    assert [(start, end) for url, start, end in device_farm.artifact_storage.ranges if url == logcat] == [
+        (0, 999), (1000, 1999), (2000, 2499)]
+    assert device_farm.artifact_storage.max_read_size == 256
+    assert device_farm.calls['list_artifacts'] == 2 * len(artifacts.ARTIFACT_CATEGORIES)
+    assert device_farm.artifact_storage.attempts == 12
+
+
+def test_download_by_type_and_category(device_farm, run_arn, tmp_path):
+    add_job_artifacts(device_farm, run_arn, 'Google Pixel 4')
+
+    results = artifacts.download_run_artifacts(run_arn, str(tmp_path), categories=['LOG'])
+
+    assert sorted(result.artifact.type for result in results) == ['DEVICE_LOG', 'DEVICE_LOG']
+    assert device_farm.calls['list_artifacts'] == 1
+    assert [artifact.type for artifact in artifacts.list_artifacts(run_arn, types={'VIDEO'})] == ['VIDEO']
+
+
+def test_download_resumes_interrupted_transfers(device_farm, run_arn, tmp_path, sleeps, caplog):
+    job_arn = device_farm.add_job(run_arn, 'Google Pixel 4')['arn']
+    video = device_farm.add_artifact(job_arn, 'Video', 'VIDEO', 'mp4', content(10000))
+    device_farm.artifact_storage.interrupt_after = 3000
+
+    result, = artifacts.download_run_artifacts(run_arn, str(tmp_path), part_size=4000)
+
+    assert open(result.path, 'rb').read() == content(10000)
+    # the dropped part continued where it broke off, with a short pause
+    assert [(start, end) for _, start, end in device_farm.artifact_storage.ranges] == [
+        (0, 3999), (3000, 6999), (7000, 9999)]
+    assert retries(caplog) == 1
+
+    # a partial file left behind by an earlier process, and a completed one that is skipped
+    os.remove(result.path)
+    with open(result.path + artifacts.PARTIAL_SUFFIX, 'wb') as f:
+        f.write(content(10000)[:6000])
+    resumed, = artifacts.download_run_artifacts(run_arn, str(tmp_path), part_size=4000)
+    skipped, = artifacts.download_run_artifacts(run_arn, str(tmp_path), part_size=4000)
+
+    assert resumed.resumed_from == 6000
+    assert open(result.path, 'rb').read() == content(10000)
+    assert device_farm.artifact_storage.ranges[-1] == (video['url'], 6000, 9999)
+    assert skipped.skipped and skipped.size == 10000
+    assert device_farm.artifact_storage.attempts == 4
+
+
+def test_download_starts_over_when_the_partial_file_does_not_match(device_farm, run_arn, tmp_path, sleeps):
+    job_arn = device_farm.add_job(run_arn, 'Google Pixel 4')['arn']
+    device_farm.add_artifact(job_arn, 'Logcat', 'DEVICE_LOG', 'logcat', content(1000))
+    artifact, = artifacts.list_artifacts(run_arn)
+    path = os.path.join(str(tmp_path), artifact.path)
+    os.makedirs(os.path.dirname(path))
+    with open(path + artifacts.PARTIAL_SUFFIX, 'wb') as f:
+        f.write(b'x' * 1500)
+
+    result, = artifacts.download_artifacts([artifact], str(tmp_path))
+
+    assert open(result.path, 'rb').read() == content(1000)
+
+
+def test_failed_downloads_do_not_stop_the_others(device_farm, run_arn, tmp_path, sleeps, caplog):
+    job_arn = device_farm.add_job(run_arn, 'Google Pixel 4')['arn']
+    for index in range(3):
+        device_farm.add_artifact(job_arn, f'Screenshot {index}', 'SCREENSHOT', 'png', content(100, index))
+    device_farm.artifact_storage.fail_next = 3
+
+    with pytest.raises(artifacts.DownloadError, match='1 of 3 artifacts failed to download'):
+        artifacts.download_run_artifacts(run_arn, str(tmp_path), max_concurrency=1, max_attempts=3)
+
+    downloaded = [name for _, _, names in os.walk(str(tmp_path)) for name in names if name.endswith('.png')]
+    assert len(downloaded) == 2
+    assert retries(caplog) == 2
+
+
+def test_signed_url_is_not_raised_or_logged(tmp_path, sleeps, caplog, requests_mock):
+    signed_url = 'https://example.com/artifacts/screenshot.png?X-Amz-Credential=AKIA&X-Amz-Signature=SECRETSIG'
+    requests_mock.get(signed_url, exc=requests.ConnectionError(
+        f"HTTPSConnectionPool(host='example.com', port=443): Max retries exceeded with url: "
+        f"{signed_url[len('https://example.com'):]}"))
+
+    with pytest.raises(artifacts.DownloadError) as e:
+        artifacts.download_file(signed_url, str(tmp_path / 'screenshot.png'), max_attempts=2)
+
+    assert 'https://example.com/artifacts/screenshot.png failed: ConnectionError' in str(e.value)
+    assert retries(caplog) == 1
+    for text in (str(e.value), caplog.text):
+        assert 'Signature' not in text
+        assert 'AKIA' not in text
+
+
+def test_download_memory_is_bounded(device_farm, run_arn, tmp_path, sleeps):
+    job_arn = device_farm.add_job(run_arn, 'Google Pixel 4')['arn']
+    device_farm.add_artifact(job_arn, 'Video', 'VIDEO', 'mp4', bytes(32 * 1024 * 1024))
+
+    tracemalloc.start()
+    try:
+        result, = artifacts.download_run_artifacts(run_arn, str(tmp_path), chunk_size=256 * 1024,
+                                                   part_size=8 * 1024 * 1024)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result.size == 32 * 1024 * 1024
+    assert peak < 4 * 1024 * 1024
@@ -0,0 +1,58 @@
+import json
+
+from benchmarks import __main__ as cli
+from benchmarks import handlers, harness, load
+from device_farm_testing import fakes
+
+
+def test_run_measures_every_handler():
+    results = handlers.run(iterations=2, import_iterations=1, curated_pool_counts=[1, 150])
+
+    for name in ('cold_import', 'project.Create', 'project.Delete', 'device_pool.Update', 'device_pool.Invalid',
+                 'project.Create.curated_pools.1', 'project.Create.curated_pools.150'):
+        assert results[name]['unit'] == 'ms'
+        assert results[name]['min'] <= results[name]['median'] <= results[name]['p95']
+    assert results['project.Create.allocations']['peak_bytes'] > 0
+
+
+def test_compare_reports_regressions():
+    baseline = harness.results_document({
+        'fast': harness.summarize([1.0, 1.0]).to_dict(),
+        'jitter': harness.summarize([0.1, 0.1]).to_dict(),
+        'memory': {'peak_bytes': 1000, 'retained_bytes': 0, 'unit': 'bytes'},
+    })
+    current = harness.results_document({
+        'fast': harness.summarize([2.0, 2.0]).to_dict(),
+        'jitter': harness.summarize([0.2, 0.2]).to_dict(),
+        'memory': {'peak_bytes': 1100, 'retained_bytes': 0, 'unit': 'bytes'},
+        'new': harness.summarize([5.0]).to_dict(),
+    })
+
+    regressions = harness.compare(baseline, current, threshold=1.25)
+
+    assert regressions == [harness.Regression(name='fast', baseline=1.0, current=2.0)]
+    assert regressions[0].ratio == 2
+
+
+def test_cli_fails_on_regression(tmp_path, monkeypatch):
+    monkeypatch.setattr(handlers, 'run', lambda **kwargs: {'project.Create': harness.summarize([2.0]).to_dict()})
+    baseline = tmp_path / 'baseline.json'
+    harness.save(str(baseline), harness.results_document({'project.Create': harness.summarize([1.0]).to_dict()}))
+
+    assert cli.main(['--quick', '--output', str(tmp_path / 'current.json')]) == 0
+    assert json.loads((tmp_path / 'current.json').read_text())['version'] == harness.RESULTS_VERSION
+    assert cli.main(['--quick', '--output', str(tmp_path / 'current.json'), '--compare', str(baseline)]) == 1
+
+
+def test_load_replays_stacks_in_containers():
+    result = load.run(stacks=4, concurrency=2, faults=fakes.Faults(),
+                      operation_faults={'update_device_pool': fakes.Faults(error_rate=1)}, client_latency=0)
+
+    assert result['events'] == 24
+    assert result['errors'] == {'ServiceUnavailableException': 4}
+    assert result['operations']['device_pool.Update']['errors'] == {'ServiceUnavailableException': 4}
+    assert result['operations']['project.Create']['count'] == 4
+    assert result['latency']['p50'] <= result['latency']['p95'] <= result['latency']['p99']
+    assert result['curated_pool_cache']['hits'] > 0
+    assert result['service']['projects'] == 0
+    assert result['service']['failed'] == 4
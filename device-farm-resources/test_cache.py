@@ -0,0 +1,85 @@
+import json
+from unittest.mock import MagicMock
+
+from device_farm import cache
+
+
+def test_get_or_load_caches_value(clock):
+    subject = cache.TtlCache(ttl=10, clock=clock)
+    loader = MagicMock(return_value='arn:top-devices')
+
+    assert subject.get_or_load('arn:project', loader) == 'arn:top-devices'
+    assert subject.get_or_load('arn:project', loader) == 'arn:top-devices'
+
+    assert loader.call_count == 1
+    assert subject.stats() == cache.CacheStats(hits=1, misses=1)
+
+
+def test_none_is_cached(clock):
+    subject = cache.TtlCache(ttl=10, clock=clock)
+    loader = MagicMock(return_value=None)
+
+    subject.get_or_load('arn:project', loader)
+    subject.get_or_load('arn:project', loader)
+
+    assert loader.call_count == 1
+
+
+def test_entries_expire(clock):
+    subject = cache.TtlCache(ttl=10, clock=clock)
+    loader = MagicMock(side_effect=['first', 'second'])
+
+    subject.get_or_load('arn:project', loader)
+    clock.now += 10
+
+    assert subject.get_or_load('arn:project', loader) == 'second'
+    assert subject.stats() == cache.CacheStats(hits=0, misses=2)
+
+
+def test_invalidate(clock):
+    subject = cache.TtlCache(ttl=10, clock=clock)
+    loader = MagicMock(side_effect=['first', 'second'])
+
+    subject.get_or_load('arn:project', loader)
+    subject.invalidate('arn:project')
+
+    assert subject.get_or_load('arn:project', loader) == 'second'
+
+
+def test_persisted_entries_are_shared(tmp_path, clock):
+    path = str(tmp_path / 'cache.json')
+    cache.TtlCache(ttl=10, persist_path=path, clock=clock).set('arn:project', 'arn:top-devices')
+    loader = MagicMock()
+
+    value = cache.TtlCache(ttl=10, persist_path=path, clock=clock).get_or_load('arn:project', loader)
+
+    assert value == 'arn:top-devices'
+    loader.assert_not_called()
+
+
+def test_expired_persisted_entries_are_dropped(tmp_path, clock):
+    path = str(tmp_path / 'cache.json')
+    cache.TtlCache(ttl=10, persist_path=path, clock=clock).set('arn:old', 'value')
+    clock.now += 20
+
+    cache.TtlCache(ttl=10, persist_path=path, clock=clock).set('arn:new', 'value')
+
+    with open(path) as f:
+        assert set(json.load(f).keys()) == {'arn:new'}
+
+
+def test_unreadable_persisted_file_is_ignored(tmp_path, clock):
+    path = tmp_path / 'cache.json'
+    path.write_text('not json')
+
+    value = cache.TtlCache(ttl=10, persist_path=str(path), clock=clock).get_or_load('arn:project', lambda: 'x')
+
+    assert value == 'x'
+
+
+def test_persist_path(monkeypatch):
+    monkeypatch.delenv(cache.CACHE_DIR_VARIABLE, raising=False)
+    assert cache.persist_path('cache.json') is None
+
+    monkeypatch.setenv(cache.CACHE_DIR_VARIABLE, '/tmp')
+    assert cache.persist_path('cache.json') == '/tmp/cache.json'
@@ -0,0 +1,56 @@
+import pytest
+
+from device_farm import changes
+
+TEST_PROPERTIES = {
+    'ServiceToken': 'arn:aws:lambda:us-west-2:account-id:function:device-pool',
+    'ProjectArn': 'arn:aws:devicefarm:us-west-2:account-id:project:12345',
+    'Name': 'device-pool-name',
+    'MaxDevices': 42,
+    'Rules': [
+        {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+        {'attribute': 'MANUFACTURER', 'operator': 'IN', 'value': '["Samsung", "Google"]'},
+    ],
+}
+
+
+def test_missing_old_properties_is_a_change():
+    assert changes.properties_changed(None, TEST_PROPERTIES)
+
+
+def test_identical_properties_are_unchanged():
+    assert not changes.properties_changed(TEST_PROPERTIES, dict(TEST_PROPERTIES))
+
+
+@pytest.mark.parametrize('new_properties', [
+    dict(TEST_PROPERTIES, ServiceToken='arn:aws:lambda:us-west-2:account-id:function:other'),
+    dict(TEST_PROPERTIES, MaxDevices='42'),
+    dict(TEST_PROPERTIES, Rules=list(reversed(TEST_PROPERTIES['Rules']))),
+    dict(TEST_PROPERTIES, Rules=[
+        {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+        {'attribute': 'MANUFACTURER', 'operator': 'IN', 'value': '["Google","Samsung"]'},
+    ]),
+])
+def test_equivalent_properties_are_unchanged(new_properties):
+    assert not changes.properties_changed(TEST_PROPERTIES, new_properties)
+
+
+@pytest.mark.parametrize('new_properties', [
+    dict(TEST_PROPERTIES, Name='other-name'),
+    dict(TEST_PROPERTIES, MaxDevices=43),
+    dict(TEST_PROPERTIES, Description='new description'),
+    dict(TEST_PROPERTIES, Rules=TEST_PROPERTIES['Rules'][:1]),
+    dict(TEST_PROPERTIES, Rules=[
+        {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"IOS"'},
+        {'attribute': 'MANUFACTURER', 'operator': 'IN', 'value': '["Samsung", "Google"]'},
+    ]),
+])
+def test_changed_properties(new_properties):
+    assert changes.properties_changed(TEST_PROPERTIES, new_properties)
+
+
+def test_order_of_equals_values_matters():
+    old = {'Rules': [{'attribute': 'ARN', 'operator': 'EQUALS', 'value': '["a", "b"]'}]}
+    new = {'Rules': [{'attribute': 'ARN', 'operator': 'EQUALS', 'value': '["b", "a"]'}]}
+
+    assert changes.properties_changed(old, new)
@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from device_farm import clients
+
+
+@pytest.fixture
+def boto3_client(monkeypatch):
+    mock = MagicMock(side_effect=lambda *args, **kwargs: MagicMock())
+    monkeypatch.setattr('boto3.client', mock)
+    return mock
+
+
+def test_client_is_reused(boto3_client):
+    first = clients.get_device_farm_client()
+    assert clients.last_client_was_warm() is False
+    second = clients.get_device_farm_client()
+    assert clients.last_client_was_warm() is True
+
+    assert first is second
+    assert boto3_client.call_count == 1
+    assert clients.stats() == clients.ClientStats(cold=1, warm=1)
+
+
+def test_clients_are_keyed_by_service_and_region(boto3_client):
+    device_farm = clients.get_client('devicefarm')
+    other_region = clients.get_client('devicefarm', region_name='eu-west-1')
+    other_service = clients.get_client('lambda')
+
+    assert len({id(device_farm), id(other_region), id(other_service)}) == 3
+    assert boto3_client.call_count == 3
+
+
+def test_configure_applies_to_new_clients(boto3_client):
+    clients.configure(max_pool_connections=50, connect_timeout=1, read_timeout=2)
+    clients.get_device_farm_client()
+
+    config = boto3_client.call_args[1]['config']
+    assert config.max_pool_connections == 50
+    assert config.connect_timeout == 1
+    assert config.read_timeout == 2
+
+
+def test_configure_drops_existing_clients(boto3_client):
+    first = clients.get_device_farm_client()
+    clients.configure(read_timeout=3)
+    second = clients.get_device_farm_client()
+
+    assert first is not second
+    assert clients.last_client_was_warm() is False
+
+
+def test_reset(boto3_client):
+    clients.get_device_farm_client()
+    clients.reset()
+
+    assert clients.stats() == clients.ClientStats(cold=0, warm=0)
+    assert clients.last_client_was_warm() is None
+    clients.get_device_farm_client()
+    assert boto3_client.call_count == 2
+
+
+def test_call_with_backoff_retries_throttling(monkeypatch):
+    sleep = MagicMock()
+    monkeypatch.setattr('time.sleep', sleep)
+    throttled = ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'ListDevicePools')
+    operation = MagicMock(side_effect=[throttled, throttled, 'result'])
+
+    assert clients.call_with_backoff(operation, 'arg', key='value') == 'result'
+
+    assert operation.call_count == 3
+    operation.assert_called_with('arg', key='value')
+    assert sleep.call_count == 2
+
+
+def test_call_with_backoff_gives_up(monkeypatch):
+    monkeypatch.setattr('time.sleep', MagicMock())
+    throttled = ClientError({'Error': {'Code': 'LimitExceededException', 'Message': 'Slow down'}}, 'CreateDevicePool')
+    operation = MagicMock(side_effect=throttled)
+
+    with pytest.raises(ClientError):
+        clients.call_with_backoff(operation, max_attempts=3)
+
+    assert operation.call_count == 3
+
+
+def test_call_with_backoff_raises_other_errors():
+    operation = MagicMock(side_effect=ValueError('boom'))
+
+    with pytest.raises(ValueError):
+        clients.call_with_backoff(operation)
+
+    assert operation.call_count == 1
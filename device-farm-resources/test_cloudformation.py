@@ -0,0 +1,152 @@
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+from requests_mock import Mocker
+
+from device_farm import cloudformation
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+TEST_EVENT = {
+    'RequestType': 'Create',
+    'LogicalResourceId': 'DeviceFarm',
+    'RequestId': '1234',
+    'ResponseURL': TEST_RESPONSE_URL,
+    'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+    'ResourceProperties': {},
+}
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    return mock
+
+
+@pytest.fixture
+def sleep(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr('time.sleep', mock)
+    return mock
+
+
+def test_send_response(context, requests_mock: Mocker):
+    requests_mock.put(TEST_RESPONSE_URL)
+
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS, data={'Arn': 'arn:foo'},
+                                 physical_resource_id='arn:foo')
+
+    assert len(requests_mock.request_history) == 1
+    assert requests_mock.request_history[0].json() == {
+        'Status': 'SUCCESS',
+        'Reason': 'See the details in CloudWatch Log Stream: stream',
+        'PhysicalResourceId': 'arn:foo',
+        'StackId': TEST_EVENT['StackId'],
+        'RequestId': '1234',
+        'LogicalResourceId': 'DeviceFarm',
+        'Data': {'Arn': 'arn:foo'},
+        'NoEcho': False,
+    }
+    assert requests_mock.request_history[0].timeout == (3.05, 10)
+    record = cloudformation.get_transport().history[-1]
+    assert record.request_id == '1234'
+    assert record.status_code == 200
+    assert record.attempts == 1
+    assert record.duration >= 0
+
+
+def test_send_response_reuses_session(context, requests_mock: Mocker):
+    requests_mock.put(TEST_RESPONSE_URL)
+
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS)
+    session = cloudformation.get_transport().session
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS)
+
+    assert cloudformation.get_transport().session is session
+    assert len(cloudformation.get_transport().history) == 2
+
+
+def test_send_response_retries_transient_failures(context, requests_mock: Mocker, sleep):
+    requests_mock.put(TEST_RESPONSE_URL, [
+        {'exc': requests.ConnectionError},
+        {'status_code': 503},
+        {'status_code': 200},
+    ])
+
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS)
+
+    assert len(requests_mock.request_history) == 3
+    assert sleep.call_count == 2
+    assert cloudformation.get_transport().history[-1].attempts == 3
+    assert cloudformation.get_transport().history[-1].status_code == 200
+
+
+def test_send_response_does_not_log_signed_url(context, requests_mock: Mocker, sleep, caplog):
+    signed_url = 'https://example.com/response?AWSAccessKeyId=AKIA&Expires=1&Signature=SECRETSIG'
+    requests_mock.put(signed_url, [
+        {'exc': requests.ConnectionError(f"HTTPSConnectionPool(host='example.com', port=443): Max retries exceeded "
+                                         f"with url: {signed_url[len('https://example.com'):]}")},
+        {'status_code': 200},
+    ])
+
+    cloudformation.send_response(dict(TEST_EVENT, ResponseURL=signed_url), context, cloudformation.Status.SUCCESS)
+
+    assert 'ConnectionError' in caplog.text
+    assert 'example.com' in caplog.text
+    assert 'Signature' not in caplog.text
+    assert 'AKIA' not in caplog.text
+
+
+def test_send_response_does_not_retry_client_errors(context, requests_mock: Mocker, sleep):
+    requests_mock.put(TEST_RESPONSE_URL, status_code=403)
+
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS)
+
+    assert len(requests_mock.request_history) == 1
+    sleep.assert_not_called()
+
+
+def test_send_response_gives_up_after_max_attempts(context, requests_mock: Mocker, sleep):
+    cloudformation.configure_transport(max_attempts=3)
+    requests_mock.put(TEST_RESPONSE_URL, exc=requests.Timeout)
+
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS)
+
+    assert len(requests_mock.request_history) == 3
+    assert sleep.call_count == 2
+    assert cloudformation.get_transport().history[-1].status_code is None
+
+
+def test_backoff_is_bounded():
+    transport = cloudformation.ResponseTransport(backoff_base=1, backoff_cap=2)
+
+    for attempt in range(1, 10):
+        assert 0 <= transport._backoff(attempt) <= 2
+
+
+def test_fit_data_keeps_everything_that_fits(context):
+    data = cloudformation.fit_data(TEST_EVENT, context, data={'Arn': 'arn:foo'},
+                                   optional_data={'B': 'b', 'A': 'a'})
+
+    assert data == {'Arn': 'arn:foo', 'A': 'a', 'B': 'b'}
+
+
+def test_fit_data_trims_deterministically(context, requests_mock: Mocker):
+    requests_mock.put(TEST_RESPONSE_URL)
+    optional_data = {f'CuratedPool.Pool{i:03}.Arn': 'arn:aws:devicefarm:us-west-2::devicepool:' + 'x' * 40
+                     for i in range(100)}
+
+    data = cloudformation.fit_data(TEST_EVENT, context, data={'Arn': 'arn:foo'}, optional_data=optional_data,
+                                   physical_resource_id='arn:foo')
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS, data=data,
+                                 physical_resource_id='arn:foo')
+
+    assert data['Arn'] == 'arn:foo'
+    kept = sorted(key for key in data if key != 'Arn')
+    assert 0 < len(kept) < len(optional_data)
+    assert kept == sorted(optional_data)[:len(kept)]
+    assert len(requests_mock.request_history[0].body) <= cloudformation.MAX_RESPONSE_SIZE
+    assert data == cloudformation.fit_data(TEST_EVENT, context, data={'Arn': 'arn:foo'},
+                                           optional_data=dict(reversed(list(optional_data.items()))),
+                                           physical_resource_id='arn:foo')
@@ -0,0 +1,170 @@
+from unittest.mock import MagicMock
+
+import pytest
+from requests_mock import Mocker
+
+from device_farm import continuation, deadline, project_resource
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+TEST_PROJECT_ARN = 'arn:aws:devicefarm:us-west-2:account-id:project:12345'
+TEST_FUNCTION_ARN = 'arn:aws:lambda:eu-west-1:123456789012:function:project'
+
+
+class FakeDeviceFarm:
+    # lists what has not been deleted yet, like the service does
+
+    def __init__(self, runs, device_pools):
+        self.runs = runs
+        self.device_pools = device_pools
+        self.delete_project = MagicMock()
+
+    def get_paginator(self, operation_name):
+        paginator = MagicMock()
+        if operation_name == 'list_runs':
+            paginator.paginate = lambda **kwargs: [{'runs': list(self.runs.values())}]
+        else:
+            paginator.paginate = lambda **kwargs: [{'devicePools': list(self.device_pools.values())
+                                                    if kwargs['type'] == 'PRIVATE' else []}]
+        return paginator
+
+    def delete_run(self, arn):
+        del self.runs[arn]
+
+    def delete_device_pool(self, arn):
+        del self.device_pools[arn]
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    mock.invoked_function_arn = TEST_FUNCTION_ARN
+    return mock
+
+
+@pytest.fixture
+def cf_endpoint():
+    with Mocker() as m:
+        yield m.put(TEST_RESPONSE_URL)
+
+
+@pytest.fixture
+def device_farm(monkeypatch):
+    runs = {f'run-{index}': {'arn': f'run-{index}', 'status': 'COMPLETED'} for index in range(5)}
+    runs['run-running'] = {'arn': 'run-running', 'status': 'RUNNING'}
+    fake = FakeDeviceFarm(runs, {f'pool-{index}': {'arn': f'pool-{index}', 'name': f'Pool {index}'}
+                                      for index in range(2)})
+    monkeypatch.setattr('boto3.client', MagicMock(return_value=fake))
+    return fake
+
+
+@pytest.fixture
+def invoker():
+    invoker = continuation.LocalInvoker()
+    continuation.set_invoker(invoker)
+    return invoker
+
+
+def test_next_event_counts_invocations():
+    event = {'RequestId': '1234'}
+
+    next_event = continuation.next_event(event, {'Phase': 'Runs'})
+
+    assert next_event[continuation.STATE_KEY] == {'Phase': 'Runs', 'Invocation': 1}
+    assert continuation.get_state(next_event) == {'Phase': 'Runs', 'Invocation': 1}
+    assert continuation.get_state(event) == {}
+    with pytest.raises(RuntimeError):
+        continuation.next_event(event, {'Invocation': continuation.MAX_INVOCATIONS})
+
+
+def test_remove_all_checkpoints_before_deadline():
+    removed = []
+    state = {}
+    clock = MagicMock(return_value=0.0)
+    current = deadline.Deadline(20, safety_margin=10, clock=clock)
+
+    def remove(item):
+        removed.append(item)
+        clock.return_value += 3
+
+    with deadline.active(current), pytest.raises(continuation.Continue) as e:
+        continuation.remove_all(range(10), remove, state, 'Items')
+
+    assert removed == [0, 1]
+    assert e.value.state == {'Removed': {'Items': 2}}
+
+
+def test_remove_all_without_deadline_removes_everything():
+    removed = []
+    state = {}
+
+    continuation.remove_all(range(10), removed.append, state, 'Items')
+
+    assert len(removed) == 10
+    assert state == {'Removed': {'Items': 10}}
+
+
+def test_lambda_invoker_invokes_function_asynchronously(monkeypatch, context):
+    lambda_client = MagicMock()
+    boto3_client = MagicMock(return_value=lambda_client)
+    monkeypatch.setattr('boto3.client', boto3_client)
+
+    continuation.LambdaInvoker().invoke({'RequestId': '1234'}, context)
+
+    assert boto3_client.call_args[0][0] == 'lambda'
+    assert boto3_client.call_args[1]['region_name'] == 'eu-west-1'
+    lambda_client.invoke.assert_called_once_with(FunctionName=TEST_FUNCTION_ARN, InvocationType='Event',
+                                                 Payload=b'{"RequestId": "1234"}')
+
+
+def test_project_delete_continues_until_done(monkeypatch, context, cf_endpoint, device_farm, invoker):
+    monkeypatch.setenv(continuation.ENABLED_VARIABLE, 'true')
+    removals = []
+
+    def should_continue(reserve=continuation.DEFAULT_RESERVE):
+        # pretend every invocation has time for two removals
+        removals.append(None)
+        return len(removals) % 3 == 0
+
+    monkeypatch.setattr(continuation, 'should_continue', should_continue)
+    event = {
+        'RequestType': 'Delete',
+        'LogicalResourceId': 'DeviceFarm',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'PhysicalResourceId': TEST_PROJECT_ARN,
+        'ResourceProperties': {'ProjectName': 'project'},
+    }
+
+    project_resource.lambda_handler(event, context)
+
+    assert not cf_endpoint.called
+    assert len(invoker.events) == 1
+    assert invoker.events[0][continuation.STATE_KEY] == {'Phase': 'Runs', 'Removed': {'Runs': 2}, 'Invocation': 1}
+
+    assert invoker.run(project_resource.lambda_handler, context) == 3
+    assert len(cf_endpoint.request_history) == 1
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert list(device_farm.runs) == ['run-running']
+    assert device_farm.device_pools == {}
+    device_farm.delete_project.assert_called_once_with(arn=TEST_PROJECT_ARN)
+
+
+def test_project_delete_without_continuations(context, cf_endpoint, device_farm, invoker):
+    event = {
+        'RequestType': 'Delete',
+        'LogicalResourceId': 'DeviceFarm',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'PhysicalResourceId': TEST_PROJECT_ARN,
+        'ResourceProperties': {'ProjectName': 'project'},
+    }
+
+    project_resource.lambda_handler(event, context)
+
+    assert len(invoker.events) == 0
+    assert len(device_farm.runs) == 6
+    device_farm.delete_project.assert_called_once_with(arn=TEST_PROJECT_ARN)
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
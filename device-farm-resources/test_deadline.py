@@ -0,0 +1,192 @@
+import concurrent.futures
+import queue
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from requests_mock import Mocker
+
+from device_farm import clients, cloudformation, deadline, resource
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    mock.get_remaining_time_in_millis.return_value = 1500
+    return mock
+
+
+@pytest.fixture
+def cf_endpoint():
+    with Mocker() as m:
+        yield m.put(TEST_RESPONSE_URL)
+
+
+@pytest.fixture
+def sleep(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr(time, 'sleep', mock)
+    return mock
+
+
+def test_remaining_keeps_safety_margin(clock):
+    current = deadline.Deadline(30, safety_margin=10, clock=clock)
+
+    assert current.remaining() == 20
+    assert current.time_left() == 30
+    assert current.timeout(5) == 5
+    clock.now += 25
+    assert current.remaining() == 0
+    assert current.timeout(5) == 0
+    assert current.expired
+    with pytest.raises(deadline.DeadlineExceeded):
+        current.check()
+
+
+def test_from_context_without_remaining_time_is_unbounded():
+    current = deadline.Deadline.from_context(object())
+
+    assert current.remaining() is None
+    assert not current.expired
+    assert current.timeout(5) == 5
+
+
+def test_from_context_reads_safety_margin(monkeypatch, context):
+    monkeypatch.setenv(deadline.SAFETY_MARGIN_VARIABLE, '1')
+
+    current = deadline.Deadline.from_context(context)
+
+    assert current.safety_margin == 1
+    assert 0.4 < current.remaining() <= 0.5
+
+
+def test_run_returns_result_and_raises_errors():
+    current = deadline.Deadline(10, safety_margin=1)
+
+    assert deadline.run(lambda: 'result', current) == 'result'
+    with pytest.raises(ValueError):
+        deadline.run(lambda: int('x'), current)
+    assert not current.cancelled
+
+
+def test_run_cancels_stalled_work():
+    current = deadline.Deadline(0.3, safety_margin=0.1)
+
+    start = time.monotonic()
+    with pytest.raises(deadline.DeadlineExceeded):
+        deadline.run(lambda: time.sleep(2), current)
+
+    assert time.monotonic() - start < 1
+    assert current.cancelled
+
+
+def test_call_with_backoff_stops_when_cancelled():
+    current = deadline.Deadline(10, safety_margin=1)
+    operation = MagicMock()
+    current.cancel()
+
+    with deadline.active(current), pytest.raises(deadline.DeadlineExceeded):
+        clients.call_with_backoff(operation)
+
+    operation.assert_not_called()
+
+
+def test_call_with_backoff_does_not_sleep_past_deadline(monkeypatch, clock, sleep):
+    monkeypatch.setattr(clients.random, 'uniform', lambda low, high: high)
+    current = deadline.Deadline(1.1, safety_margin=1, clock=clock)
+    operation = MagicMock(side_effect=ClientError({'Error': {'Code': 'ThrottlingException'}}, 'ListDevices'))
+
+    with deadline.active(current), pytest.raises(ClientError):
+        clients.call_with_backoff(operation)
+
+    assert operation.call_count == 1
+    sleep.assert_not_called()
+
+
+def test_active_restores_previous_deadline():
+    current = deadline.Deadline(10)
+
+    with deadline.active(current):
+        assert deadline.current() is current
+    assert deadline.current() is None
+
+
+def test_response_is_not_retried_past_invocation_end(clock, sleep):
+    with Mocker() as m:
+        endpoint = m.put(TEST_RESPONSE_URL, status_code=503)
+        current = deadline.Deadline(2, safety_margin=1, clock=clock)
+        with deadline.active(current):
+            cloudformation.get_transport().put(TEST_RESPONSE_URL, b'{}', '1234')
+
+    assert endpoint.call_count == 1
+    sleep.assert_not_called()
+
+
+def test_handler_answers_before_deadline(monkeypatch, context, cf_endpoint):
+    monkeypatch.setenv(deadline.SAFETY_MARGIN_VARIABLE, '1')
+    stalled = resource.CustomResource(
+        name='Stalled',
+        properties=[],
+        create=lambda request: time.sleep(3),
+        update=MagicMock(),
+        delete=MagicMock(),
+    )
+    event = {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'Stalled',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': {},
+    }
+
+    start = time.monotonic()
+    stalled.handle(event, context)
+
+    assert time.monotonic() - start < 1
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'Timed out, stopped 1s before the Lambda deadline'
+    assert response['PhysicalResourceId'] == 'ResourceNotCreated'
+
+
+def test_abandoned_worker_keeps_its_cancelled_deadline():
+    # invocation 1 times out, its worker must not pass check() once invocation 2 has started
+    first = deadline.Deadline(0.3, safety_margin=0.1)
+    resume = threading.Event()
+    checked = queue.Queue()
+
+    def stalled():
+        resume.wait(5)
+        try:
+            deadline.check()
+            checked.put('passed')
+        except deadline.DeadlineExceeded:
+            checked.put('stopped')
+
+    with deadline.active(first), pytest.raises(deadline.DeadlineExceeded):
+        deadline.run(stalled, first)
+
+    second = deadline.Deadline(10, safety_margin=1)
+    with deadline.active(second):
+        resume.set()
+        assert checked.get(timeout=5) == 'stopped'
+    assert not second.cancelled
+
+
+def test_bound_carries_deadline_into_thread_pools():
+    first = deadline.Deadline(10)
+    second = deadline.Deadline(10)
+
+    with deadline.active(first):
+        bound_current = deadline.bound(deadline.current)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            assert [future.result() for future in [executor.submit(bound_current) for _ in range(2)]] == [first] * 2
+    with deadline.active(second), concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(bound_current).result() is first
+        assert executor.submit(deadline.current).result() is second
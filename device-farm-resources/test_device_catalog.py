@@ -0,0 +1,200 @@
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from device_farm import device_catalog
+
+TEST_DEVICES = [
+    {
+        'arn': 'arn:device:pixel',
+        'platform': 'ANDROID',
+        'formFactor': 'PHONE',
+        'manufacturer': 'Google',
+        'model': 'Google Pixel 3',
+        'os': '10',
+        'availability': 'HIGHLY_AVAILABLE',
+        'remoteAccessEnabled': True,
+    },
+    {
+        'arn': 'arn:device:galaxy-tab',
+        'platform': 'ANDROID',
+        'formFactor': 'TABLET',
+        'manufacturer': 'Samsung',
+        'model': 'Galaxy Tab S4',
+        'os': '9',
+        'availability': 'AVAILABLE',
+        'remoteAccessEnabled': False,
+    },
+    {
+        'arn': 'arn:device:iphone',
+        'platform': 'IOS',
+        'formFactor': 'PHONE',
+        'manufacturer': 'Apple',
+        'model': 'Apple iPhone XR',
+        'os': '12.4.1',
+        'availability': 'BUSY',
+        'remoteAccessEnabled': True,
+    },
+]
+
+
+def _client(*pages):
+    client = MagicMock()
+    client.get_paginator().paginate = MagicMock(return_value=[{'devices': devices} for devices in pages])
+    return client
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    path = str(tmp_path / 'devices.jsonl')
+    device_catalog.write_snapshot(path, TEST_DEVICES)
+    return path
+
+
+def test_snapshot_records(snapshot_path):
+    snapshot = device_catalog.DeviceCatalogSnapshot(snapshot_path)
+
+    assert len(snapshot) == 3
+    assert snapshot.arns == ['arn:device:galaxy-tab', 'arn:device:iphone', 'arn:device:pixel']
+    assert snapshot.device(1) == TEST_DEVICES[2]
+    assert list(snapshot.devices()) == [TEST_DEVICES[1], TEST_DEVICES[2], TEST_DEVICES[0]]
+
+
+@pytest.mark.parametrize('criteria,expected_arns', [
+    ({}, ['arn:device:galaxy-tab', 'arn:device:iphone', 'arn:device:pixel']),
+    ({'platform': 'ANDROID'}, ['arn:device:galaxy-tab', 'arn:device:pixel']),
+    ({'platform': 'android', 'form_factor': 'PHONE'}, ['arn:device:pixel']),
+    ({'manufacturer': ['Apple', 'Google']}, ['arn:device:iphone', 'arn:device:pixel']),
+    ({'os_version': '9', 'availability': 'AVAILABLE'}, ['arn:device:galaxy-tab']),
+    ({'os_version': '9', 'availability': 'BUSY'}, []),
+    ({'platform': None}, ['arn:device:galaxy-tab', 'arn:device:iphone', 'arn:device:pixel']),
+])
+def test_find(snapshot_path, criteria, expected_arns):
+    assert device_catalog.load(snapshot_path).find(**criteria) == expected_arns
+
+
+def test_snapshot_catalog_evaluates_rules(snapshot_path):
+    catalog = device_catalog.load(snapshot_path).catalog()
+
+    result = catalog.evaluate([{'attribute': 'REMOTE_ACCESS_ENABLED', 'operator': 'EQUALS', 'value': 'true'}])
+
+    assert result.arns == ['arn:device:iphone', 'arn:device:pixel']
+
+
+def test_snapshot_catalog_uses_header_indexes(snapshot_path, monkeypatch):
+    snapshot = device_catalog.DeviceCatalogSnapshot(snapshot_path)
+    monkeypatch.setattr(snapshot, 'record', MagicMock(side_effect=AssertionError('record decoded')))
+
+    result = snapshot.catalog().evaluate([
+        {'attribute': 'MODEL', 'operator': 'CONTAINS', 'value': 'Galaxy'},
+        {'attribute': 'ARN', 'operator': 'NOT_IN', 'value': '["arn:device:pixel"]'},
+    ])
+
+    assert result.arns == ['arn:device:galaxy-tab']
+
+
+def test_load_reuses_snapshot_until_file_changes(snapshot_path):
+    snapshot = device_catalog.load(snapshot_path)
+    assert device_catalog.load(snapshot_path) is snapshot
+
+    device_catalog.write_snapshot(snapshot_path, TEST_DEVICES[:1])
+    os.utime(snapshot_path, (0, 0))
+
+    assert len(device_catalog.load(snapshot_path)) == 1
+    assert snapshot._mmap.closed
+    assert snapshot.catalog().arns == [device['arn'] for device in sorted(TEST_DEVICES, key=lambda d: d['arn'])]
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'devices.json'
+    path.write_text(json.dumps(TEST_DEVICES))
+
+    with pytest.raises(ValueError):
+        device_catalog.DeviceCatalogSnapshot(str(path))
+
+
+def test_sync_creates_snapshot(tmp_path):
+    path = str(tmp_path / 'devices.jsonl')
+
+    result = device_catalog.sync(_client(TEST_DEVICES[:2], TEST_DEVICES[2:]), path)
+
+    assert result == device_catalog.SyncResult(refreshed=True, added=3)
+    assert len(device_catalog.load(path)) == 3
+
+
+def test_sync_detects_changes(snapshot_path):
+    changed_device = dict(TEST_DEVICES[0], availability='BUSY')
+    new_device = dict(TEST_DEVICES[0], arn='arn:device:new')
+    old_snapshot = device_catalog.load(snapshot_path)
+
+    result = device_catalog.sync(_client([changed_device, TEST_DEVICES[1], new_device]), snapshot_path)
+
+    assert result == device_catalog.SyncResult(refreshed=True, added=1, removed=1, changed=1, unchanged=1)
+    assert old_snapshot._mmap.closed
+    snapshot = device_catalog.load(snapshot_path)
+    assert snapshot.find(availability='BUSY') == ['arn:device:pixel']
+    assert snapshot.arns == ['arn:device:galaxy-tab', 'arn:device:new', 'arn:device:pixel']
+
+
+def test_sync_keeps_unchanged_snapshot(snapshot_path):
+    with open(snapshot_path, 'rb') as f:
+        content = f.read()
+    os.utime(snapshot_path, (0, 0))
+    snapshot = device_catalog.load(snapshot_path)
+
+    result = device_catalog.sync(_client(TEST_DEVICES), snapshot_path, clock=lambda: 1000.0)
+
+    assert result == device_catalog.SyncResult(refreshed=True, unchanged=3)
+    assert device_catalog.synced_at(snapshot_path) == 1000.0
+    assert os.path.getmtime(snapshot_path) == 0
+    assert device_catalog.load(snapshot_path) is snapshot
+    with open(snapshot_path, 'rb') as f:
+        assert f.read() == content
+    assert device_catalog.sync(_client(TEST_DEVICES), snapshot_path, max_age=60,
+                               clock=lambda: 1030.0) == device_catalog.SyncResult(refreshed=False)
+
+
+def test_sync_skips_fresh_snapshot(snapshot_path):
+    client = _client(TEST_DEVICES)
+
+    result = device_catalog.sync(client, snapshot_path, max_age=60)
+
+    assert result == device_catalog.SyncResult(refreshed=False)
+    client.get_paginator().paginate.assert_not_called()
+
+
+def test_load_catalog_from_device_list(tmp_path, monkeypatch):
+    path = tmp_path / 'devices.json'
+    path.write_text(json.dumps({'devices': TEST_DEVICES}))
+    monkeypatch.setenv(device_catalog.CATALOG_PATH_VARIABLE, str(path))
+    monkeypatch.delenv(device_catalog.MAX_AGE_VARIABLE, raising=False)
+
+    catalog = device_catalog.load_catalog(MagicMock())
+
+    assert len(catalog) == 3
+    assert device_catalog.load_catalog(MagicMock()) is catalog
+
+
+def test_load_catalog_syncs_stale_snapshot(tmp_path, monkeypatch):
+    path = str(tmp_path / 'devices.jsonl')
+    monkeypatch.setenv(device_catalog.CATALOG_PATH_VARIABLE, path)
+    monkeypatch.setenv(device_catalog.MAX_AGE_VARIABLE, '3600')
+    client_factory = MagicMock(return_value=_client(TEST_DEVICES))
+
+    assert len(device_catalog.load_catalog(client_factory)) == 3
+    assert len(device_catalog.load_catalog(client_factory)) == 3
+    assert client_factory.call_count == 1
+
+
+def test_load_catalog_not_configured(monkeypatch):
+    monkeypatch.delenv(device_catalog.CATALOG_PATH_VARIABLE, raising=False)
+
+    assert device_catalog.load_catalog(MagicMock()) is None
+
+
+def test_main_find(snapshot_path, capsys):
+    device_catalog.main(['find', snapshot_path, '--platform', 'ANDROID', '--form-factor', 'TABLET'])
+
+    assert capsys.readouterr().out == 'arn:device:galaxy-tab\n'
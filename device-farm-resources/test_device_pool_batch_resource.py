@@ -0,0 +1,297 @@
+import uuid
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from requests_mock import Mocker
+
+from device_farm import cloudformation, device_pool_batch_resource, rate_limit
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+TEST_PROJECT_ARN = 'arn:aws:devicefarm:us-west-2:account-id:project:12345'
+TEST_BATCH_ID = 'create-request-id'
+TEST_PHYSICAL_RESOURCE_ID = TEST_PROJECT_ARN + '/device-pool-batch/DevicePools/' + TEST_BATCH_ID
+TEST_BATCH_TAGS = [{'Key': 'DevicePoolBatch', 'Value': TEST_BATCH_ID}]
+TEST_RULES = [{
+    'attribute': 'PLATFORM',
+    'operator': 'EQUALS',
+    'value': '"ANDROID"',
+}]
+TEST_DEVICE_POOLS = [
+    {'Name': 'phones', 'Rules': TEST_RULES, 'MaxDevices': '5'},
+    {'Name': 'tablets', 'Rules': TEST_RULES, 'Description': 'Tablets'},
+]
+TEST_VALID_RESOURCE_PROPERTIES = {
+    'ProjectArn': TEST_PROJECT_ARN,
+    'DevicePools': TEST_DEVICE_POOLS,
+}
+
+
+def _throttling_error(operation_name):
+    return ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, operation_name)
+
+
+def _raise(error):
+    raise error
+
+
+def _event(request_type, resource_properties=TEST_VALID_RESOURCE_PROPERTIES, **kwargs):
+    event = {
+        'RequestType': request_type,
+        'LogicalResourceId': 'DevicePools',
+        'RequestId': TEST_BATCH_ID,
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': resource_properties,
+    }
+    event.update(kwargs)
+    return event
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    return mock
+
+
+@pytest.fixture
+def cf_endpoint(requests_mock: Mocker):
+    requests_mock.put(TEST_RESPONSE_URL)
+    return requests_mock
+
+
+@pytest.fixture
+def sleep(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr('time.sleep', mock)
+    return mock
+
+
+@pytest.fixture
+def device_farm_endpoint(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr('boto3.client', MagicMock(return_value=mock))
+    mock.create_device_pool = MagicMock(side_effect=lambda **kwargs: {
+        'devicePool': {'arn': 'arn:pool:' + kwargs['name'], 'name': kwargs['name']},
+    })
+    paginator_mock = MagicMock()
+    paginator_mock.paginate = MagicMock(return_value=[{
+        'devicePools': [
+            {'arn': 'arn:pool:phones', 'name': 'phones', 'type': 'PRIVATE'},
+            {'arn': 'arn:pool:tablets', 'name': 'tablets', 'type': 'PRIVATE'},
+            {'arn': 'arn:pool:other', 'name': 'other', 'type': 'PRIVATE'},
+            # same names, created by other stacks in the project
+            {'arn': 'arn:pool:other-stack-phones', 'name': 'phones', 'type': 'PRIVATE'},
+            {'arn': 'arn:pool:other-stack-new', 'name': 'new', 'type': 'PRIVATE'},
+        ],
+    }])
+    mock.get_paginator = MagicMock(return_value=paginator_mock)
+    tags = {
+        'arn:pool:phones': TEST_BATCH_TAGS,
+        'arn:pool:tablets': TEST_BATCH_TAGS,
+        'arn:pool:other': TEST_BATCH_TAGS,
+        'arn:pool:other-stack-phones': [{'Key': 'DevicePoolBatch', 'Value': 'other-request-id'}],
+        'arn:pool:other-stack-new': [],
+    }
+    mock.list_tags_for_resource = MagicMock(side_effect=lambda ResourceARN: {'Tags': tags[ResourceARN]})
+    return mock
+
+
+@pytest.mark.parametrize('resource_properties,expected_reason', [
+    ({'DevicePools': TEST_DEVICE_POOLS}, 'Required property ProjectArn not set'),
+    ({'ProjectArn': TEST_PROJECT_ARN}, 'Required property DevicePools not set'),
+    (dict(TEST_VALID_RESOURCE_PROPERTIES, Foo='foo'), 'Unknown properties found: Foo'),
+    ({'ProjectArn': TEST_PROJECT_ARN, 'DevicePools': [{'Name': 'a', 'Rules': TEST_RULES},
+                                                      {'Name': 'a', 'Rules': TEST_RULES},
+                                                      {'Rules': TEST_RULES, 'Foo': 'foo'}]},
+     'Invalid DevicePools: device pool a: duplicate name; device pool 3: required property Name not set; '
+     'device pool 3: unknown properties Foo'),
+    ({'ProjectArn': TEST_PROJECT_ARN, 'DevicePools': [
+        {'Name': 'a', 'Rules': [{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"WINDOWS"'}]}]},
+     'Invalid DevicePools: device pool a: rule 1: invalid value WINDOWS for PLATFORM, use one of ANDROID, IOS'),
+])
+def test_handler_invalid_parameters(resource_properties, expected_reason, context, cf_endpoint,
+                                    device_farm_endpoint):
+    device_pool_batch_resource.lambda_handler(_event('Create', resource_properties), context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'FAILED'
+    assert cf_endpoint.request_history[0].json()['Reason'] == expected_reason
+    device_farm_endpoint.create_device_pool.assert_not_called()
+
+
+def test_handler_create(context, cf_endpoint, device_farm_endpoint):
+    device_pool_batch_resource.lambda_handler(_event('Create'), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+    assert response['Data'] == {
+        'DevicePool.phones.Arn': 'arn:pool:phones',
+        'DevicePool.tablets.Arn': 'arn:pool:tablets',
+        'Arns': 'arn:pool:phones,arn:pool:tablets',
+    }
+    device_farm_endpoint.create_device_pool.assert_any_call(
+        projectArn=TEST_PROJECT_ARN, name='phones', rules=TEST_RULES, maxDevices=5)
+    device_farm_endpoint.create_device_pool.assert_any_call(
+        projectArn=TEST_PROJECT_ARN, name='tablets', rules=TEST_RULES, description='Tablets')
+    device_farm_endpoint.tag_resource.assert_any_call(ResourceARN='arn:pool:phones', Tags=TEST_BATCH_TAGS)
+    device_farm_endpoint.tag_resource.assert_any_call(ResourceARN='arn:pool:tablets', Tags=TEST_BATCH_TAGS)
+
+
+def _many_device_pools(count):
+    return [{'Name': f'Pool {index:02}', 'Rules': TEST_RULES} for index in range(count)]
+
+
+def test_handler_create_largest_batch_returns_every_arn(context, cf_endpoint, device_farm_endpoint, sleep):
+    device_farm_endpoint.create_device_pool = MagicMock(side_effect=lambda **kwargs: {'devicePool': {
+        'arn': 'arn:aws:devicefarm:us-west-2:123456789012:devicepool:8e9c1f0e-5d2a-4e5f-9abc-1234567890ab/'
+               + str(uuid.uuid5(uuid.NAMESPACE_OID, kwargs['name'])),
+    }})
+    count = 1
+    while not device_pool_batch_resource.validate_device_pools(_many_device_pools(count + 1)):
+        count += 1
+    device_pools = _many_device_pools(count)
+
+    device_pool_batch_resource.lambda_handler(
+        _event('Create', dict(TEST_VALID_RESOURCE_PROPERTIES, DevicePools=device_pools)), context)
+
+    response = cf_endpoint.request_history[0]
+    assert response.json()['Status'] == 'SUCCESS'
+    assert len(response.body) <= cloudformation.MAX_RESPONSE_SIZE
+    arn_keys = sorted(key for key in response.json()['Data'] if key != 'Arns')
+    assert arn_keys == [f'DevicePool.Pool{index:02}.Arn' for index in range(count)]
+
+
+def test_handler_create_rejects_batch_that_does_not_fit_response(context, cf_endpoint, device_farm_endpoint):
+    device_pool_batch_resource.lambda_handler(
+        _event('Create', dict(TEST_VALID_RESOURCE_PROPERTIES, DevicePools=_many_device_pools(40))), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'].startswith('Invalid DevicePools: the ARNs of device pools ')
+    assert 'Pool 39' in response['Reason']
+    assert 'Pool 00' not in response['Reason']
+    assert 'split DevicePools into more batches' in response['Reason']
+    device_farm_endpoint.create_device_pool.assert_not_called()
+
+
+def test_handler_create_retries_throttled_calls(context, cf_endpoint, device_farm_endpoint, sleep):
+    create = device_farm_endpoint.create_device_pool.side_effect
+    calls = []
+
+    def throttled_create(**kwargs):
+        calls.append(kwargs['name'])
+        if calls.count(kwargs['name']) == 1:
+            raise _throttling_error('CreateDevicePool')
+        return create(**kwargs)
+
+    device_farm_endpoint.create_device_pool = MagicMock(side_effect=throttled_create)
+
+    device_pool_batch_resource.lambda_handler(_event('Create'), context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert device_farm_endpoint.create_device_pool.call_count == 4
+    # backoff after each throttled call, plus the waits of the lowered rate limit
+    assert sleep.call_count >= 2
+    assert rate_limit.stats()['create_device_pool'].throttles == 2
+
+
+def test_handler_create_partial_failure_rolls_back(context, cf_endpoint, device_farm_endpoint):
+    create = device_farm_endpoint.create_device_pool.side_effect
+
+    def failing_create(**kwargs):
+        if kwargs['name'] == 'tablets':
+            raise Exception('This went wrong')
+        return create(**kwargs)
+
+    device_farm_endpoint.create_device_pool = MagicMock(side_effect=failing_create)
+
+    device_pool_batch_resource.lambda_handler(_event('Create'), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'FAILED'
+    assert response['PhysicalResourceId'] == 'ResourceNotCreated'
+    assert response['Reason'] == 'Failed to create 1 device pools: tablets: This went wrong'
+    device_farm_endpoint.delete_device_pool.assert_called_once_with(arn='arn:pool:phones')
+
+
+def test_handler_create_untagged_pool_is_deleted(context, cf_endpoint, device_farm_endpoint):
+    device_farm_endpoint.tag_resource = MagicMock(side_effect=lambda ResourceARN, Tags: (
+        _raise(Exception('Tagging failed')) if ResourceARN == 'arn:pool:tablets' else {}))
+
+    device_pool_batch_resource.lambda_handler(_event('Create'), context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'FAILED'
+    assert device_farm_endpoint.delete_device_pool.call_count == 2
+    device_farm_endpoint.delete_device_pool.assert_any_call(arn='arn:pool:tablets')
+    device_farm_endpoint.delete_device_pool.assert_any_call(arn='arn:pool:phones')
+
+
+def test_handler_update_diffs_device_pools(context, cf_endpoint, device_farm_endpoint):
+    new_device_pools = [
+        dict(TEST_DEVICE_POOLS[0], MaxDevices='10'),
+        {'Name': 'new', 'Rules': TEST_RULES},
+    ]
+    old_device_pools = TEST_DEVICE_POOLS + [{'Name': 'other', 'Rules': TEST_RULES}]
+    event = _event('Update', dict(TEST_VALID_RESOURCE_PROPERTIES, DevicePools=new_device_pools + [TEST_DEVICE_POOLS[1]]),
+                   PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID,
+                   OldResourceProperties=dict(TEST_VALID_RESOURCE_PROPERTIES, DevicePools=old_device_pools))
+
+    device_pool_batch_resource.lambda_handler(event, context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+    assert response['Data']['Arns'] == 'arn:pool:phones,arn:pool:new,arn:pool:tablets'
+    device_farm_endpoint.update_device_pool.assert_called_once_with(
+        arn='arn:pool:phones', name='phones', rules=TEST_RULES, maxDevices=10)
+    # the same-named pools of the other stack are neither reused nor changed
+    device_farm_endpoint.create_device_pool.assert_called_once_with(
+        projectArn=TEST_PROJECT_ARN, name='new', rules=TEST_RULES)
+    device_farm_endpoint.delete_device_pool.assert_called_once_with(arn='arn:pool:other')
+
+
+def test_handler_update_new_project_creates_pools(context, cf_endpoint, device_farm_endpoint):
+    event = _event('Update', PhysicalResourceId='arn:old-project/device-pool-batch/DevicePools/old-request-id',
+                   OldResourceProperties=dict(TEST_VALID_RESOURCE_PROPERTIES, ProjectArn='arn:old-project'))
+
+    device_pool_batch_resource.lambda_handler(event, context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+    assert device_farm_endpoint.create_device_pool.call_count == 2
+    device_farm_endpoint.update_device_pool.assert_not_called()
+
+
+def test_handler_delete(context, cf_endpoint, device_farm_endpoint):
+    device_farm_endpoint.delete_device_pool = MagicMock(side_effect=[
+        None,
+        ClientError({'Error': {'Code': 'NotFoundException', 'Message': 'gone'}}, 'DeleteDevicePool'),
+    ])
+
+    device_pool_batch_resource.lambda_handler(_event('Delete', PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID),
+                                              context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert device_farm_endpoint.delete_device_pool.call_count == 2
+    device_farm_endpoint.delete_device_pool.assert_any_call(arn='arn:pool:phones')
+    device_farm_endpoint.delete_device_pool.assert_any_call(arn='arn:pool:tablets')
+
+
+def test_handler_delete_other_batch(context, cf_endpoint, device_farm_endpoint):
+    # another stack with the same pool names in the project
+    device_pool_batch_resource.lambda_handler(
+        _event('Delete', PhysicalResourceId=TEST_PROJECT_ARN + '/device-pool-batch/DevicePools/other-request-id'),
+        context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    device_farm_endpoint.delete_device_pool.assert_called_once_with(arn='arn:pool:other-stack-phones')
+
+
+def test_handler_delete_not_created(context, cf_endpoint, device_farm_endpoint):
+    device_pool_batch_resource.lambda_handler(_event('Delete', PhysicalResourceId='ResourceNotCreated'), context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    device_farm_endpoint.delete_device_pool.assert_not_called()
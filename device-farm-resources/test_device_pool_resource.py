@@ -1,8 +1,10 @@
+import json
+
 import pytest
 from requests_mock import Mocker
 from unittest.mock import MagicMock
 
-from device_farm import device_pool_resource
+from device_farm import device_catalog, device_pool_resource
 
 TEST_DEVICE_POOL_NAME = 'device-pool-name'
 TEST_RESPONSE_URL = 'http://example.com/response'
@@ -65,6 +67,11 @@ def device_farm_endpoint(monkeypatch):
     # invalid parameters
     ({'ProjectArn': TEST_PROJECT_ARN, 'Name': TEST_DEVICE_POOL_NAME, 'Rules': TEST_DEVICE_POOL_RULES, 'Foo': 'foo'},
      'Unknown properties found: Foo'),
+    ({'ProjectArn': TEST_PROJECT_ARN, 'Name': TEST_DEVICE_POOL_NAME, 'Rules': [
+        {'attribute': 'PLATFORM', 'operator': 'CONTAINS', 'value': '"ANDROID"'},
+        {'attribute': 'FORM_FACTOR', 'operator': 'IN', 'value': '["PHONE", "WATCH"]'},
+    ]}, 'Invalid Rules: rule 1: operator CONTAINS is not allowed for PLATFORM, use one of EQUALS, IN, NOT_IN; '
+        'rule 2: invalid value WATCH for FORM_FACTOR, use one of PHONE, TABLET'),
 ])
 def test_handler_create_missing_or_invalid_parameter(resource_properties, expected_reason, context, cf_endpoint,
                                                      device_farm_endpoint):
@@ -335,6 +342,25 @@ def test_handler_delete_not_created(context, cf_endpoint, device_farm_endpoint):
     device_farm_endpoint.delete_devic_pool.assert_not_called()
 
 
+def test_handler_delete_does_not_validate_rules(context, cf_endpoint, device_farm_endpoint):
+    # a pool created before its rules were validated locally stays deletable
+    event = {
+        'RequestType': 'Delete',
+        'LogicalResourceId': 'DeviceFarm',
+        'PhysicalResourceId': TEST_PHYSICAL_RESOURCE_ID,
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': dict(TEST_VALID_RESOURCE_PROPERTIES, Rules=[
+            {'attribute': 'COLOR', 'operator': 'EQUALS', 'value': '"RED"'}]),
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    device_farm_endpoint.delete_device_pool.assert_called_with(arn=TEST_PHYSICAL_RESOURCE_ID)
+
+
 def test_handler_delete_fails(context, cf_endpoint, device_farm_endpoint):
     event = {
         'RequestType': 'Delete',
@@ -356,3 +382,144 @@ def test_handler_delete_fails(context, cf_endpoint, device_farm_endpoint):
     device_farm_endpoint.create_device_pool.assert_not_called()
     device_farm_endpoint.update_device_pool.assert_not_called()
     device_farm_endpoint.delete_device_pool.assert_called_with(arn=TEST_PHYSICAL_RESOURCE_ID)
+
+
+def test_handler_update_unchanged_properties(context, cf_endpoint, device_farm_endpoint):
+    event = {
+        'RequestType': 'Update',
+        'LogicalResourceId': 'DeviceFarm',
+        'PhysicalResourceId': TEST_PHYSICAL_RESOURCE_ID,
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': TEST_VALID_RESOURCE_PROPERTIES,
+        'OldResourceProperties': dict(TEST_VALID_RESOURCE_PROPERTIES, MaxDevices=str(TEST_MAX_DEVICES)),
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.called
+    assert len(cf_endpoint.request_history) == 1
+    assert cf_endpoint.request_history[0].json()['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert cf_endpoint.request_history[0].json()['Data']['Arn'] == TEST_PHYSICAL_RESOURCE_ID
+    device_farm_endpoint.update_device_pool.assert_not_called()
+
+
+def test_handler_update_changed_rules(context, cf_endpoint, device_farm_endpoint):
+    event = {
+        'RequestType': 'Update',
+        'LogicalResourceId': 'DeviceFarm',
+        'PhysicalResourceId': TEST_PHYSICAL_RESOURCE_ID,
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': TEST_VALID_RESOURCE_PROPERTIES,
+        'OldResourceProperties': dict(TEST_VALID_RESOURCE_PROPERTIES, Rules=[{
+            'attribute': 'REMOTE_ACCESS_ENABLED',
+            'operator': 'EQUALS',
+            'value': 'False',
+        }]),
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    device_farm_endpoint.update_device_pool.assert_called_with(
+        arn=TEST_PHYSICAL_RESOURCE_ID,
+        name=TEST_DEVICE_POOL_NAME,
+        description=TEST_DESCRIPTION,
+        rules=TEST_DEVICE_POOL_RULES,
+        maxDevices=TEST_MAX_DEVICES,
+    )
+
+
+def test_handler_create_retried_request(context, cf_endpoint, device_farm_endpoint):
+    event = {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'DeviceFarm',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': TEST_VALID_RESOURCE_PROPERTIES,
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+    device_pool_resource.lambda_handler(event, context)
+
+    assert len(cf_endpoint.request_history) == 2
+    assert cf_endpoint.request_history[1].json() == cf_endpoint.request_history[0].json()
+    assert cf_endpoint.request_history[1].json()['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+    assert device_farm_endpoint.create_device_pool.call_count == 1
+
+
+@pytest.fixture
+def device_catalog_file(tmp_path, monkeypatch):
+    path = tmp_path / 'devices.json'
+    path.write_text(json.dumps([
+        {'arn': 'arn:device:1', 'remoteAccessEnabled': True},
+        {'arn': 'arn:device:2', 'remoteAccessEnabled': False},
+    ]))
+    monkeypatch.setenv(device_catalog.CATALOG_PATH_VARIABLE, str(path))
+    return path
+
+
+def test_handler_create_require_matching_devices(context, cf_endpoint, device_farm_endpoint, device_catalog_file):
+    event = {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'DeviceFarm',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': dict(TEST_VALID_RESOURCE_PROPERTIES, RequireMatchingDevices='true'),
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert cf_endpoint.request_history[0].json()['Data']['MatchingDevices'] == 1
+    device_farm_endpoint.create_device_pool.assert_called_once()
+
+
+def test_handler_update_unchanged_require_matching_devices(context, cf_endpoint, device_farm_endpoint,
+                                                           device_catalog_file):
+    properties = dict(TEST_VALID_RESOURCE_PROPERTIES, RequireMatchingDevices='true')
+    event = {
+        'RequestType': 'Update',
+        'LogicalResourceId': 'DeviceFarm',
+        'PhysicalResourceId': TEST_PHYSICAL_RESOURCE_ID,
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': properties,
+        'OldResourceProperties': properties,
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert cf_endpoint.request_history[0].json()['Data'] == {'Arn': TEST_PHYSICAL_RESOURCE_ID, 'MatchingDevices': 1}
+    device_farm_endpoint.update_device_pool.assert_not_called()
+
+
+def test_handler_create_require_matching_devices_without_match(context, cf_endpoint, device_farm_endpoint,
+                                                               device_catalog_file):
+    event = {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'DeviceFarm',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': dict(TEST_VALID_RESOURCE_PROPERTIES, RequireMatchingDevices='true', Rules=[{
+            'attribute': 'PLATFORM',
+            'operator': 'EQUALS',
+            'value': '"IOS"',
+        }]),
+    }
+
+    device_pool_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.request_history[0].json()['PhysicalResourceId'] == 'ResourceNotCreated'
+    assert cf_endpoint.request_history[0].json()['Status'] == 'FAILED'
+    assert cf_endpoint.request_history[0].json()['Reason'] == 'Rules do not match any device in the device catalog'
+    device_farm_endpoint.create_device_pool.assert_not_called()
@@ -0,0 +1,65 @@
+import pytest
+
+from device_farm import device_pool_rules
+
+
+@pytest.mark.parametrize('rule', [
+    {'attribute': 'REMOTE_ACCESS_ENABLED', 'operator': 'EQUALS', 'value': 'True'},
+    {'attribute': 'REMOTE_DEBUG_ENABLED', 'operator': 'EQUALS', 'value': 'false'},
+    {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+    {'attribute': 'PLATFORM', 'operator': 'IN', 'value': '["ANDROID", "IOS"]'},
+    {'attribute': 'FORM_FACTOR', 'operator': 'NOT_IN', 'value': '["TABLET"]'},
+    {'attribute': 'OS_VERSION', 'operator': 'GREATER_THAN_OR_EQUALS', 'value': '"9.0"'},
+    {'attribute': 'OS_VERSION', 'operator': 'LESS_THAN', 'value': '10'},
+    {'attribute': 'MODEL', 'operator': 'CONTAINS', 'value': '"Pixel"'},
+    {'attribute': 'MANUFACTURER', 'operator': 'IN', 'value': '["Samsung", "Google"]'},
+    {'attribute': 'AVAILABILITY', 'operator': 'EQUALS', 'value': '"HIGHLY_AVAILABLE"'},
+    {'attribute': 'FLEET_TYPE', 'operator': 'EQUALS', 'value': 'PUBLIC'},
+    {'attribute': 'INSTANCE_LABELS', 'operator': 'CONTAINS', 'value': '"label"'},
+    {'attribute': 'APPIUM_VERSION', 'operator': 'CONTAINS', 'value': '"1.7"'},
+    {'attribute': 'ARN', 'operator': 'EQUALS', 'value': '"arn:aws:devicefarm:us-west-2::device:123"'},
+])
+def test_valid_rule(rule):
+    assert device_pool_rules.validate_rule(rule) == []
+
+
+@pytest.mark.parametrize('rule,expected_errors', [
+    ('PLATFORM', ['must be an object with attribute, operator and value']),
+    ({'attribute': 'PLATFORM', 'operator': 'EQUALS'}, ['missing value']),
+    ({'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"IOS"', 'foo': 'bar'}, ['unknown keys foo']),
+    ({'attribute': 'COLOR', 'operator': 'EQUALS', 'value': '"RED"'}, ['unknown attribute COLOR']),
+    ({'attribute': 'AVAILABILITY', 'operator': 'IN', 'value': '["BUSY"]'},
+     ['operator IN is not allowed for AVAILABILITY, use one of EQUALS']),
+    ({'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"WINDOWS"'},
+     ['invalid value WINDOWS for PLATFORM, use one of ANDROID, IOS']),
+    ({'attribute': 'PLATFORM', 'operator': 'IN', 'value': '"ANDROID"'},
+     ['value for IN must be a non-empty JSON list']),
+    ({'attribute': 'PLATFORM', 'operator': 'IN', 'value': '[]'},
+     ['value for IN must be a non-empty JSON list']),
+    ({'attribute': 'MANUFACTURER', 'operator': 'EQUALS', 'value': '["Samsung"]'},
+     ['value for EQUALS must be a single value']),
+    ({'attribute': 'OS_VERSION', 'operator': 'GREATER_THAN', 'value': '"latest"'},
+     ['invalid version latest for OS_VERSION']),
+    ({'attribute': 'REMOTE_ACCESS_ENABLED', 'operator': 'EQUALS', 'value': 'yes'},
+     ['invalid value yes for REMOTE_ACCESS_ENABLED, use one of FALSE, TRUE']),
+])
+def test_invalid_rule(rule, expected_errors):
+    assert device_pool_rules.validate_rule(rule) == expected_errors
+
+
+def test_validate_rules_reports_all_errors():
+    errors = device_pool_rules.validate_rules([
+        {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+        {'attribute': 'COLOR', 'operator': 'EQUALS', 'value': '"RED"'},
+        {'attribute': 'FORM_FACTOR', 'operator': 'IN', 'value': '["PHONE", "WATCH", "TV"]'},
+    ])
+
+    assert errors == [
+        'rule 2: unknown attribute COLOR',
+        'rule 3: invalid value WATCH for FORM_FACTOR, use one of PHONE, TABLET',
+        'rule 3: invalid value TV for FORM_FACTOR, use one of PHONE, TABLET',
+    ]
+
+
+def test_validate_rules_requires_list():
+    assert device_pool_rules.validate_rules({'attribute': 'PLATFORM'}) == ['Rules must be a list']
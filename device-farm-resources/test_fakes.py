@@ -0,0 +1,176 @@
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from device_farm import clients, device_pool_resource, project_resource, rate_limit
+from device_farm_testing import fakes
+
+TEST_RESPONSE_URL = 'https://cloudformation-custom-resource-response-uswest2.s3.amazonaws.com/response'
+TEST_RULES = [{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'}]
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    return mock
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # backoff and rate limiting sleep through time.sleep
+    sleeps = []
+    monkeypatch.setattr('time.sleep', sleeps.append)
+    return sleeps
+
+
+def event(request_type, request_id, properties, physical_resource_id=None, old_properties=None):
+    result = {
+        'RequestType': request_type,
+        'LogicalResourceId': 'Resource',
+        'RequestId': request_id,
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': properties,
+    }
+    if physical_resource_id is not None:
+        result['PhysicalResourceId'] = physical_resource_id
+    if old_properties is not None:
+        result['OldResourceProperties'] = old_properties
+    return result
+
+
+def test_stack_lifecycle(context):
+    device_farm = fakes.FakeDeviceFarm(seed=1)
+    cloud_formation = fakes.FakeCloudFormation()
+
+    with fakes.installed(device_farm, cloud_formation):
+        project_resource.lambda_handler(event('Create', '1', {'ProjectName': 'project'}), context)
+        project_arn = cloud_formation.response_for('1')['PhysicalResourceId']
+        pool = {'ProjectArn': project_arn, 'Name': 'pool', 'Rules': TEST_RULES}
+        device_pool_resource.lambda_handler(event('Create', '2', pool), context)
+        pool_arn = cloud_formation.response_for('2')['PhysicalResourceId']
+        device_pool_resource.lambda_handler(
+            event('Update', '3', dict(pool, MaxDevices=2), pool_arn, old_properties=pool), context)
+
+        assert device_farm.device_pools[pool_arn]['maxDevices'] == 2
+        device_pool_resource.lambda_handler(event('Delete', '4', pool, pool_arn), context)
+        project_resource.lambda_handler(event('Delete', '5', {'ProjectName': 'project'}, project_arn), context)
+
+    assert [response['Status'] for response in cloud_formation.responses] == ['SUCCESS'] * 5
+    top_devices_arn = cloud_formation.response_for('1')['Data']['TopDevicesDevicePoolArn']
+    assert top_devices_arn.startswith(f'arn:aws:devicefarm:us-west-2:123456789012:devicepool:{project_arn[-36:]}/')
+    assert device_farm.projects == {}
+    assert device_farm.device_pools == {}
+
+
+def test_curated_pools_are_paginated(context):
+    names = ['Top Devices'] + [f'Curated Pool {index}' for index in range(24)]
+    device_farm = fakes.FakeDeviceFarm(page_size=10, curated_pool_names=names)
+    cloud_formation = fakes.FakeCloudFormation()
+
+    with fakes.installed(device_farm, cloud_formation):
+        project_resource.lambda_handler(event('Create', '1', {'ProjectName': 'project'}), context)
+
+    response = cloud_formation.response_for('1')
+    assert response['Status'] == 'SUCCESS'
+    assert response['Data']['CuratedPool.CuratedPool23.Arn']
+    assert device_farm.calls['list_device_pools'] == 3
+
+
+def test_throttled_calls_are_retried(context, sleeps):
+    rate_limit.set_limiter(rate_limit.RateLimiter(rates={}, default_rate=1e9))
+    device_farm = fakes.FakeDeviceFarm(seed=3, faults=fakes.Faults(throttle_rate=0.5))
+    cloud_formation = fakes.FakeCloudFormation()
+
+    with fakes.installed(device_farm, cloud_formation):
+        for index in range(10):
+            project_resource.lambda_handler(event('Create', str(index), {'ProjectName': 'project'}), context)
+
+    assert [response['Status'] for response in cloud_formation.responses] == ['SUCCESS'] * 10
+    assert len(device_farm.projects) == 10
+    assert device_farm.calls['create_project'] > 10
+    assert sleeps
+
+
+def test_persistent_throttling_fails_the_request(context, sleeps):
+    device_farm = fakes.FakeDeviceFarm(operation_faults={'create_project': fakes.Faults(throttle_rate=1)})
+    cloud_formation = fakes.FakeCloudFormation()
+
+    with fakes.installed(device_farm, cloud_formation):
+        project_resource.lambda_handler(event('Create', '1', {'ProjectName': 'project'}), context)
+
+    response = cloud_formation.response_for('1')
+    assert response['Status'] == 'FAILED'
+    assert 'ThrottlingException' in response['Reason']
+    assert device_farm.calls['create_project'] == 6
+    assert rate_limit.stats()['create_project'].throttles == 6
+
+
+def test_errors_and_missing_resources(context):
+    device_farm = fakes.FakeDeviceFarm(operation_faults={'update_project': fakes.Faults(error_rate=1)})
+    cloud_formation = fakes.FakeCloudFormation()
+    missing_arn = 'arn:aws:devicefarm:us-west-2:123456789012:devicepool:project/pool'
+
+    with fakes.installed(device_farm, cloud_formation):
+        project_resource.lambda_handler(event('Create', '1', {'ProjectName': 'project'}), context)
+        project_arn = cloud_formation.response_for('1')['PhysicalResourceId']
+        project_resource.lambda_handler(
+            event('Update', '2', {'ProjectName': 'renamed'}, project_arn, {'ProjectName': 'project'}), context)
+        device_pool_resource.lambda_handler(event('Delete', '3', {
+            'ProjectArn': project_arn, 'Name': 'pool', 'Rules': TEST_RULES}, missing_arn), context)
+
+    assert 'ServiceUnavailableException' in cloud_formation.response_for('2')['Reason']
+    assert 'NotFoundException' in cloud_formation.response_for('3')['Reason']
+    assert device_farm.projects[project_arn]['name'] == 'project'
+
+
+def test_deleted_project_has_no_curated_pools():
+    device_farm = fakes.FakeDeviceFarm()
+    project_arn = device_farm.create_project(name='project')['project']['arn']
+    assert device_farm.list_device_pools(arn=project_arn, type='CURATED')['devicePools']
+
+    device_farm.delete_project(arn=project_arn)
+
+    with pytest.raises(ClientError) as e:
+        device_farm.list_device_pools(arn=project_arn, type='CURATED')
+    assert clients.error_code(e.value) == 'NotFoundException'
+
+
+def test_latency_is_injected():
+    sleeps = []
+    device_farm = fakes.FakeDeviceFarm(faults=fakes.Faults(latency=0.05, jitter=0.01), sleep=sleeps.append)
+
+    project_arn = device_farm.create_project(name='project')['project']['arn']
+    pages = list(device_farm.get_paginator('list_device_pools').paginate(arn=project_arn, type='CURATED'))
+
+    assert len(pages) == 1
+    assert len(sleeps) == 2
+    assert all(0.05 <= delay <= 0.06 for delay in sleeps)
+
+
+def test_cloudformation_errors_are_retried(context, sleeps):
+    device_farm = fakes.FakeDeviceFarm()
+    cloud_formation = fakes.FakeCloudFormation(error_rate=0.2, failure_rate=0.1, seed=2)
+
+    with fakes.installed(device_farm, cloud_formation):
+        for index in range(5):
+            project_resource.lambda_handler(event('Create', str(index), {'ProjectName': 'project'}), context)
+
+    assert [response['Status'] for response in cloud_formation.responses] == ['SUCCESS'] * 5
+    assert cloud_formation.attempts > 5
+
+
+def test_installed_restores_boto3(monkeypatch):
+    create_client = MagicMock()
+    monkeypatch.setattr('boto3.client', create_client)
+    device_farm = fakes.FakeDeviceFarm()
+
+    with fakes.installed(device_farm):
+        assert clients.get_device_farm_client().create_project(name='a')['project']['name'] == 'a'
+        clients.get_client('lambda')
+        create_client.assert_called_once()
+
+    import boto3
+    assert boto3.client is create_client
@@ -0,0 +1,86 @@
+from unittest.mock import MagicMock
+
+import pytest
+from requests_mock import Mocker
+
+from device_farm import cloudformation, idempotency
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+TEST_EVENT = {
+    'RequestType': 'Create',
+    'LogicalResourceId': 'DeviceFarm',
+    'RequestId': '1234',
+    'ResponseURL': TEST_RESPONSE_URL,
+    'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+    'ResourceProperties': {},
+}
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    return mock
+
+
+def test_put_and_get(clock):
+    store = idempotency.LocalIdempotencyStore(clock=clock)
+
+    store.put('1234', {'Status': 'SUCCESS'})
+
+    assert store.get('1234') == {'Status': 'SUCCESS'}
+    assert store.get('5678') is None
+
+
+def test_entries_expire(clock):
+    store = idempotency.LocalIdempotencyStore(ttl=10, clock=clock)
+    store.put('1234', {'Status': 'SUCCESS'})
+    clock.now += 10
+
+    assert store.get('1234') is None
+
+
+def test_size_is_bounded(clock):
+    store = idempotency.LocalIdempotencyStore(max_entries=2, clock=clock)
+
+    for request_id in ['1', '2', '3']:
+        store.put(request_id, {'RequestId': request_id})
+
+    assert len(store) == 2
+    assert store.get('1') is None
+    assert store.get('3') == {'RequestId': '3'}
+
+
+def test_persisted_entries_are_shared(tmp_path, clock):
+    path = str(tmp_path / 'idempotency.json')
+    idempotency.LocalIdempotencyStore(max_entries=2, persist_path=path, clock=clock).put('1234', {'Status': 'FAILED'})
+
+    store = idempotency.LocalIdempotencyStore(max_entries=2, persist_path=path, clock=clock)
+
+    assert store.get('1234') == {'Status': 'FAILED'}
+    store.put('2', {})
+    store.put('3', {})
+    assert store.get('1234') is None
+
+
+def test_replay_response(context, requests_mock: Mocker):
+    requests_mock.put(TEST_RESPONSE_URL)
+
+    assert not cloudformation.replay_response(TEST_EVENT)
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS, physical_resource_id='arn:foo')
+    assert cloudformation.replay_response(TEST_EVENT)
+
+    assert len(requests_mock.request_history) == 2
+    assert requests_mock.request_history[1].json() == requests_mock.request_history[0].json()
+
+
+def test_custom_store_is_used(context, requests_mock: Mocker):
+    requests_mock.put(TEST_RESPONSE_URL)
+    store = MagicMock(spec=idempotency.IdempotencyStore)
+    store.get = MagicMock(return_value=None)
+    idempotency.set_store(store)
+
+    cloudformation.send_response(TEST_EVENT, context, cloudformation.Status.SUCCESS)
+
+    store.put.assert_called_once()
+    assert store.put.call_args[0][0] == '1234'
@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+
+# Cold import budget for all device_farm modules, see DEVICE_FARM_IMPORT_BUDGET_MS.
+# Most of it is spent importing requests, which is needed to answer CloudFormation anyway.
+DEFAULT_IMPORT_BUDGET_MS = 300
+
+IMPORT_SCRIPT = '''
+import json
+import pkgutil
+import sys
+import time
+
+start = time.perf_counter()
+import device_farm
+for module in pkgutil.iter_modules(device_farm.__path__):
+    __import__('device_farm.' + module.name)
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({
+    'elapsed_ms': elapsed,
+    'sdk_loaded': sorted(name for name in ('boto3', 'botocore') if name in sys.modules),
+}))
+'''
+
+
+def _cold_import(**env) -> dict:
+    process_env = dict(os.environ)
+    process_env.pop('DEVICE_FARM_EAGER_IMPORTS', None)
+    process_env.update(env)
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], env=process_env,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.decode('utf-8'))
+
+
+def test_cold_import_does_not_load_sdk():
+    assert _cold_import()['sdk_loaded'] == []
+
+
+def test_cold_import_within_budget():
+    budget = float(os.environ.get('DEVICE_FARM_IMPORT_BUDGET_MS', DEFAULT_IMPORT_BUDGET_MS))
+    # best of three, to keep a single noisy run from failing the suite
+    elapsed = min(_cold_import()['elapsed_ms'] for _ in range(3))
+
+    assert elapsed <= budget, f'Cold import of device_farm took {elapsed:.0f}ms, budget is {budget:.0f}ms'
+
+
+def test_eager_imports_load_sdk():
+    assert _cold_import(DEVICE_FARM_EAGER_IMPORTS='1')['sdk_loaded'] == ['boto3', 'botocore']
@@ -0,0 +1,124 @@
+import io
+import json
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from requests_mock import Mocker
+
+from device_farm import metrics, resource
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    return mock
+
+
+@pytest.fixture
+def cf_endpoint():
+    with Mocker() as m:
+        yield m.put(TEST_RESPONSE_URL)
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setenv(metrics.ENABLED_VARIABLE, 'true')
+
+
+def test_disabled_records_nothing():
+    output = io.StringIO()
+
+    with metrics.invocation('Project', 'Create', output=output) as recorder:
+        with metrics.span('Validate'):
+            pass
+        metrics.count('Failed')
+
+    assert isinstance(recorder, metrics.NoopRecorder)
+    assert not isinstance(recorder, metrics.Recorder)
+    assert output.getvalue() == ''
+
+
+def test_disabled_span_is_cheap():
+    start = time.perf_counter()
+    for _ in range(100000):
+        with metrics.span('Validate'):
+            pass
+    # generous, a no-op span costs well under a microsecond
+    assert time.perf_counter() - start < 1
+
+
+def test_invocation_writes_embedded_metric_format(enabled):
+    output = io.StringIO()
+
+    with metrics.invocation('Project', 'Create', output=output):
+        with metrics.span('DeviceFarm.create_project'):
+            pass
+        with metrics.span('DeviceFarm.create_project'):
+            pass
+        metrics.add('ResponsePut', 12.5)
+        metrics.count('Throttles', 2)
+
+    record = json.loads(output.getvalue())
+    assert record['_aws']['CloudWatchMetrics'] == [{
+        'Namespace': metrics.NAMESPACE,
+        'Dimensions': [['Resource', 'RequestType']],
+        'Metrics': [
+            {'Name': 'DeviceFarm.create_project', 'Unit': 'Milliseconds'},
+            {'Name': 'ResponsePut', 'Unit': 'Milliseconds'},
+            {'Name': 'DeviceFarm.create_projectCalls', 'Unit': 'Count'},
+            {'Name': 'ResponsePutCalls', 'Unit': 'Count'},
+            {'Name': 'Throttles', 'Unit': 'Count'},
+        ],
+    }]
+    assert record['Resource'] == 'Project'
+    assert record['RequestType'] == 'Create'
+    assert record['ResponsePut'] == 12.5
+    assert record['DeviceFarm.create_projectCalls'] == 2
+    assert record['Throttles'] == 2
+    assert record['SampleRate'] == 1
+
+
+def test_invocation_is_sampled(enabled, monkeypatch):
+    monkeypatch.setenv(metrics.SAMPLE_RATE_VARIABLE, '0.25')
+    monkeypatch.setattr(metrics.random, 'random', MagicMock(side_effect=[0.5, 0.1]))
+    output = io.StringIO()
+
+    with metrics.invocation('Project', 'Create', output=output) as skipped:
+        pass
+    with metrics.invocation('Project', 'Create', output=output) as sampled:
+        pass
+
+    assert not isinstance(skipped, metrics.Recorder)
+    assert isinstance(sampled, metrics.Recorder)
+    assert json.loads(output.getvalue())['SampleRate'] == 0.25
+
+
+def test_handler_emits_one_record_per_invocation(enabled, context, cf_endpoint, capsys):
+    thing = resource.CustomResource(
+        name='Thing',
+        properties=[resource.Property('Name', required=True)],
+        create=lambda request: resource.Result(physical_resource_id='arn:thing'),
+        update=MagicMock(),
+        delete=MagicMock(),
+    )
+    event = {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'Thing',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': {'Name': 'a'},
+    }
+
+    thing.handle(event, context)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"_aws"')]
+    assert len(records) == 1
+    assert records[0]['Resource'] == 'Thing'
+    for name in ('Invocation', 'Validate', 'Execute', 'ResponsePut'):
+        assert name in records[0]
+    assert records[0]['Invocation'] >= records[0]['Execute']
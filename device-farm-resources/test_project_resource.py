@@ -124,6 +124,8 @@ def test_handler_create(context, cf_endpoint, device_farm_endpoint):
     assert cf_endpoint.request_history[0].json()['Data']['Arn'] == TEST_PHYSICAL_RESOURCE_ID
     assert cf_endpoint.request_history[0].json()['Data']['ProjectId'] == TEST_PROJECT_ID
     assert cf_endpoint.request_history[0].json()['Data']['TopDevicesDevicePoolArn'] == TEST_TOP_DEVICES_ARN
+    assert cf_endpoint.request_history[0].json()['Data']['CuratedPool.TopDevices.Arn'] == TEST_TOP_DEVICES_ARN
+    assert cf_endpoint.request_history[0].json()['Data']['CuratedPool.FlopDevices.Arn'] == 'arn:other'
     device_farm_endpoint.create_project.assert_called_with(name=TEST_PROJECT_NAME)
     device_farm_endpoint.update_project.assert_not_called()
     device_farm_endpoint.get_paginator.assert_called_with('list_device_pools')
@@ -276,3 +278,91 @@ def test_handler_delete_fails(context, cf_endpoint, device_farm_endpoint):
     device_farm_endpoint.create_project.assert_not_called()
     device_farm_endpoint.update_project.assert_not_called()
     device_farm_endpoint.delete_project.assert_called_with(arn=TEST_PHYSICAL_RESOURCE_ID)
+
+
+def test_handler_update_uses_cached_curated_pools(context, cf_endpoint, device_farm_endpoint):
+    create_event = {
+        'RequestType': 'Create',
+        'LogicalResourceId': 'DeviceFarm',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': {
+            'ProjectName': TEST_PROJECT_NAME,
+        }
+    }
+    update_event = dict(create_event, RequestType='Update', RequestId='5678',
+                        PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID)
+
+    project_resource.lambda_handler(create_event, context)
+    project_resource.lambda_handler(update_event, context)
+
+    assert len(cf_endpoint.request_history) == 2
+    assert cf_endpoint.request_history[1].json()['Status'] == 'SUCCESS'
+    assert cf_endpoint.request_history[1].json()['Data']['TopDevicesDevicePoolArn'] == TEST_TOP_DEVICES_ARN
+    assert device_farm_endpoint.get_paginator().paginate.call_count == 1
+    assert project_resource.curated_pool_cache.stats().hits == 1
+
+
+def test_handler_delete_invalidates_curated_pool_cache(context, cf_endpoint, device_farm_endpoint):
+    project_resource.curated_pool_cache.set(TEST_PHYSICAL_RESOURCE_ID, {'Top Devices': 'arn:stale'})
+    event = {
+        'RequestType': 'Delete',
+        'LogicalResourceId': 'DeviceFarm',
+        'PhysicalResourceId': TEST_PHYSICAL_RESOURCE_ID,
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': {
+            'ProjectName': TEST_PROJECT_NAME,
+        }
+    }
+
+    project_resource.lambda_handler(event, context)
+
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    device_farm_endpoint.get_paginator.assert_not_called()
+    assert project_resource.curated_pool_cache.stats().hits == 0
+    assert project_resource.curated_pool_cache.get_or_load(TEST_PHYSICAL_RESOURCE_ID, lambda: None) is None
+
+
+def test_get_curated_device_pool_data():
+    data = project_resource.get_curated_device_pool_data({
+        'Top Devices': 'arn:top',
+        'Top-Devices': 'arn:duplicate',
+        'Android 9+': 'arn:android',
+    })
+
+    assert data == {
+        'CuratedPool.TopDevices.Arn': 'arn:top',
+        'CuratedPool.Android9.Arn': 'arn:android',
+    }
+
+
+def test_handler_update_unchanged_properties(context, cf_endpoint, device_farm_endpoint):
+    project_resource.curated_pool_cache.set(TEST_PHYSICAL_RESOURCE_ID, {'Top Devices': TEST_TOP_DEVICES_ARN})
+    event = {
+        'RequestType': 'Update',
+        'LogicalResourceId': 'DeviceFarm',
+        'PhysicalResourceId': TEST_PHYSICAL_RESOURCE_ID,
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': {
+            'ServiceToken': 'arn:new-function',
+            'ProjectName': TEST_PROJECT_NAME,
+        },
+        'OldResourceProperties': {
+            'ServiceToken': 'arn:old-function',
+            'ProjectName': TEST_PROJECT_NAME,
+        },
+    }
+
+    project_resource.lambda_handler(event, context)
+
+    assert len(cf_endpoint.request_history) == 1
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+    assert cf_endpoint.request_history[0].json()['Data']['Arn'] == TEST_PHYSICAL_RESOURCE_ID
+    assert cf_endpoint.request_history[0].json()['Data']['TopDevicesDevicePoolArn'] == TEST_TOP_DEVICES_ARN
+    device_farm_endpoint.update_project.assert_not_called()
+    device_farm_endpoint.get_paginator.assert_not_called()
@@ -0,0 +1,145 @@
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from device_farm import clients, deadline, rate_limit
+
+
+def _throttling_error():
+    return ClientError({'Error': {'Code': 'LimitExceededException', 'Message': 'Slow down'}}, 'CreateDevicePool')
+
+
+def test_token_bucket_allows_burst_then_paces(clock):
+    bucket = rate_limit.TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(4)]
+
+    assert waits == [0, 0, 0.5, 0.5]
+    assert clock.now == 1001.0
+    assert bucket.stats() == rate_limit.LimiterStats(rate=2, calls=4, throttles=0, wait_time=1.0)
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = rate_limit.TokenBucket(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 10
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+
+
+def test_token_bucket_does_not_wait_past_deadline(clock):
+    bucket = rate_limit.TokenBucket(rate=1, burst=1, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+
+    with deadline.active(deadline.Deadline(1.5, safety_margin=1, clock=clock)), \
+            pytest.raises(deadline.DeadlineExceeded):
+        bucket.acquire()
+
+    assert clock.now == 1001.0
+    # the caller that gave up did not keep its place in the queue
+    clock.now += 0.5
+    assert bucket.acquire() == 0.5
+    assert bucket.stats().calls == 3
+
+
+def test_token_bucket_adapts_rate(clock):
+    bucket = rate_limit.TokenBucket(rate=4, clock=clock, sleep=clock.sleep)
+
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 1
+    assert bucket.throttles == 2
+    for _ in range(100):
+        bucket.on_throttle()
+    assert bucket.rate == bucket.min_rate == 0.25
+    for _ in range(1000):
+        bucket.on_success()
+    # recovery stops at the configured rate
+    assert bucket.rate == bucket.max_rate == 4
+
+
+def test_token_bucket_max_rate_allows_higher_rate(clock):
+    bucket = rate_limit.TokenBucket(rate=4, max_rate=6, clock=clock, sleep=clock.sleep)
+
+    for _ in range(1000):
+        bucket.on_success()
+    assert bucket.rate == 6
+
+
+def test_limiter_uses_rate_per_operation(clock):
+    limiter = rate_limit.RateLimiter({'create_device_pool': 1}, default_rate=5, clock=clock, sleep=clock.sleep)
+
+    assert limiter.bucket('create_device_pool').rate == 1
+    assert limiter.bucket('list_device_pools').rate == 5
+    assert limiter.bucket('list_device_pools') is limiter.bucket('list_device_pools')
+
+
+def test_limiter_counts_throttles(clock):
+    limiter = rate_limit.RateLimiter({'create_device_pool': 4}, clock=clock, sleep=clock.sleep)
+    operation = MagicMock(side_effect=[_throttling_error(), ValueError('other'), 'ok'])
+
+    with pytest.raises(ClientError):
+        limiter.call('create_device_pool', operation)
+    with pytest.raises(ValueError):
+        limiter.call('create_device_pool', operation)
+    assert limiter.call('create_device_pool', operation, name='pool') == 'ok'
+
+    operation.assert_called_with(name='pool')
+    stats = limiter.stats()['create_device_pool']
+    assert stats.calls == 3
+    assert stats.throttles == 1
+    # the rate was halved to 2/s, both calls after the throttle wait
+    assert stats.wait_time == 1.0
+
+
+def test_rate_limited_client_limits_calls_and_pages(clock):
+    limiter = rate_limit.RateLimiter({}, default_rate=1, clock=clock, sleep=clock.sleep)
+    client = MagicMock()
+    client.get_paginator.return_value.paginate.return_value = [{'page': 1}, {'page': 2}]
+    limited = rate_limit.RateLimitedClient(client, limiter)
+
+    limited.create_device_pool(name='pool')
+    pages = list(limited.get_paginator('list_device_pools').paginate(arn='arn'))
+
+    client.create_device_pool.assert_called_once_with(name='pool')
+    client.get_paginator.return_value.paginate.assert_called_once_with(arn='arn')
+    assert pages == [{'page': 1}, {'page': 2}]
+    stats = limiter.stats()
+    assert stats['create_device_pool'].calls == 1
+    # two pages and the call that finds the end
+    assert stats['list_device_pools'].calls == 3
+    assert limited.can_paginate is client.can_paginate
+
+
+def test_parse_rates():
+    assert rate_limit.parse_rates('create_device_pool=2, list_device_pools=5.5,') == {
+        'create_device_pool': 2,
+        'list_device_pools': 5.5,
+    }
+    assert rate_limit.parse_rates('') == {}
+
+
+def test_get_limiter_reads_rates(monkeypatch):
+    monkeypatch.setenv(rate_limit.RATE_LIMITS_VARIABLE, 'create_device_pool=1')
+
+    limiter = rate_limit.get_limiter()
+
+    assert limiter.rates['create_device_pool'] == 1
+    assert limiter.rates['delete_project'] == rate_limit.DEFAULT_RATES['delete_project']
+
+
+def test_device_farm_client_is_rate_limited(monkeypatch):
+    boto3_client = MagicMock()
+    monkeypatch.setattr('boto3.client', MagicMock(return_value=boto3_client))
+
+    client = clients.get_device_farm_client()
+    client.list_projects()
+
+    assert isinstance(client, rate_limit.RateLimitedClient)
+    boto3_client.list_projects.assert_called_once_with()
+    assert rate_limit.stats()['list_projects'].calls == 1
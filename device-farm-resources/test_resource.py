@@ -0,0 +1,169 @@
+from unittest.mock import MagicMock
+
+import pytest
+from requests_mock import Mocker
+
+from device_farm import resource
+
+TEST_RESPONSE_URL = 'http://example.com/response'
+TEST_PHYSICAL_RESOURCE_ID = 'arn:aws:devicefarm:us-west-2:account-id:thing:12345'
+
+
+def _event(request_type, resource_properties, **kwargs):
+    event = {
+        'RequestType': request_type,
+        'LogicalResourceId': 'Thing',
+        'RequestId': '1234',
+        'ResponseURL': TEST_RESPONSE_URL,
+        'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+        'ResourceProperties': resource_properties,
+    }
+    event.update(kwargs)
+    return event
+
+
+@pytest.fixture
+def context():
+    mock = MagicMock()
+    mock.log_stream_name = 'stream'
+    return mock
+
+
+@pytest.fixture
+def cf_endpoint():
+    with Mocker() as m:
+        yield m.put(TEST_RESPONSE_URL)
+
+
+@pytest.fixture
+def operations():
+    mock = MagicMock()
+    result = resource.Result(physical_resource_id=TEST_PHYSICAL_RESOURCE_ID, data={'Arn': TEST_PHYSICAL_RESOURCE_ID})
+    mock.create.return_value = result
+    mock.update.return_value = result
+    mock.delete.return_value = result
+    mock.unchanged.return_value = result
+    return mock
+
+
+@pytest.fixture
+def thing(operations):
+    return resource.CustomResource(
+        name='Thing',
+        properties=[
+            resource.Property('Name', required=True),
+            resource.Property('Count', default=1, parse=int),
+            resource.Property('Enabled', default=False, parse=resource.parse_bool),
+            resource.Property('Tags', validate=lambda tags: [] if isinstance(tags, list) else ['must be a list']),
+        ],
+        create=operations.create,
+        update=operations.update,
+        delete=operations.delete,
+        unchanged=operations.unchanged,
+    )
+
+
+def test_parse_applies_defaults_and_parsers(thing):
+    properties = thing.parse({'Name': 'a', 'Count': '3', 'Enabled': 'True', 'ServiceToken': 'arn'})
+
+    assert properties == {'Name': 'a', 'Count': 3, 'Enabled': True, 'Tags': None}
+
+
+@pytest.mark.parametrize('resource_properties,expected_reason', [
+    ({}, 'Required property Name not set'),
+    ({'Name': 'a', 'Foo': 'foo', 'Bar': 'bar'}, 'Unknown properties found: Foo, Bar'),
+    ({'Name': 'a', 'Count': 'many', 'Tags': 'a'},
+     "Invalid Count: invalid literal for int() with base 10: 'many'; Invalid Tags: must be a list"),
+])
+def test_handle_invalid_properties(resource_properties, expected_reason, thing, operations, context, cf_endpoint):
+    thing.handle(_event('Create', resource_properties), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == expected_reason
+    assert response['PhysicalResourceId'] == 'ResourceNotCreated'
+    operations.create.assert_not_called()
+
+
+def test_handle_invalid_properties_on_update_keeps_physical_resource_id(thing, context, cf_endpoint):
+    thing.handle(_event('Update', {}, PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'FAILED'
+    assert response['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+
+
+def test_handle_create(thing, operations, context, cf_endpoint):
+    thing.handle(_event('Create', {'Name': 'a', 'Count': '2'}), context)
+
+    request = operations.create.call_args[0][0]
+    assert request.request_type == 'Create'
+    assert request['Count'] == 2
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+    assert response['Data'] == {'Arn': TEST_PHYSICAL_RESOURCE_ID}
+
+
+def test_handle_create_without_data(thing, operations, context, cf_endpoint):
+    operations.create.return_value = resource.Result(physical_resource_id=TEST_PHYSICAL_RESOURCE_ID)
+
+    thing.handle(_event('Create', {'Name': 'a'}), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'SUCCESS'
+    assert response['Data'] == {}
+    # no mutable default shared between results
+    assert resource.Result(physical_resource_id='a').data is None
+
+
+def test_handle_update_unchanged_properties(thing, operations, context, cf_endpoint):
+    thing.handle(_event('Update', {'Name': 'a'}, PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID,
+                        OldResourceProperties={'Name': 'a'}), context)
+
+    operations.unchanged.assert_called_once()
+    operations.update.assert_not_called()
+    assert cf_endpoint.request_history[0].json()['Status'] == 'SUCCESS'
+
+
+def test_handle_update_changed_properties(thing, operations, context, cf_endpoint):
+    thing.handle(_event('Update', {'Name': 'b'}, PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID,
+                        OldResourceProperties={'Name': 'a'}), context)
+
+    operations.update.assert_called_once()
+    operations.unchanged.assert_not_called()
+
+
+def test_handle_delete_not_created(thing, operations, context, cf_endpoint):
+    thing.handle(_event('Delete', {'Name': 'a'}, PhysicalResourceId='ResourceNotCreated'), context)
+
+    operations.delete.assert_not_called()
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'SUCCESS'
+    assert response['PhysicalResourceId'] == 'ResourceNotCreated'
+
+
+def test_handle_operation_fails(thing, operations, context, cf_endpoint):
+    operations.delete.side_effect = Exception('This went wrong')
+
+    thing.handle(_event('Delete', {'Name': 'a'}, PhysicalResourceId=TEST_PHYSICAL_RESOURCE_ID), context)
+
+    response = cf_endpoint.request_history[0].json()
+    assert response['Status'] == 'FAILED'
+    assert response['Reason'] == 'This went wrong'
+    assert response['PhysicalResourceId'] == TEST_PHYSICAL_RESOURCE_ID
+
+
+def test_handle_optional_data_is_fitted(thing, operations, context, cf_endpoint):
+    operations.create.return_value = resource.Result(
+        physical_resource_id=TEST_PHYSICAL_RESOURCE_ID,
+        data={'Arn': TEST_PHYSICAL_RESOURCE_ID},
+        optional_data={f'Key{index:03}': 'x' * 100 for index in range(100)},
+    )
+
+    thing.handle(_event('Create', {'Name': 'a'}), context)
+
+    data = cf_endpoint.request_history[0].json()['Data']
+    assert data['Arn'] == TEST_PHYSICAL_RESOURCE_ID
+    assert 'Key000' in data
+    assert 'Key099' not in data
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from device_farm import rule_engine
+
+TEST_DEVICES = [
+    {
+        'arn': 'arn:device:pixel',
+        'platform': 'ANDROID',
+        'formFactor': 'PHONE',
+        'manufacturer': 'Google',
+        'model': 'Google Pixel 3',
+        'os': '10',
+        'availability': 'HIGHLY_AVAILABLE',
+        'fleetType': 'PUBLIC',
+        'remoteAccessEnabled': True,
+        'remoteDebugEnabled': False,
+    },
+    {
+        'arn': 'arn:device:galaxy-tab',
+        'platform': 'ANDROID',
+        'formFactor': 'TABLET',
+        'manufacturer': 'Samsung',
+        'model': 'Galaxy Tab S4',
+        'os': '9.0',
+        'availability': 'AVAILABLE',
+        'fleetType': 'PUBLIC',
+        'remoteAccessEnabled': False,
+        'remoteDebugEnabled': False,
+    },
+    {
+        'arn': 'arn:device:iphone',
+        'platform': 'IOS',
+        'formFactor': 'PHONE',
+        'manufacturer': 'Apple',
+        'model': 'Apple iPhone XR',
+        'os': '12.4.1',
+        'availability': 'BUSY',
+        'fleetType': 'PRIVATE',
+        'remoteAccessEnabled': True,
+        'remoteDebugEnabled': False,
+        'instances': [{'arn': 'arn:instance:1', 'labels': ['team-a', 'nightly']}],
+    },
+]
+
+
+@pytest.fixture
+def catalog():
+    return rule_engine.DeviceCatalog.from_devices(TEST_DEVICES)
+
+
+@pytest.mark.parametrize('rules,expected_arns', [
+    ([], ['arn:device:pixel', 'arn:device:galaxy-tab', 'arn:device:iphone']),
+    ([{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'}],
+     ['arn:device:pixel', 'arn:device:galaxy-tab']),
+    ([{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"android"'}],
+     ['arn:device:pixel', 'arn:device:galaxy-tab']),
+    ([{'attribute': 'REMOTE_ACCESS_ENABLED', 'operator': 'EQUALS', 'value': 'True'}],
+     ['arn:device:pixel', 'arn:device:iphone']),
+    ([{'attribute': 'MANUFACTURER', 'operator': 'IN', 'value': '["Apple", "Samsung"]'}],
+     ['arn:device:galaxy-tab', 'arn:device:iphone']),
+    ([{'attribute': 'FORM_FACTOR', 'operator': 'NOT_IN', 'value': '["TABLET"]'}],
+     ['arn:device:pixel', 'arn:device:iphone']),
+    ([{'attribute': 'MODEL', 'operator': 'CONTAINS', 'value': '"Pixel"'}], ['arn:device:pixel']),
+    ([{'attribute': 'INSTANCE_LABELS', 'operator': 'CONTAINS', 'value': '"nightly"'}], ['arn:device:iphone']),
+    ([{'attribute': 'INSTANCE_ARN', 'operator': 'EQUALS', 'value': '"arn:instance:1"'}], ['arn:device:iphone']),
+    ([{'attribute': 'OS_VERSION', 'operator': 'GREATER_THAN_OR_EQUALS', 'value': '"10"'}],
+     ['arn:device:pixel', 'arn:device:iphone']),
+    ([{'attribute': 'OS_VERSION', 'operator': 'LESS_THAN_OR_EQUALS', 'value': '"9"'}], ['arn:device:galaxy-tab']),
+    ([{'attribute': 'OS_VERSION', 'operator': 'GREATER_THAN', 'value': '"12.4"'}], ['arn:device:iphone']),
+    ([{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+      {'attribute': 'AVAILABILITY', 'operator': 'EQUALS', 'value': '"HIGHLY_AVAILABLE"'}], ['arn:device:pixel']),
+    ([{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"IOS"'},
+      {'attribute': 'FORM_FACTOR', 'operator': 'EQUALS', 'value': '"TABLET"'}], []),
+    ([{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"IOS"'},
+      {'attribute': 'APPIUM_VERSION', 'operator': 'CONTAINS', 'value': '"1.7"'}], ['arn:device:iphone']),
+])
+def test_evaluate(catalog, rules, expected_arns):
+    result = catalog.evaluate(rules)
+
+    assert result.arns == expected_arns
+    assert result.total == result.count == len(expected_arns)
+
+
+def test_evaluate_respects_max_devices(catalog):
+    result = catalog.evaluate([{'attribute': 'FLEET_TYPE', 'operator': 'EQUALS', 'value': '"PUBLIC"'}], max_devices='1')
+
+    assert result.total == 2
+    assert result.count == 1
+    assert result.arns == ['arn:device:pixel']
+
+
+def test_evaluate_large_catalog():
+    devices = [dict(TEST_DEVICES[i % 3], arn=f'arn:device:{i}', model=f'Model {i % 500}') for i in range(30000)]
+    catalog = rule_engine.DeviceCatalog.from_devices(devices)
+    rules = [
+        {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'},
+        {'attribute': 'OS_VERSION', 'operator': 'GREATER_THAN_OR_EQUALS', 'value': '"9"'},
+        {'attribute': 'MODEL', 'operator': 'CONTAINS', 'value': '"Model 1"'},
+    ]
+
+    start = time.perf_counter()
+    result = catalog.evaluate(rules, max_devices=10)
+    elapsed = time.perf_counter() - start
+
+    assert result.total == sum(1 for i in range(30000) if i % 3 != 2 and str(i % 500).startswith('1'))
+    assert result.count == 10
+    assert elapsed < 0.1
+
@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+
+from device_farm import run_poller
+from device_farm_testing import fakes
+
+TEST_RULES = [{'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'}]
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.steps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # the devices make progress while the poller sleeps
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.steps:
+            self.steps.pop(0)()
+
+
+@pytest.fixture
+def device_farm():
+    fake = fakes.FakeDeviceFarm()
+    with fakes.installed(fake):
+        yield fake
+
+
+@pytest.fixture
+def run_arn(device_farm):
+    project_arn = device_farm.create_project(name='project')['project']['arn']
+    pool_arn = device_farm.create_device_pool(projectArn=project_arn, name='pool', rules=TEST_RULES)['devicePool']['arn']
+    return device_farm.schedule_run(projectArn=project_arn, devicePoolArn=pool_arn,
+                                    test={'type': 'BUILTIN_FUZZ'})['run']['arn']
+
+
+def complete_job(device_farm, job_arn, tests):
+    suite = device_farm.add_suite(job_arn, 'com.example.LoginTest', status='COMPLETED')
+    device_farm.add_suite(job_arn, 'Setup Suite', status='COMPLETED')
+    for name, seconds in tests.items():
+        started = datetime.datetime(2021, 1, 1, 12, 0, 0)
+        device_farm.add_test(suite['arn'], name, result='PASSED', started=started,
+                             stopped=started + datetime.timedelta(seconds=seconds))
+    device_farm.update(job_arn, status='COMPLETED', result='PASSED', counters={'total': len(tests)})
+
+
+def test_poller_streams_progress_until_runs_complete(device_farm, run_arn):
+    clock = Clock()
+    jobs = {}
+
+    def start_run():
+        device_farm.update(run_arn, status='RUNNING')
+        for device in ('Pixel 4', 'Galaxy S20'):
+            jobs[device] = device_farm.add_job(run_arn, device)['arn']
+
+    def nothing_changes():
+        pass
+
+    def complete_run():
+        complete_job(device_farm, jobs['Galaxy S20'], {'testLogin': 30, 'testLogout': 10})
+        device_farm.update(run_arn, status='COMPLETED', result='PASSED', counters={'total': 4, 'passed': 4})
+
+    clock.steps = [start_run, lambda: complete_job(device_farm, jobs['Pixel 4'], {'testLogin': 20}),
+                   nothing_changes, nothing_changes, complete_run]
+
+    events = list(run_poller.poll_runs([run_arn], min_interval=5, max_interval=60, clock=clock, sleep=clock.sleep))
+
+    assert [(event.kind, event.status, event.device) for event in events] == [
+        ('run', 'SCHEDULING', None),
+        ('run', 'RUNNING', None),
+        ('job', 'RUNNING', 'Pixel 4'),
+        ('job', 'RUNNING', 'Galaxy S20'),
+        ('job', 'COMPLETED', 'Pixel 4'),
+        ('job_completed', 'COMPLETED', 'Pixel 4'),
+        ('run', 'COMPLETED', None),
+        ('job', 'COMPLETED', 'Galaxy S20'),
+        ('job_completed', 'COMPLETED', 'Galaxy S20'),
+        ('run_completed', 'COMPLETED', None),
+    ]
+    assert events[-1].result == 'PASSED'
+    assert events[-1].counters == {'total': 4, 'passed': 4}
+    # jobs are listed once the run started, completed jobs are fetched once
+    assert device_farm.calls['list_jobs'] == 5
+    assert device_farm.calls['list_suites'] == 2
+    # back to the minimum after a change, growing while nothing changes
+    assert clock.sleeps == [5, 5, 5, 7.5, 11.25]
+    assert run_poller.measured_test_durations(events) == {
+        'com.example.LoginTest#testLogin': 25.0,
+        'com.example.LoginTest#testLogout': 10.0,
+    }
+
+
+def test_poller_follows_expected_duration(device_farm, run_arn):
+    clock = Clock()
+    device_farm.update(run_arn, status='RUNNING')
+    clock.steps = [lambda: None] * 3 + [lambda: device_farm.update(run_arn, status='COMPLETED', result='PASSED')]
+
+    poller = run_poller.RunPoller([run_arn], min_interval=5, max_interval=300, expected_seconds={run_arn: 400},
+                                  clock=clock, sleep=clock.sleep)
+    list(poller.poll())
+
+    # half of the expected remaining time, then polls closely once the run is overdue
+    assert clock.sleeps == [200, 100, 50, 25]
+    assert poller.polls == 5
+
+
+def test_poller_times_out(device_farm, run_arn):
+    clock = Clock()
+
+    with pytest.raises(TimeoutError, match='1 runs still running'):
+        list(run_poller.poll_runs([run_arn], min_interval=10, max_interval=10, timeout=25, clock=clock,
+                                  sleep=clock.sleep))
+
+    assert clock.sleeps == [10, 10]
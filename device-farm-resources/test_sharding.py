@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from device_farm import sharding
+from device_farm_testing import fakes
+
+RECORDED_DURATIONS = {
+    'com.example.LoginTest#testLogin': 120.0,
+    'com.example.LoginTest#testLogout': 30.0,
+    'com.example.CartTest#testAdd': 90.0,
+    'com.example.CartTest#testRemove': 60.0,
+    'com.example.CheckoutTest#testPay': 80.0,
+    'com.example.CheckoutTest#testRefund': 50.0,
+    'com.example.SearchTest#testSearch': 40.0,
+}
+
+
+@pytest.fixture
+def durations_file(tmp_path):
+    path = tmp_path / 'durations.json'
+    path.write_text(json.dumps(RECORDED_DURATIONS))
+    return str(path)
+
+
+def test_plan_shards_balances_recorded_durations(durations_file):
+    durations = sharding.load_durations(durations_file)
+
+    shards = sharding.plan_shards(list(RECORDED_DURATIONS), durations, 3)
+
+    # LPT is within 4/3 of the optimal makespan, 160s here
+    assert [shard.estimated_seconds for shard in shards] == [160, 170, 140]
+    assert shards[0].tests == ['com.example.LoginTest#testLogin', 'com.example.SearchTest#testSearch']
+    assert sorted(test for shard in shards for test in shard.tests) == sorted(RECORDED_DURATIONS)
+    assert shards[0].filter == 'com.example.LoginTest#testLogin,com.example.SearchTest#testSearch'
+
+
+def test_plan_shards_estimates_unknown_tests():
+    shards = sharding.plan_shards(['a', 'b', 'new', 'new'], {'a': 10, 'b': 30}, 2)
+
+    # the median of the recorded durations
+    assert sorted(shard.estimated_seconds for shard in shards) == [30, 30]
+    assert sorted(shard.tests for shard in shards) == [['a', 'new'], ['b']]
+
+
+def test_plan_shards_without_enough_tests():
+    shards = sharding.plan_shards(['a', 'b'], {}, 5)
+
+    assert [shard.tests for shard in shards] == [['a'], ['b']]
+    assert shards[0].estimated_seconds == sharding.DEFAULT_TEST_DURATION
+    with pytest.raises(ValueError, match='Invalid shard count: 0'):
+        sharding.plan_shards(['a'], {}, 0)
+
+
+def test_update_and_save_durations(tmp_path):
+    durations = sharding.update_durations({'a': 10.0, 'b': 20.0}, {'a': 20.0, 'c': 5.0})
+    path = str(tmp_path / 'durations.json')
+
+    sharding.save_durations(path, durations)
+
+    assert sharding.load_durations(path) == {'a': 15.0, 'b': 20.0, 'c': 5.0}
+    assert sharding.load_durations(str(tmp_path / 'missing.json')) == {}
+
+
+def test_schedule_and_merge_shards():
+    device_farm = fakes.FakeDeviceFarm(processing_polls=0)
+    with fakes.installed(device_farm):
+        project_arn = device_farm.create_project(name='project')['project']['arn']
+        app_arn, test_package_arn = [
+            device_farm.create_upload(projectArn=project_arn, name=name, type=upload_type)['upload']['arn']
+            for name, upload_type in (('app.apk', 'ANDROID_APP'), ('tests.apk', 'INSTRUMENTATION_TEST_PACKAGE'))]
+        for upload_arn in (app_arn, test_package_arn):
+            device_farm.uploads[upload_arn]['status'] = 'SUCCEEDED'
+        pool_arns = [device_farm.create_device_pool(projectArn=project_arn, name=name, rules=[
+            {'attribute': 'PLATFORM', 'operator': 'EQUALS', 'value': '"ANDROID"'}])['devicePool']['arn']
+            for name in ('phones', 'tablets')]
+        shards = sharding.plan_shards(list(RECORDED_DURATIONS), RECORDED_DURATIONS, 3)
+
+        shard_runs = sharding.schedule_shards(project_arn, app_arn, test_package_arn, pool_arns, shards)
+        running = sharding.merge_results(shard_runs)
+        for index, shard_run in enumerate(shard_runs):
+            device_farm.complete_run(shard_run.run_arn, result='FAILED' if index == 4 else 'PASSED',
+                                     counters={'total': 3, 'passed': 2 if index == 4 else 3,
+                                               'failed': 1 if index == 4 else 0})
+        merged = sharding.merge_results(shard_runs)
+
+    assert len(shard_runs) == 6
+    scheduled = device_farm.runs[shard_runs[0].run_arn]
+    assert scheduled['name'] == 'Instrumentation shard 1/3'
+    assert scheduled['test'] == {'type': 'INSTRUMENTATION', 'testPackageArn': test_package_arn,
+                                 'filter': shards[0].filter}
+    assert {shard_run.device_pool_arn for shard_run in shard_runs} == set(pool_arns)
+    assert (running.status, running.result) == ('RUNNING', 'PENDING')
+    assert (merged.status, merged.result) == ('COMPLETED', 'FAILED')
+    assert merged.counters['total'] == 18
+    assert merged.counters['failed'] == 1
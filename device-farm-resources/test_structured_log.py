@@ -0,0 +1,98 @@
+import json
+import logging
+from unittest.mock import MagicMock
+
+from device_farm import structured_log
+
+TEST_EVENT = {
+    'RequestType': 'Create',
+    'LogicalResourceId': 'DevicePools',
+    'RequestId': '1234',
+    'ResponseURL': 'https://cloudformation-custom-resource-response.s3.amazonaws.com/signed?X-Amz-Signature=secret',
+    'StackId': 'arn:aws:cloudformation:us-east-2:namespace:stack/stack-name/guid',
+    'ResourceProperties': {'ProjectArn': 'arn:aws:devicefarm:us-west-2:account-id:project:12345'},
+}
+
+
+def test_summarize_redacts_response_url():
+    summary = structured_log.summarize(TEST_EVENT)
+
+    assert summary['ResponseURL'] == structured_log.REDACTED
+    assert summary['ResourceProperties'] == TEST_EVENT['ResourceProperties']
+    assert 'secret' not in json.dumps(summary)
+
+
+def test_redact_urls_removes_query_strings():
+    text = ("HTTPSConnectionPool(host='example.com', port=443): Max retries exceeded with url: "
+            "/response?AWSAccessKeyId=AKIA&Expires=1&Signature=SECRETSIG (Caused by timeout)")
+
+    assert structured_log.redact_urls(text) == (
+        "HTTPSConnectionPool(host='example.com', port=443): Max retries exceeded with url: "
+        "/response?<redacted> (Caused by timeout)")
+    assert structured_log.redact_urls('Why? No idea') == 'Why? No idea'
+
+
+def test_summarize_redacts_signed_urls_in_strings():
+    summary = structured_log.summarize({'Reason': f'Upload failed: {TEST_EVENT["ResponseURL"]}'})
+
+    assert summary == {'Reason': 'Upload failed: https://cloudformation-custom-resource-response.s3.amazonaws.com/'
+                                 'signed?<redacted>'}
+
+
+def test_summarize_truncates_strings_and_collections():
+    summary = structured_log.summarize({
+        'Description': 'x' * 1000,
+        'Rules': [{'attribute': 'ARN', 'value': str(index)} for index in range(50)],
+        'Nested': {'a': {'b': {'c': 'd'}}},
+    }, max_string_length=10, max_items=3, max_depth=2)
+
+    assert summary['Description'] == 'xxxxxxxxxx... (1000 characters)'
+    assert summary['Rules'] == ['<2 keys>', '<2 keys>', '<2 keys>', '... 47 more items']
+    assert summary['Nested'] == {'a': '<1 keys>'}
+
+
+def test_summarize_is_bounded_for_large_payloads():
+    event = dict(TEST_EVENT, ResourceProperties={
+        'DevicePools': [{'Name': str(index), 'Rules': [{'attribute': 'ARN', 'value': 'x' * 10000}] * 100}
+                        for index in range(1000)],
+    })
+
+    rendered = str(structured_log.Message('Handling request', payload=event))
+
+    assert len(rendered) < 20000
+
+
+def test_message_is_formatted_lazily(caplog):
+    payload = MagicMock()
+    logger = logging.getLogger('device_farm.test')
+    logger.setLevel(logging.WARNING)
+
+    logger.info(structured_log.Message('Handling request', payload=payload))
+
+    payload.__str__.assert_not_called()
+    assert caplog.records == []
+
+
+def test_message_renders_json(caplog):
+    logger = logging.getLogger('device_farm.test')
+    logger.setLevel(logging.INFO)
+
+    with caplog.at_level(logging.INFO, logger='device_farm.test'):
+        logger.info(structured_log.Message('Handling request', payload=TEST_EVENT,
+                                           **structured_log.request_fields(TEST_EVENT)))
+
+    record = json.loads(caplog.records[0].getMessage())
+    assert record['message'] == 'Handling request'
+    assert record['request_type'] == 'Create'
+    assert record['request_id'] == '1234'
+    assert record['logical_resource_id'] == 'DevicePools'
+    assert record['payload']['ResponseURL'] == structured_log.REDACTED
+
+
+def test_payload_is_sampled(monkeypatch):
+    monkeypatch.setenv(structured_log.PAYLOAD_SAMPLE_RATE_VARIABLE, '0.1')
+    monkeypatch.setattr(structured_log.random, 'random', MagicMock(side_effect=[0.5, 0.05]))
+    message = structured_log.Message('Handling request', payload=TEST_EVENT, request_id='1234')
+
+    assert message.to_dict() == {'message': 'Handling request', 'request_id': '1234', 'payload': '<not sampled>'}
+    assert message.to_dict()['payload']['RequestId'] == '1234'
@@ -0,0 +1,177 @@
+import hashlib
+import tracemalloc
+
+import pytest
+import requests
+
+from device_farm import upload
+from device_farm_testing import fakes
+
+TEST_UPLOAD_TYPE = 'ANDROID_APP'
+
+
+@pytest.fixture
+def device_farm(monkeypatch):
+    fake = fakes.FakeDeviceFarm(processing_polls=2)
+    with fakes.installed(fake):
+        yield fake
+
+
+@pytest.fixture
+def project_arn(device_farm):
+    return device_farm.create_project(name='project')['project']['arn']
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(upload.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+@pytest.fixture
+def apk(tmp_path):
+    path = tmp_path / 'app-debug.apk'
+    path.write_bytes(bytes(range(256)) * 4096 + b'end')
+    return path
+
+
+def test_upload_file(device_farm, project_arn, apk, sleeps):
+    result = upload.upload_file(project_arn, str(apk), TEST_UPLOAD_TYPE, chunk_size=64 * 1024)
+
+    assert result.status == 'SUCCEEDED'
+    assert result.size == apk.stat().st_size
+    assert result.throughput > 0
+    stored = device_farm.uploads[result.arn]
+    assert stored['name'] == 'app-debug.apk'
+    assert stored['type'] == TEST_UPLOAD_TYPE
+    assert stored['sha256'] == hashlib.sha256(apk.read_bytes()).hexdigest()
+    assert device_farm.storage.max_chunk_size == 64 * 1024
+    # polled while processing, with a growing interval
+    assert sleeps == [1, 2]
+
+
+def test_upload_streams_large_files(device_farm, project_arn, tmp_path, sleeps):
+    path = tmp_path / 'tests.apk'
+    with open(str(path), 'wb') as f:
+        f.truncate(64 * 1024 * 1024)
+
+    tracemalloc.start()
+    try:
+        result = upload.upload_file(project_arn, str(path), 'INSTRUMENTATION_TEST_PACKAGE')
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result.size == 64 * 1024 * 1024
+    assert peak < 8 * upload.CHUNK_SIZE
+
+
+def test_upload_empty_file(device_farm, project_arn, tmp_path, sleeps):
+    path = tmp_path / 'empty.apk'
+    path.write_bytes(b'')
+
+    result = upload.upload_file(project_arn, str(path), TEST_UPLOAD_TYPE)
+
+    assert result.size == 0
+    assert device_farm.uploads[result.arn]['sha256'] == hashlib.sha256(b'').hexdigest()
+
+
+def test_upload_retries_server_errors(device_farm, project_arn, apk, sleeps):
+    device_farm.storage.fail_next = 2
+
+    result = upload.upload_file(project_arn, str(apk), TEST_UPLOAD_TYPE)
+
+    assert result.status == 'SUCCEEDED'
+    assert device_farm.storage.attempts == 3
+
+
+def test_upload_gives_up_after_max_attempts(device_farm, project_arn, apk, sleeps):
+    device_farm.storage.fail_next = 3
+
+    with pytest.raises(upload.UploadError, match='HTTP 503'):
+        upload.upload_file(project_arn, str(apk), TEST_UPLOAD_TYPE)
+
+
+def test_signed_url_is_not_raised_or_logged(apk, sleeps, caplog, requests_mock):
+    signed_url = 'https://example.com/uploads/app.apk?X-Amz-Credential=AKIA&X-Amz-Signature=SECRETSIG'
+    requests_mock.put(signed_url, exc=requests.Timeout(
+        f"HTTPSConnectionPool(host='example.com', port=443): Read timed out. "
+        f"(url: {signed_url[len('https://example.com'):]})"))
+
+    with pytest.raises(upload.UploadError) as e:
+        upload.put_file(signed_url, apk, 'application/octet-stream', max_attempts=2)
+
+    assert 'failed: Timeout' in str(e.value)
+    assert 'failed on attempt 1' in caplog.text
+    for text in (str(e.value), caplog.text):
+        assert 'X-Amz' not in text
+        assert 'AKIA' not in text
+
+
+def test_wait_for_upload_reports_processing_failure(device_farm, project_arn, apk, sleeps):
+    created = device_farm.create_upload(projectArn=project_arn, name='app.apk', type=TEST_UPLOAD_TYPE)['upload']
+    upload.put_file(created['url'], str(apk), 'application/octet-stream')
+    device_farm.fail_upload(created['arn'], 'The APK could not be parsed')
+
+    with pytest.raises(upload.UploadError, match='The APK could not be parsed'):
+        upload.wait_for_upload(device_farm, created['arn'])
+
+
+def test_wait_for_upload_times_out(device_farm, project_arn, sleeps):
+    created = device_farm.create_upload(projectArn=project_arn, name='app.apk', type=TEST_UPLOAD_TYPE)['upload']
+
+    with pytest.raises(upload.UploadError, match='still INITIALIZED'):
+        upload.wait_for_upload(device_farm, created['arn'], poll_interval=1, max_poll_interval=4, timeout=10)
+
+    assert sleeps == [1, 2, 4]
+
+
+def test_upload_file_once_reuses_unchanged_content(device_farm, project_arn, apk, sleeps):
+    first = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+    second = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+
+    assert not first.reused
+    assert second.reused
+    assert second.arn == first.arn
+    assert second.sha256 == first.sha256 == hashlib.sha256(apk.read_bytes()).hexdigest()
+    assert device_farm.uploads[first.arn]['name'] == f'{first.sha256}-app-debug.apk'
+    assert device_farm.calls['create_upload'] == 1
+    assert device_farm.storage.attempts == 1
+
+
+def test_upload_file_once_uploads_changed_content(device_farm, project_arn, apk, sleeps):
+    first = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+    apk.write_bytes(b'changed')
+    second = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+    test_package = upload.upload_file_once(project_arn, str(apk), 'INSTRUMENTATION_TEST_PACKAGE')
+
+    assert not second.reused
+    assert not test_package.reused
+    assert len({first.arn, second.arn, test_package.arn}) == 3
+
+
+def test_upload_file_once_rebuilds_index_from_device_farm(device_farm, project_arn, apk, sleeps):
+    first = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+    # e.g. a retried pipeline running in a new container
+    upload.upload_index.clear()
+
+    second = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+
+    assert second.reused
+    assert second.arn == first.arn
+    # once for each time the index was loaded
+    assert device_farm.calls['list_uploads'] == 2
+
+
+def test_upload_file_once_skips_deleted_and_failed_uploads(device_farm, project_arn, apk, sleeps):
+    first = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+    device_farm.delete_upload(arn=first.arn)
+    second = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+    device_farm.fail_upload(second.arn, 'Expired')
+    third = upload.upload_file_once(project_arn, str(apk), TEST_UPLOAD_TYPE)
+
+    assert not second.reused
+    assert not third.reused
+    assert third.arn != second.arn
+    assert upload.upload_index.get_or_load(project_arn, dict)[f'{TEST_UPLOAD_TYPE}:{third.sha256}'] == third.arn